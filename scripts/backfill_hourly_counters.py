@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Rebuild the hourly per-author and per-domain counters from the stored submissions.
+
+The ingester keeps ``public.author_hourly_posts`` and ``public.domain_hourly_posts`` up to date for the submissions it
+stores, this is only needed once for submissions that were stored some other way (or before the counters existed).
+The counters are locked against the ingester while they are rebuilt, in one transaction. Run it with the bot's
+database:
+
+    GYROBOT_DATABASE_URL=postgresql://... python scripts/backfill_hourly_counters.py
+"""
+import os
+
+import psycopg
+
+SQL_REBUILD_COUNTERS = """
+LOCK TABLE public.author_hourly_posts, public.domain_hourly_posts IN SHARE ROW EXCLUSIVE MODE;
+DELETE FROM public.author_hourly_posts;
+DELETE FROM public.domain_hourly_posts;
+INSERT INTO public.author_hourly_posts (subreddit, author, hour, posts)
+SELECT lower(subreddit), author, date_trunc('hour', created), count(*)
+FROM public.submissions
+WHERE author IS NOT NULL
+GROUP BY 1, 2, 3;
+INSERT INTO public.domain_hourly_posts (subreddit, domain, hour, posts)
+SELECT lower(subreddit), domain, date_trunc('hour', created), count(*)
+FROM public.submissions
+WHERE domain IS NOT NULL
+GROUP BY 1, 2, 3;
+"""
+
+
+def main():
+    with psycopg.connect(os.environ['GYROBOT_DATABASE_URL']) as conn:
+        with conn.cursor() as cur:
+            cur.execute(SQL_REBUILD_COUNTERS)
+            cur.execute('SELECT (SELECT count(*) FROM public.author_hourly_posts), '
+                        '(SELECT count(*) FROM public.domain_hourly_posts)')
+            author_rows, domain_rows = cur.fetchone()
+    print(f'{author_rows} author and {domain_rows} domain hourly counters rebuilt')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Benchmark username and thread id extraction from command arguments.
+
+Compares the old ``extract_username`` (``re.match`` with pattern strings) with the compiled one, and thread ids
+extracted one argument at a time with the batch ``extract_real_thread_ids``. Share links are served from a primed
+in-memory cache, nothing is fetched from reddit. Run from the repository root:
+
+    python scripts/benchmark_extract.py [ARGUMENT_COUNT ...]
+"""
+import os
+import random
+import re
+import sys
+import time
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+os.environ.setdefault('SUBREDDIT_NAME', 'benchmark')  # commands.reddit refuses to load without it
+
+from commands.reddit import common  # noqa: E402
+
+ARGUMENT_COUNTS = [10, 1_000, 100_000]
+REPEAT = 5
+
+
+def old_extract_username(username):
+    if re.match(r'^\*.*\*$', username):
+        username = username[1:-1]  # Remove slack formatting
+    if re.match(r'^[a-zA-Z0-9_-]+$', username):
+        pass  # Already a valid username
+    elif m := re.match(common.REDDIT_USERNAME_PATTERN, username):
+        username = m.group('username')  # Extract username from reddit link
+    elif re.match(r'^u/[a-zA-Z0-9_-]+$', username):
+        username = username.split('/')[-1]  # Extract username from reddit link
+    else:
+        username = None  # Invalid username
+    return username
+
+
+def make_usernames(count: int, rng: random.Random) -> list:
+    forms = [
+        lambda name: name,
+        lambda name: f'*{name}*',
+        lambda name: f'u/{name}',
+        lambda name: f'<https://www.reddit.com/user/{name}|{name}>',
+        lambda name: f'<https://old.reddit.com/u/{name}/>',
+        lambda name: f'{name}!',
+    ]
+    return [rng.choice(forms)(f'user_{i}') for i in range(count)]
+
+
+def make_thread_ids(count: int, rng: random.Random) -> list:
+    forms = [
+        lambda tid: tid,
+        lambda tid: f'https://www.reddit.com/r/test/comments/{tid}/some_title/',
+        lambda tid: f'<https://old.reddit.com/r/test/comments/{tid}/some_title/>',
+        lambda tid: f'/r/test/comments/{tid}/',
+        lambda tid: f'https://www.reddit.com/r/test/s/{tid}',
+    ]
+    return [rng.choice(forms)(f'{i:x}') for i in range(count)]
+
+
+def prime_short_links(thread_ids: list):
+    now = time.time()
+    common._short_links = {
+        thread_id: {'url': f'https://www.reddit.com/r/test/comments/{thread_id.split("/")[-1]}/title/',
+                    'resolved': now}
+        for thread_id in thread_ids if common._is_short_link(thread_id)}
+
+
+def best_of(func) -> float:
+    number, _ = timeit.Timer(func).autorange()
+    return min(timeit.repeat(func, number=number, repeat=REPEAT)) / number
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or ARGUMENT_COUNTS
+    rng = random.Random(0)
+    print(f"{'Args':>8} {'Old names ms':>13} {'Names ms':>9} {'One by one ids ms':>18} {'Batch ids ms':>13}")
+    for count in counts:
+        usernames = make_usernames(count, rng)
+        thread_ids = make_thread_ids(count, rng)
+        prime_short_links(thread_ids)
+        old_names_ms = best_of(lambda: [old_extract_username(u) for u in usernames]) * 1000
+        names_ms = best_of(lambda: [common.extract_username(u) for u in usernames]) * 1000
+        one_by_one_ms = best_of(lambda: [common.extract_real_thread_id(t) for t in thread_ids]) * 1000
+        batch_ms = best_of(lambda: common.extract_real_thread_ids(thread_ids)) * 1000
+        assert [common.extract_real_thread_id(t) for t in thread_ids] == common.extract_real_thread_ids(thread_ids)
+        print(f'{count:>8} {old_names_ms:>13.2f} {names_ms:>9.2f} {one_by_one_ms:>18.2f} {batch_ms:>13.2f}')
+
+
+if __name__ == '__main__':
+    main()
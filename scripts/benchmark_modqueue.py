@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Benchmark 'modqueue grouped' on synthetic modqueues.
+
+Compares the old grouping (Counter over Redditor objects, full sort, string concatenation into blocks) with the
+snapshot's author index, ``top_authors`` and ``pack_sections``. Run from the repository root:
+
+    python scripts/benchmark_modqueue.py [QUEUE_SIZE ...]
+"""
+import collections
+import os
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+os.environ.setdefault('SUBREDDIT_NAME', 'benchmark')  # commands.reddit refuses to load without it
+
+from commands.reddit.modqueue_snapshot import ModqueueItem, ModqueueSnapshot, pack_sections, top_authors  # noqa: E402
+
+REDDIT_URL = 'https://www.reddit.com'
+QUEUE_SIZES = [1_000, 10_000, 50_000]
+REPEAT = 5
+
+
+class FakeRedditor:
+    """Hashes and compares like a PRAW Redditor: through the lower case name, every time"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+    def __hash__(self):
+        return hash(str(self).lower())
+
+    def __eq__(self, other):
+        return str(self).lower() == str(other).lower()
+
+
+def make_items(size: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    # a few heavy posters and a long tail of authors with one or two items, like a real queue
+    authors = [f'user_{i}' for i in range(size // 3)]
+    weights = [1 / (i + 1) for i in range(len(authors))]
+    names = rng.choices(authors, weights, k=size)
+    names[::50] = ['[deleted]'] * len(names[::50])
+    return [ModqueueItem(fullname=f't1_{i:x}', kind=rng.choice(('submission', 'comment')), author=name,
+                         created_utc=1_700_000_000 + rng.random() * 86400, permalink=f'/r/test/comments/{i:x}/',
+                         text='text', url=None)
+            for i, name in enumerate(names)]
+
+
+def old_grouped(items: list, redditors: dict) -> list:
+    grouped_step_1 = collections.Counter([redditors[mq.author] for mq in items])
+    grouped_step_2 = sorted(grouped_step_1.items(), key=lambda x: -x[1])
+    grouped_step_3 = [item for item in grouped_step_2 if item[1] > 1]
+    grouped_items = [f"{item[1]} items from <{REDDIT_URL}/u/{item[0]}|{item[0]}>" for item in grouped_step_3]
+    inner_text = ''
+    blocks = []
+    for item in grouped_items:
+        if len(inner_text) < 2000:
+            inner_text += item + '\n'
+        else:
+            blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": inner_text.strip('\n')}})
+            inner_text = ''
+    blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": inner_text}})
+    return blocks
+
+
+def new_grouped(snapshot: ModqueueSnapshot, limit: int = None) -> list:
+    grouped_items = [f"{count} items from <{REDDIT_URL}/u/{author}|{author}>"
+                     for author, count in top_authors(snapshot, limit)]
+    return list(pack_sections(grouped_items))
+
+
+def line_count(blocks: list) -> int:
+    return sum(len(block['text']['text'].strip('\n').splitlines()) for block in blocks)
+
+
+def best_of(func) -> float:
+    number, _ = timeit.Timer(func).autorange()
+    return min(timeit.repeat(func, number=number, repeat=REPEAT)) / number
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or QUEUE_SIZES
+    print(f"{'Items':>8} {'Authors':>8} {'Old ms':>9} {'Snapshot ms':>12} {'New ms':>9} {'Top 10 ms':>10} "
+          f"{'Old lost':>9} {'New lost':>9}")
+    for size in sizes:
+        items = make_items(size)
+        redditors = {name: FakeRedditor(name) for name in {item.author for item in items}}
+        snapshot = ModqueueSnapshot(items)
+        old_ms = best_of(lambda: old_grouped(items, redditors)) * 1000
+        # the poller builds the snapshot once per interval, every command reuses it
+        snapshot_ms = best_of(lambda: ModqueueSnapshot(items)) * 1000
+        new_ms = best_of(lambda: new_grouped(snapshot)) * 1000
+        top_ms = best_of(lambda: new_grouped(snapshot, 10)) * 1000
+        # lines the block packing dropped (the old grouping also listed [deleted], the new one doesn't)
+        old_lost = sum(count > 1 for count in collections.Counter(item.author for item in items).values()) - \
+            line_count(old_grouped(items, redditors))
+        new_lost = len(top_authors(snapshot)) - line_count(new_grouped(snapshot))
+        print(f'{size:>8} {len(redditors):>8} {old_ms:>9.2f} {snapshot_ms:>12.2f} {new_ms:>9.2f} {top_ms:>10.2f} '
+              f'{old_lost:>9} {new_lost:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Benchmark reading survey results from a synthetic table of a million answers.
+
+Creates a ``survey_benchmark`` schema with synthetic "Votes" and "Answers" tables in the PostgreSQL database at
+``BENCHMARK_DATABASE_URL`` and compares the old export (a connection and a ``regexp_split_to_array`` scan per
+question) with the grouped query behind ``full_replies``: counted from scratch, refreshed with no new votes, and
+streamed into a workbook. The schema is dropped afterwards. Run from the repository root:
+
+    BENCHMARK_DATABASE_URL=postgresql://... python scripts/benchmark_survey.py [ANSWER_COUNT]
+"""
+import datetime
+import io
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import psycopg
+import psycopg.conninfo
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+SCHEMA = 'survey_benchmark'
+DATABASE_URL = psycopg.conninfo.make_conninfo(os.environ['BENCHMARK_DATABASE_URL'], options=f'-c search_path={SCHEMA}')
+os.environ['QUESTIONNAIRE_DATABASE_URL'] = DATABASE_URL  # the survey module refuses to load without it
+os.environ.setdefault('SUBREDDIT_NAME', 'benchmark')  # and commands.reddit without a subreddit
+
+from commands.reddit import survey  # noqa: E402
+
+ANSWER_COUNT = 1_000_000
+QUESTION_COUNT = 60
+KINDS = ['radio', 'checkbox', 'scale-matrix', 'text', 'tree', 'radio']
+
+_SCHEMA = f"""
+DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;
+CREATE SCHEMA {SCHEMA};
+CREATE TABLE {SCHEMA}."Votes" (id INTEGER PRIMARY KEY, datestamp TIMESTAMP NOT NULL);
+CREATE TABLE {SCHEMA}."Answers" (id SERIAL PRIMARY KEY, vote_id INTEGER NOT NULL, code TEXT NOT NULL,
+                                 answer_value TEXT);
+"""
+
+# the per-question statements the export used before the grouped query
+SQL_SURVEY_PREFILLED_ANSWERS = r"""select answer[3] AS Code, answer_value as Answer, count(*) AS VoteCount
+from (select regexp_split_to_array(code, '_') AS answer_parts, *
+      from "Answers"
+      where  code = 'q_{0}' or code like 'q\_{0}\_%') AS dt(answer)
+group by 1, 2
+order by 3 desc"""
+SQL_SURVEY_TEXT = r"""select answer_value as Answer, count(*) AS VoteCount
+from "Answers"
+where code = 'q_{0}'
+group by 1
+order by 2 desc"""
+SQL_SURVEY_SCALE_MATRIX = """select answer[3] AS AnswerCode, answer_value AS AnswerValue, count(vote_id) AS VoteCount
+from (select regexp_split_to_array(code, '_') AS answer_parts, *
+      from "Answers"
+      where code like 'q\\_{0}\\_%') AS dt(answer)
+group by 1, 2
+order by 1, 3 desc"""
+
+
+def make_questions() -> list:
+    choices = {f'c{i}': f'Choice {i}' for i in range(1, 9)}
+    tree_choices = {code: {'title': title} for code, title in choices.items()}
+    tree_choices['c1']['choices'] = {'c9': {'title': 'Child'}}
+    questions = []
+    for i in range(QUESTION_COUNT):
+        kind = KINDS[i % len(KINDS)]
+        question = {'kind': kind, 'title': f'Question {i + 1}'}
+        if kind == 'tree':
+            question['choices'] = tree_choices
+        elif kind == 'scale-matrix':
+            question['choices'] = {str(value): f'Value {value}' for value in range(1, 6)}
+            question['lines'] = [f'Line {line}' for line in range(1, 6)]
+        elif kind != 'text':
+            question['choices'] = choices
+        questions.append(question)
+    return questions
+
+
+def vote_answers(questions: list, rng: random.Random):
+    """(code, answer value) of the answers of one vote"""
+    for question_id, question in enumerate(questions, start=1):
+        code = f'q_{question_id}'
+        if question['kind'] in ('radio', 'tree'):
+            yield code, rng.choice(list(question['choices']))
+        elif question['kind'] == 'checkbox':
+            for choice in rng.sample(list(question['choices']), 2):
+                yield f'{code}_{choice}', 'on'
+        elif question['kind'] == 'scale-matrix':
+            for line in range(1, len(question['lines']) + 1):
+                yield f'{code}_{line}', str(rng.randint(1, 5))
+        elif rng.random() < 0.3:
+            yield code, f'free text {rng.randint(1, 500)}'
+
+
+def create_tables(questions: list, answer_count: int) -> int:
+    rng = random.Random(0)
+    start = datetime.datetime(2026, 1, 1)
+    answers = 0
+    vote_id = 0
+    with psycopg.connect(DATABASE_URL) as conn:
+        with conn.cursor() as cur:
+            cur.execute(_SCHEMA)
+            with cur.copy('COPY "Answers" (vote_id, code, answer_value) FROM STDIN') as copy:
+                while answers < answer_count:
+                    vote_id += 1
+                    for code, answer_value in vote_answers(questions, rng):
+                        copy.write_row((vote_id, code, answer_value))
+                        answers += 1
+            with cur.copy('COPY "Votes" (id, datestamp) FROM STDIN') as copy:
+                for vote in range(1, vote_id + 1):
+                    copy.write_row((vote, start + datetime.timedelta(minutes=vote)))
+            cur.execute('ANALYZE "Votes"; ANALYZE "Answers"')
+    return answers
+
+
+def old_export(questions: list) -> int:
+    rows = 0
+    for question_id, question in enumerate(questions, start=1):
+        if question['kind'] in ('checktree', 'checkbox', 'tree', 'radio'):
+            sql = SQL_SURVEY_PREFILLED_ANSWERS
+        elif question['kind'] in ('text', 'textarea'):
+            sql = SQL_SURVEY_TEXT
+        else:
+            sql = SQL_SURVEY_SCALE_MATRIX
+        with psycopg.connect(DATABASE_URL) as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql.format(question_id))
+                rows += len(cur.fetchall())
+    return rows
+
+
+def timed(title: str, func):
+    started = time.perf_counter()
+    func()
+    print(f'{title:<45} {time.perf_counter() - started:>8.2f} s')
+
+
+def main():
+    answer_count = int(sys.argv[1]) if len(sys.argv) > 1 else ANSWER_COUNT
+    questions = make_questions()
+    questionnaire = survey.Questionnaire(questions)
+    started = time.perf_counter()
+    answers = create_tables(questions, answer_count)
+    print(f'{answers} answers to {QUESTION_COUNT} questions created in {time.perf_counter() - started:.1f} s')
+    try:
+        timed(f'old: {QUESTION_COUNT} connections and scans', lambda: old_export(questions))
+        timed('new: all questions, counted from scratch', lambda: survey._survey_all_questions(questionnaire))
+        timed('new: all questions, no new votes since', lambda: survey._survey_all_questions(questionnaire))
+        timed('new: workbook through server-side cursor',
+              lambda: survey._write_survey_workbook(questionnaire, io.BytesIO()))
+    finally:
+        with psycopg.connect(DATABASE_URL) as conn:
+            conn.execute(f'DROP SCHEMA {SCHEMA} CASCADE')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Profile the subreddit filter of 'nuke user' on a synthetic comment history.
+
+Compares the old filter (``c.subreddit.display_name.lower()`` against ``ctx.subreddit.display_name.lower()`` for every
+comment) with ``SubredditContext.is_own_item``. The comments are real PRAW objects built from listing data, nothing is
+fetched from reddit. Run from the repository root:
+
+    python scripts/profile_subreddit_filter.py [COMMENT_COUNT]
+"""
+import cProfile
+import pstats
+import random
+import sys
+import timeit
+from pathlib import Path
+
+import click
+import praw
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from commands.extended_context import ExtendedContext  # noqa: E402
+from subreddit_context import SubredditContext  # noqa: E402
+
+COMMENT_COUNT = 1_000
+SUBREDDIT_NAME = 'Europe'
+OTHER_SUBREDDITS = ['AskEurope', 'europe', 'greece', 'de', 'france', 'worldnews', 'EUROPE']
+REPEAT = 5
+
+
+def make_comments(reddit: praw.Reddit, count: int) -> list:
+    rng = random.Random(0)
+    comments = []
+    for i in range(count):
+        subreddit = rng.choice(OTHER_SUBREDDITS)
+        comments.append(praw.models.Comment(reddit, _data={
+            'id': f'{i:x}', 'name': f't1_{i:x}', 'author': 'some_user', 'body': 'text',
+            'subreddit': subreddit, 'subreddit_name_prefixed': f'r/{subreddit}',
+            'link_id': 't3_abc', 'parent_id': 't3_abc', 'banned_by': None,
+            'created_utc': 1_700_000_000 + i}))
+    return comments
+
+
+def old_filter(ctx: ExtendedContext, comments: list) -> int:
+    own = 0
+    for c in comments:
+        comment_subreddit_name = c.subreddit.display_name.lower()
+        if comment_subreddit_name != ctx.subreddit.display_name.lower():
+            continue
+        own += 1
+    return own
+
+
+def new_filter(ctx: ExtendedContext, comments: list) -> int:
+    own = 0
+    subreddit_context = ctx.subreddit_context
+    for c in comments:
+        if not subreddit_context.is_own_item(c):
+            continue
+        own += 1
+    return own
+
+
+def profile(title: str, func):
+    print(f'--- {title}')
+    profiler = cProfile.Profile()
+    profiler.runcall(func)
+    pstats.Stats(profiler).strip_dirs().sort_stats('tottime').print_stats(6)
+
+
+def best_of(func) -> float:
+    number, _ = timeit.Timer(func).autorange()
+    return min(timeit.repeat(func, number=number, repeat=REPEAT)) / number
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COMMENT_COUNT
+    reddit = praw.Reddit(client_id='profile', client_secret='profile', user_agent='profile',
+                         check_for_updates=False)
+    subreddit = reddit.subreddit(SUBREDDIT_NAME)
+    ctx = ExtendedContext(click.Command('nuke'), obj={
+        'subreddit': subreddit, 'subreddit_context': SubredditContext(subreddit, reddit)})
+    comments = make_comments(reddit, count)
+    assert old_filter(ctx, comments) == new_filter(ctx, comments)
+
+    profile('old: c.subreddit.display_name.lower()', lambda: old_filter(ctx, comments))
+    profile('new: SubredditContext.is_own_item', lambda: new_filter(ctx, comments))
+    old_ms = best_of(lambda: old_filter(ctx, comments)) * 1000
+    new_ms = best_of(lambda: new_filter(ctx, comments)) * 1000
+    print(f'{count} comments: old {old_ms:.3f} ms, new {new_ms:.3f} ms ({old_ms / new_ms:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -24,6 +24,7 @@ from bot_framework.praw_wrapper import praw_wrapper
 from bot_framework.yaml_wrapper import yaml
 from chat import get_chat_wrapper
 from chat.chat_wrapper import ChatWrapper, Conversation, Message
+from subreddit_context import SubredditContext
 
 locale.setlocale(locale.LC_ALL, os.environ.get('LOCALE', ''))
 
@@ -45,6 +46,7 @@ chat_obj: ChatWrapper
 reddit_session: praw.Reddit = None
 bot_reddit_session: praw.reddit.Reddit = None
 subreddit: praw.reddit.Subreddit = None
+subreddit_context: SubredditContext = None
 subreddit_name: str
 trigger_words: list
 shortcut_words: dict
@@ -55,7 +57,7 @@ executor: concurrent.futures.ThreadPoolExecutor
 
 def init():
     global chat_obj, logger, subreddit_name, shortcut_words, bot_name, trigger_words, executor
-    global reddit_session, bot_reddit_session, subreddit
+    global reddit_session, bot_reddit_session, subreddit, subreddit_context
     global runner
     runner = click.testing.CliRunner()
     runner.mix_stderr = True
@@ -76,7 +78,7 @@ def init():
 
 
 def _init_reddit():
-    global subreddit_name, reddit_session, subreddit, bot_reddit_session
+    global subreddit_name, reddit_session, subreddit, bot_reddit_session, subreddit_context
     subreddit_name = os.environ.get('SUBREDDIT_NAME')
     if subreddit_name:
         base_user_agent = 'python:gr.terrasoft.reddit.slackmodbot'
@@ -89,6 +91,7 @@ def _init_reddit():
             bot_reddit_session = praw_wrapper(user_agent=alt_user_agent,
                                               prompt=f'Visit the following URL as {alt_user}:',
                                               scopes=['*'])
+        subreddit_context = SubredditContext(subreddit, reddit_session, bot_reddit_session)
 
 
 def handle_message(message: chat.chat_wrapper.Message):
@@ -139,6 +142,7 @@ def handle_line(text, message):
         'chat_wrapper': chat_obj,
         'logger': logger,
         'subreddit': subreddit,
+        'subreddit_context': subreddit_context,
         'reddit_session': reddit_session,
         'bot_reddit_session': bot_reddit_session,
         'message': message
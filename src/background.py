@@ -0,0 +1,86 @@
+"""Long-running background workers shared by command modules.
+
+Commands run inside short-lived click invocations, so anything that has to keep running between messages (pollers,
+stream followers, periodic refreshes) lives here as a daemon thread. Workers are registered by name and started at
+most once per process: the first command that needs a worker starts it, later commands get the running instance.
+"""
+import abc
+import datetime
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+_workers: Dict[str, 'BackgroundWorker'] = {}
+_workers_lock = threading.Lock()
+
+
+class BackgroundWorker(threading.Thread, abc.ABC):
+    """Daemon thread calling :meth:`run_once` every ``interval`` seconds until stopped"""
+    interval: float = 60
+
+    def __init__(self, name: str, logger: logging.Logger, interval: float = None):
+        super().__init__(name=name, daemon=True)
+        self.logger = logger
+        if interval is not None:
+            self.interval = interval
+        self.stop_event = threading.Event()
+        self.iterations = 0
+        self.errors = 0
+        self.last_run: Optional[datetime.datetime] = None
+        self.last_error: Optional[str] = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as ex:
+                self.errors += 1
+                self.last_error = repr(ex)
+                self.logger.exception(f"Error in background worker {self.name}: {ex!r}")
+            self.iterations += 1
+            self.last_run = datetime.datetime.now(datetime.timezone.utc)
+            self.stop_event.wait(self.interval)
+        self.on_stop()
+
+    @abc.abstractmethod
+    def run_once(self):
+        """One iteration of the work, errors are logged and counted by :meth:`run`"""
+
+    def on_stop(self):
+        pass
+
+    def stop(self):
+        self.stop_event.set()
+
+    def status(self) -> dict:
+        return {
+            'Name': self.name,
+            'Alive': self.is_alive(),
+            'Interval': self.interval,
+            'Iterations': self.iterations,
+            'Errors': self.errors,
+            'Last Run': self.last_run,
+            'Last Error': self.last_error}
+
+
+def ensure_worker(name: str, factory: Callable[[], BackgroundWorker]) -> BackgroundWorker:
+    """Return the running worker called ``name``, starting a new one from ``factory`` if needed"""
+    with _workers_lock:
+        worker = _workers.get(name)
+        if worker is None or not worker.is_alive():
+            worker = factory()
+            _workers[name] = worker
+            worker.start()
+    return worker
+
+
+def get_worker(name: str) -> Optional[BackgroundWorker]:
+    worker = _workers.get(name)
+    if worker is None or not worker.is_alive():
+        return None
+    return worker
+
+
+def all_workers() -> List[BackgroundWorker]:
+    with _workers_lock:
+        return list(_workers.values())
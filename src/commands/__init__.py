@@ -5,6 +5,7 @@ setattr(click.Context, 'chat', property(lambda self: self.obj['message'].convers
 setattr(click.Context, 'message', property(lambda self: self.obj['message']))
 setattr(click.Context, 'logger', property(lambda self: self.obj['logger']))
 setattr(click.Context, 'subreddit', property(lambda self: self.obj['subreddit']))
+setattr(click.Context, 'subreddit_context', property(lambda self: self.obj['subreddit_context']))
 setattr(click.Context, 'reddit_session', property(lambda self: self.obj['reddit_session']))
 setattr(click.Context, 'bot_reddit_session', property(lambda self: self.obj['bot_reddit_session']))
 
@@ -4,6 +4,7 @@ import click
 import praw
 
 from chat.chat_wrapper import ChatWrapper, Message, Conversation
+from subreddit_context import SubredditContext
 
 
 class ExtendedContext(click.Context):
@@ -28,6 +29,10 @@ class ExtendedContext(click.Context):
     def subreddit(self) -> praw.reddit.Subreddit:
         return self.obj['subreddit']
 
+    @property
+    def subreddit_context(self) -> SubredditContext:
+        return self.obj['subreddit_context']
+
     @property
     def reddit_session(self) -> praw.reddit.Reddit:
         return self.obj['reddit_session']
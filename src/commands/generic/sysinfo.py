@@ -9,6 +9,7 @@ import click
 import humanfriendly
 import psutil
 
+from background import all_workers
 from commands import gyrobot
 from commands.extended_context import ExtendedContext
 
@@ -91,3 +92,14 @@ def disk_space_ex(ctx):
          '-output', 'mountpoint,size,avail,usage',
          '-style', 'unicode',
          '-width', '120']).decode() + '```')
+
+
+@gyrobot.command('workers')
+@click.pass_context
+def workers(ctx: ExtendedContext):
+    """Show the status of background workers"""
+    workers_table = [worker.status() for worker in all_workers()]
+    if not workers_table:
+        ctx.chat.send_text("No background workers are running")
+        return
+    ctx.chat.send_table(title='workers', table=workers_table)
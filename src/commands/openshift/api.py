@@ -1,135 +1,91 @@
 import base64
 import io
+import json
 import logging
 import os
 import pathlib
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 
 import kubernetes.client
 import kubernetes.stream
 import requests
+import requests.adapters
 import urllib3
+import urllib3.connection
 from ruamel.yaml import YAML
 
+from background import BackgroundWorker, ensure_worker
 from commands.extended_context import ExtendedContext
 
+KUBERNETES_SERVICE_AAD_SERVER_GUID = '6dae42f8-4368-4678-94ff-3960e28e3630'
+AZURE_MANAGEMENT_SCOPE = 'https://management.core.windows.net/.default'
+AZURE_KUBERNETES_SCOPE = f'{KUBERNETES_SERVICE_AAD_SERVER_GUID}/.default'
+TOKEN_REFRESH_MARGIN = float(os.environ.get('KUBERNETES_TOKEN_REFRESH_MARGIN', 300))
+POOL_REFRESHER_NAME = 'kubernetes_pool'
+PORT_FORWARD_IDLE_TTL = float(os.environ.get('KUBERNETES_PORT_FORWARD_IDLE_TTL', 30))
+TUNNEL_REAPER_NAME = 'port_forwards'
 
-class KubernetesConnection:
-    KUBERNETES_SERVICE_AAD_SERVER_GUID = '6dae42f8-4368-4678-94ff-3960e28e3630'
-    config: dict
-    project_name: str
-    server_url: str
-    cert_authority: str
-    api_key: str
 
-    class PortForward:
-        def __init__(self, kubernetes_connection):
-            self.kubernetes_connection = kubernetes_connection
-
-        def __enter__(self):
-            def kubernetes_create_connection(address, *args, **kwargs):
-                dns_name = address[0]
-                if isinstance(dns_name, bytes):
-                    dns_name = dns_name.decode()
-                dns_name = dns_name.split(".")
-                if dns_name[-1] != 'kubernetes':
-                    return self.original_create_connection(address, *args, **kwargs)
-                if len(dns_name) not in (3, 4):
-                    raise RuntimeError("Unexpected kubernetes DNS name.")
-                namespace = dns_name[-2]
-                name = dns_name[0]
-                port = address[1]
-                if len(dns_name) == 4:
-                    if dns_name[1] != 'pod':
-                        raise RuntimeError(
-                            f"Unsupported resource type: {dns_name[1]}")
-                pf = kubernetes.stream.portforward(
-                    self.kubernetes_connection.core_v1_api.connect_get_namespaced_pod_portforward, name, namespace,
-                    ports=str(port))
-                return pf.socket(port)
-
-            self.original_create_connection = urllib3.util.connection.create_connection
-            urllib3.util.connection.create_connection = kubernetes_create_connection
-            return self
-
-        def __exit__(self, exc_type, exc_val, exc_tb):
-            urllib3.util.connection.create_connection = self.original_create_connection
+def _hit_rate(hits: int, misses: int) -> str:
+    return f"{100 * hits / (hits + misses):.0f}%" if hits + misses else '-'
 
-    def __init__(self, ctx: ExtendedContext, namespace: str):
-        self.ctx = ctx
-        self.namespace = namespace
-        self.config = self.ctx.obj['config']['environments'][self.namespace]
-        self.project_name = self.config.get('project_name', self.namespace)
-        self.server_url = self.config['url']
-        self.is_azure = self.server_url == 'azure'
-        logging.getLogger('kubernetes.client.rest').setLevel(logging.INFO)
-        logging.getLogger('cron_descriptor.GetText').setLevel(logging.INFO)
 
-    def _login_openshift(self):
-        self.api_key = self.config['credentials']
+class _TokenCache:
+    """Azure AD access tokens per (tenant, client, scope), reused until ``TOKEN_REFRESH_MARGIN`` seconds before they
+    expire"""
 
-    def _login_azure(self):
-        creds = self.config['credentials']
-        yaml = YAML()
-        session = requests.Session()
-        login_page = session.post(
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens: Dict[tuple, tuple] = {}  # (tenant, client, scope) -> (token, expires at)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, creds: dict, scope: str, margin: float = TOKEN_REFRESH_MARGIN) -> str:
+        key = (creds['tenantId'], creds['servicePrincipalId'], scope)
+        with self.lock:
+            token, expires_at = self.tokens.get(key, (None, 0))
+            if token and time.time() < expires_at - margin:
+                self.hits += 1
+                return token
+            self.misses += 1
+        login_page = requests.post(
             f'https://login.microsoftonline.com/{creds["tenantId"]}/oauth2/v2.0/token',
             data={
                 'client_id': (creds['servicePrincipalId']),
                 'grant_type': 'client_credentials',
                 'client_info': 1,
                 'client_secret': (creds['servicePrincipalKey']),
-                'scope': 'https://management.core.windows.net/.default'
-            })
+                'scope': scope
+            },
+            timeout=30)
         login_result = login_page.json()
-        azure_token = login_result.get('access_token')
-        if not azure_token:
-            print(login_result)
-            raise Exception("Azure Login Failed")
-        session.headers['Authorization'] = 'Bearer ' + azure_token
-        subscriptions_page = session.get('https://management.azure.com/subscriptions?api-version=2019-11-01')
-        subscription_count = len(subscriptions_page.json()['value'])
-        assert subscription_count == 1, f"Was expecting one subscription, got {subscription_count}"
-        subscription_id = subscriptions_page.json()['value'][0]['subscriptionId']
-        aks_credentials_page = session.post(
-            (f'https://management.azure.com/subscriptions/{subscription_id}/resourceGroups'
-             f'/{self.config["azure_resource_group"]}/providers/Microsoft.ContainerService/managedClusters'
-             f'/{self.config["azure_cluster_name"]}/listClusterUserCredential?api-version=2022-03-01'))
-        aks_credentials = aks_credentials_page.json()
-        if 'error' in aks_credentials:
-            raise Exception(aks_credentials['error'])
-        aks_value_raw = [x for x in aks_credentials['kubeconfigs'] if x['name'] == 'clusterUser'][0]['value']
-        with io.BytesIO(base64.b64decode(aks_value_raw)) as f:
-            aks_value = yaml.load(f)
-        cluster_url = [x for x in aks_value['clusters'] if x['name'] == self.config['azure_cluster_name']][0]['cluster']['server']
-        self.server_url = cluster_url + '/'
+        token = login_result.get('access_token')
+        if not token:
+            raise Exception(f"Azure Login Failed: {login_result.get('error_description') or login_result}")
+        with self.lock:
+            self.tokens[key] = (token, time.time() + float(login_result.get('expires_in', 3600)))
+        return token
 
-        #
-        # self.cert_authority = tempfile.NamedTemporaryFile()
-        # cert_authority_data_raw = aks_value['clusters'][0]['cluster']['certificate-authority-data']
-        # cert_authority_data = base64.b64decode(cert_authority_data_raw)
-        # self.cert_authority.write(cert_authority_data)
-        # self.cert_authority.flush()
 
-        kubernetes_token_raw = session.post(
-            f'https://login.microsoftonline.com/{creds["tenantId"]}/oauth2/v2.0/token',
-            data={
-                'client_id': (creds['servicePrincipalId']),
-                'grant_type': 'client_credentials',
-                'client_info': 1,
-                'client_secret': (creds['servicePrincipalKey']),
-                'scope': f'{KubernetesConnection.KUBERNETES_SERVICE_AAD_SERVER_GUID}/.default'
-            })
-        kubernetes_token = kubernetes_token_raw.json()
-        self.api_key = kubernetes_token['access_token']
+_token_cache = _TokenCache()
 
-    def __enter__(self):
-        if 'cert' in self.config:
-            self.cert_authority = str((pathlib.Path('config') / self.config['cert']).resolve())
 
+class _ClusterClient:
+    """Logged in ApiClient for one environment, shared by all the commands that use it"""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.server_url = config['url']
+        self.is_azure = self.server_url == 'azure'
+        self.cert_authority = str((pathlib.Path('config') / config['cert']).resolve()) if 'cert' in config else None
         if self.is_azure:
-            self._login_azure()
+            self.server_url = self._azure_cluster_url()
+            self.api_key = _token_cache.get(config['credentials'], AZURE_KUBERNETES_SCOPE)
         else:
-            self._login_openshift()
+            self.api_key = config['credentials']
 
         if self.server_url.endswith('/'): self.server_url = self.server_url[:-1]
 
@@ -147,11 +103,276 @@ class KubernetesConnection:
         self.batch_v1_api = kubernetes.client.BatchV1Api(self.api_client)
         self.core_v1_api = kubernetes.client.CoreV1Api(self.api_client)
         self.well_known_api = kubernetes.client.WellKnownApi(self.api_client)
+
+    def _azure_cluster_url(self) -> str:
+        """API server of the AKS cluster, read from the cluster user kubeconfig"""
+        yaml = YAML()
+        session = requests.Session()
+        azure_token = _token_cache.get(self.config['credentials'], AZURE_MANAGEMENT_SCOPE)
+        session.headers['Authorization'] = 'Bearer ' + azure_token
+        subscriptions_page = session.get('https://management.azure.com/subscriptions?api-version=2019-11-01',
+                                         timeout=30)
+        subscription_count = len(subscriptions_page.json()['value'])
+        assert subscription_count == 1, f"Was expecting one subscription, got {subscription_count}"
+        subscription_id = subscriptions_page.json()['value'][0]['subscriptionId']
+        aks_credentials_page = session.post(
+            (f'https://management.azure.com/subscriptions/{subscription_id}/resourceGroups'
+             f'/{self.config["azure_resource_group"]}/providers/Microsoft.ContainerService/managedClusters'
+             f'/{self.config["azure_cluster_name"]}/listClusterUserCredential?api-version=2022-03-01'),
+            timeout=30)
+        aks_credentials = aks_credentials_page.json()
+        if 'error' in aks_credentials:
+            raise Exception(aks_credentials['error'])
+        aks_value_raw = [x for x in aks_credentials['kubeconfigs'] if x['name'] == 'clusterUser'][0]['value']
+        with io.BytesIO(base64.b64decode(aks_value_raw)) as f:
+            aks_value = yaml.load(f)
+        cluster_url = [x for x in aks_value['clusters'] if x['name'] == self.config['azure_cluster_name']][0]['cluster']['server']
+        return cluster_url + '/'
+
+    def refresh_token(self, margin: float = TOKEN_REFRESH_MARGIN):
+        """Replace the Kubernetes token if it expires in less than ``margin`` seconds"""
+        if not self.is_azure:
+            return
+        self.api_key = _token_cache.get(self.config['credentials'], AZURE_KUBERNETES_SCOPE, margin)
+        self.api_client.configuration.api_key['authorization'] = self.api_key
+
+    def close(self):
+        self.api_client.close()
+
+
+class KubernetesConnectionPool:
+    """Process-wide logged in clients, one per environment (namespace and its configuration).
+
+    Logging in to Azure takes a few HTTP calls, so clients are created once and then reused by every command, along
+    with their urllib3 connection pools. Azure tokens are refreshed shortly before they expire."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients: Dict[tuple, _ClusterClient] = {}
+        self.client_locks: Dict[tuple, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, namespace: str, config: dict) -> _ClusterClient:
+        key = (namespace, json.dumps(config, sort_keys=True, default=str))
+        with self.lock:
+            client_lock = self.client_locks.setdefault(key, threading.Lock())
+        with client_lock:  # logging in to one environment doesn't block the others
+            client = self.clients.get(key)
+            if client is None:
+                client = _ClusterClient(config)
+                self.misses += 1
+                with self.lock:
+                    self.clients[key] = client
+            else:
+                client.refresh_token()
+                self.hits += 1
+        return client
+
+    def all_clients(self) -> List[_ClusterClient]:
+        with self.lock:
+            return list(self.clients.values())
+
+    def stats(self) -> dict:
+        return {
+            'Connections': len(self.clients),
+            'Connection Hit Rate': _hit_rate(self.hits, self.misses),
+            'Token Hit Rate': _hit_rate(_token_cache.hits, _token_cache.misses)}
+
+
+connection_pool = KubernetesConnectionPool()
+
+
+class _ConnectionPoolRefresher(BackgroundWorker):
+    """Refresh pooled Azure tokens before they expire, so commands never wait for a login"""
+
+    def run_once(self):
+        for client in connection_pool.all_clients():
+            client.refresh_token(TOKEN_REFRESH_MARGIN + 2 * self.interval)
+
+    def status(self) -> dict:
+        return super().status() | connection_pool.stats()
+
+
+def _pod_address(host: str) -> Optional[Tuple[str, str]]:
+    """(namespace, pod) of a ``<pod>.pod.<namespace>.kubernetes`` or ``<pod>.<namespace>.kubernetes`` host name"""
+    dns_name = host.split('.')
+    if dns_name[-1] != 'kubernetes':
+        return None
+    if len(dns_name) not in (3, 4):
+        raise RuntimeError("Unexpected kubernetes DNS name.")
+    if len(dns_name) == 4 and dns_name[1] != 'pod':
+        raise RuntimeError(f"Unsupported resource type: {dns_name[1]}")
+    return dns_name[-2], dns_name[0]
+
+
+def _open_port_forward(configuration: kubernetes.client.Configuration, namespace: str, pod: str, port: int):
+    """Socket connected to a port of a pod.
+
+    ``kubernetes.stream`` swaps the request method of the ApiClient it is given while it connects the websocket, so
+    every tunnel gets its own ApiClient instead of racing the shared one."""
+    with kubernetes.client.ApiClient(configuration) as api_client:
+        core_v1_api = kubernetes.client.CoreV1Api(api_client)
+        port_forward = kubernetes.stream.portforward(
+            core_v1_api.connect_get_namespaced_pod_portforward, pod, namespace, ports=str(port))
+    return port_forward.socket(port)
+
+
+class _PortForwardHTTPConnection(urllib3.connection.HTTPConnection):
+    def __init__(self, *args, open_socket: Callable[[], socket.socket], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.open_socket = open_socket
+
+    def _new_conn(self) -> socket.socket:
+        sock = self.open_socket()
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        return sock
+
+
+class _PortForwardConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _PortForwardHTTPConnection
+
+
+class PortForwardTunnelPool:
+    """Process-wide port forward tunnels, one urllib3 pool per (cluster, namespace, pod, port).
+
+    Each tunnel is one port forward websocket carrying one keep-alive HTTP connection. After a response it goes back to
+    its pool, so the next request to the same pod and port reuses it instead of opening another websocket. Pools that
+    haven't been used for ``PORT_FORWARD_IDLE_TTL`` seconds are closed by the ``port_forwards`` background worker."""
+
+    def __init__(self, idle_ttl: float = PORT_FORWARD_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self.lock = threading.Lock()
+        self.pools: Dict[tuple, _PortForwardConnectionPool] = {}
+        self.last_used: Dict[tuple, float] = {}
+        self.requests = 0
+        self.tunnels_opened = 0
+        self.pools_closed = 0
+
+    def acquire(self, configuration: kubernetes.client.Configuration, namespace: str, pod: str,
+                port: int) -> _PortForwardConnectionPool:
+        key = (configuration.host, namespace, pod, port)
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = _PortForwardConnectionPool(
+                    f'{pod}.pod.{namespace}.kubernetes', port,
+                    open_socket=lambda: self._open_tunnel(configuration, namespace, pod, port))
+                self.pools[key] = pool
+            self.last_used[key] = time.monotonic()
+            self.requests += 1
+        return pool
+
+    def _open_tunnel(self, configuration: kubernetes.client.Configuration, namespace: str, pod: str,
+                     port: int) -> socket.socket:
+        sock = _open_port_forward(configuration, namespace, pod, port)
+        with self.lock:
+            self.tunnels_opened += 1
+        return sock
+
+    def close_idle(self):
+        idle_since = time.monotonic() - self.idle_ttl
+        with self.lock:
+            idle_keys = [key for key, last_used in self.last_used.items() if last_used < idle_since]
+            idle_pools = [self.pools.pop(key) for key in idle_keys]
+            for key in idle_keys:
+                del self.last_used[key]
+            self.pools_closed += len(idle_pools)
+        for pool in idle_pools:  # a request still running on one of these closes its tunnel when it's done
+            pool.close()
+
+    def stats(self) -> dict:
+        return {
+            'Port Forwards': len(self.pools),
+            'Tunnels Opened': self.tunnels_opened,
+            'Tunnel Reuse Rate': _hit_rate(self.requests - self.tunnels_opened, self.tunnels_opened),
+            'Idle Closed': self.pools_closed}
+
+
+tunnel_pool = PortForwardTunnelPool()
+
+
+class _TunnelReaper(BackgroundWorker):
+    """Close port forwards that haven't been used for ``PORT_FORWARD_IDLE_TTL`` seconds"""
+
+    def run_once(self):
+        tunnel_pool.close_idle()
+
+    def status(self) -> dict:
+        return super().status() | tunnel_pool.stats()
+
+
+class PortForwardAdapter(requests.adapters.HTTPAdapter):
+    """Transport adapter that connects to ``*.kubernetes`` hosts through pooled port forwards to the pod.
+
+    Unlike patching ``urllib3.util.connection.create_connection``, nothing outside the adapter changes, so any number of
+    sessions can forward at once."""
+
+    def __init__(self, api_client: kubernetes.client.ApiClient, deadline: Optional[float] = None):
+        self.configuration = api_client.configuration
+        self.deadline = deadline
+        super().__init__()
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        url = urllib3.util.parse_url(request.url)
+        address = _pod_address(url.host)
+        if address is None:
+            return super().get_connection_with_tls_context(request, verify, proxies, cert)
+        return tunnel_pool.acquire(self.configuration, *address, url.port or 80)
+
+    def send(self, request, timeout=None, **kwargs):
+        if self.deadline is not None:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                raise requests.exceptions.Timeout(f"Ran out of time before {request.method} {request.url}",
+                                                  request=request)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+class KubernetesConnection:
+    KUBERNETES_SERVICE_AAD_SERVER_GUID = KUBERNETES_SERVICE_AAD_SERVER_GUID
+    config: dict
+    project_name: str
+    server_url: str
+    cert_authority: str
+    api_key: str
+
+    def __init__(self, ctx: ExtendedContext, namespace: str):
+        self.ctx = ctx
+        self.namespace = namespace
+        self.config = self.ctx.obj['config']['environments'][self.namespace]
+        self.project_name = self.config.get('project_name', self.namespace)
+        self.server_url = self.config['url']
+        self.is_azure = self.server_url == 'azure'
+        logging.getLogger('kubernetes.client.rest').setLevel(logging.INFO)
+        logging.getLogger('cron_descriptor.GetText').setLevel(logging.INFO)
+
+    def __enter__(self):
+        client = connection_pool.acquire(self.namespace, self.config)
+        ensure_worker(POOL_REFRESHER_NAME, lambda: _ConnectionPoolRefresher(POOL_REFRESHER_NAME, self.ctx.logger))
+        self.server_url = client.server_url
+        self.cert_authority = client.cert_authority
+        self.api_key = client.api_key
+        self.api_client = client.api_client
+        self.apps_v1_api = client.apps_v1_api
+        self.batch_v1_api = client.batch_v1_api
+        self.core_v1_api = client.core_v1_api
+        self.well_known_api = client.well_known_api
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.api_client:
-            self.api_client.close()
+        pass  # the client stays in the pool for the next command
 
-    def port_forward(self):
-        return KubernetesConnection.PortForward(self)
+    def port_forward(self, deadline: Optional[float] = None) -> requests.Session:
+        """Session that reaches ``http://<pod>.pod.<project>.kubernetes:<port>/`` through port forwards, other hosts
+        directly. Sessions can be used from different threads at once, and tunnels stay open after the session is
+        closed, for the next requests to the same pod. With a ``deadline`` (``time.monotonic()``), no request waits
+        past it."""
+        ensure_worker(TUNNEL_REAPER_NAME,
+                      lambda: _TunnelReaper(TUNNEL_REAPER_NAME, self.ctx.logger, max(PORT_FORWARD_IDLE_TTL / 2, 1)))
+        session = requests.Session()
+        session.trust_env = False  # the tunnels are opened by the Kubernetes client, never through a proxy
+        session.mount('http://', PortForwardAdapter(self.api_client, deadline))
+        return session
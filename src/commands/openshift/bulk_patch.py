@@ -0,0 +1,56 @@
+import concurrent.futures
+import os
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import kubernetes.client
+
+BULK_PATCH_WORKERS = int(os.environ.get('KUBERNETES_BULK_PATCH_WORKERS', 10))
+
+
+class PatchResult(NamedTuple):
+    kind: str
+    name: str
+    result: Optional[object]  # the patched object, None if the patch failed
+    error: Optional[str]
+
+
+def bulk_patch(patch_function: Callable, project_name: str, kind: str, names: List[str], body: dict,
+               dry_run: bool = False) -> List[PatchResult]:
+    """Apply the same patch to many objects at once, ``BULK_PATCH_WORKERS`` at a time.
+
+    A failed patch doesn't stop the others, its error is returned in its result. With ``dry_run`` the server validates
+    and returns the patched objects without storing them. Results are in the order of ``names``."""
+    kwargs = {'dry_run': 'All'} if dry_run else {}
+
+    def patch(name):
+        try:
+            return PatchResult(kind, name, patch_function(name, project_name, body, **kwargs), None)
+        except kubernetes.client.ApiException as ex:
+            return PatchResult(kind, name, None, f'{ex.status} {ex.reason}')
+        except Exception as ex:  # a transport error, the other patches go on
+            return PatchResult(kind, name, None, repr(ex))
+
+    if not names:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(BULK_PATCH_WORKERS, len(names))) as executor:
+        return list(executor.map(patch, names))
+
+
+def patch_results_table(results: List[PatchResult], make_row: Callable[[object], Dict],
+                        dry_run: bool = False, with_kind: bool = False) -> List[Dict]:
+    """One row per patched object (from ``make_row``) with a Result column, failed objects get their error instead.
+
+    All rows get the same columns, so results of different kinds (``with_kind`` adds a Kind column) must be passed
+    together."""
+    rows = []
+    for patch_result in results:
+        row = {'Kind': patch_result.kind} if with_kind else {}
+        if patch_result.error is None:
+            row |= make_row(patch_result.result)
+            row['Result'] = 'dry run' if dry_run else 'ok'
+        else:
+            row |= {'Name': patch_result.name, 'Result': patch_result.error}
+        rows.append(row)
+    columns = [column for column in dict.fromkeys(column for row in rows for column in row) if column != 'Result']
+    columns.append('Result')
+    return [{column: row.get(column) for column in columns} for row in rows]
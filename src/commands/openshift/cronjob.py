@@ -13,6 +13,7 @@ from commands import gyrobot
 from commands.extended_context import ExtendedContext
 from commands.openshift.api import KubernetesConnection
 from commands.openshift.common import OpenShiftNamespace
+from commands.openshift.informer import list_objects
 
 if 'OPENSHIFT_CRONJOB' not in os.environ:
     raise ImportError('OPENSHIFT_CRONJOB not found in environment')
@@ -121,9 +122,9 @@ def _make_cronjob_table(cronjobs):
 @check_security
 def list_cronjobs(ctx: ExtendedContext, namespace: str, table_format: TableFormat):
     with KubernetesConnection(ctx, namespace) as k8s:
-        cronjobs = k8s.batch_v1_api.list_namespaced_cron_job(k8s.project_name)
+        cronjobs = list_objects(k8s, 'cronjobs')
 
-    cronjob_table = _make_cronjob_table(cronjobs.items)
+    cronjob_table = _make_cronjob_table(cronjobs)
     ctx.chat.send_table(title=f'cronjobs-{namespace}', table=cronjob_table, table_format=table_format)
 
 
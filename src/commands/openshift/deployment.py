@@ -7,7 +7,9 @@ from backend.constants import TableFormat
 from commands import gyrobot
 from commands.extended_context import ExtendedContext
 from commands.openshift.api import KubernetesConnection
+from commands.openshift.bulk_patch import bulk_patch, patch_results_table
 from commands.openshift.common import OpenShiftNamespace
+from commands.openshift.informer import list_objects
 from backend.configuration import read_config, check_security
 
 if 'OPENSHIFT_DEPLOYMENT' not in os.environ:
@@ -31,42 +33,42 @@ def deployment(ctx: ExtendedContext):
 @check_security
 def list_deployments(ctx: ExtendedContext, namespace: str, table_format: TableFormat=TableFormat.TABLE):
     with KubernetesConnection(ctx, namespace) as k8s:
-        deployments = k8s.apps_v1_api.list_namespaced_deployment(k8s.project_name)
-    deployments_table = _make_deployments_table(deployments.items)
+        deployments = list_objects(k8s, 'deployments')
+    deployments_table = _make_deployments_table(deployments)
     ctx.chat.send_table(title='deployments', table=deployments_table, table_format=table_format)
 
 
 @deployment.command('pause')
 @click.argument('namespace', type=OpenShiftNamespace(_deployment_config))
 @click.option('-f', '--format', type=TableFormat, default=TableFormat.TABLE)
+@click.option('--dry-run', 'dry_run', is_flag=True, default=False, help='Validate on the server without pausing')
 @click.pass_context
 @check_security
-def pause_deployment(ctx: ExtendedContext, namespace: str, table_format: TableFormat=TableFormat.TABLE):
-    with KubernetesConnection(ctx, namespace) as k8s:
-        deployments = k8s.apps_v1_api.list_namespaced_deployment(k8s.project_name)
-        result = []
-        for one_deployment in deployments.items:
-            result.append(k8s.apps_v1_api.patch_namespaced_deployment(
-                one_deployment.metadata.name, k8s.project_name,
-                {'spec': {'paused': True}}))
-        result_markdown = _make_deployments_table(result)
-    ctx.chat.send_table(title='deployments', table=result_markdown, table_format=table_format)
+def pause_deployment(ctx: ExtendedContext, namespace: str, table_format: TableFormat=TableFormat.TABLE,
+                     dry_run: bool = False):
+    _patch_all_deployments(ctx, namespace, {'spec': {'paused': True}}, table_format, dry_run)
 
 
 @deployment.command('resume')
 @click.argument('namespace', type=OpenShiftNamespace(_deployment_config))
 @click.option('-f', '--format', type=TableFormat, default=TableFormat.TABLE)
+@click.option('--dry-run', 'dry_run', is_flag=True, default=False, help='Validate on the server without resuming')
 @click.pass_context
 @check_security
-def resume_deployment(ctx: ExtendedContext, namespace, table_format: TableFormat=TableFormat.TABLE):
+def resume_deployment(ctx: ExtendedContext, namespace, table_format: TableFormat=TableFormat.TABLE,
+                      dry_run: bool = False):
+    _patch_all_deployments(ctx, namespace, {'spec': {'paused': None}}, table_format, dry_run)
+
+
+def _patch_all_deployments(ctx: ExtendedContext, namespace: str, body: dict, table_format: TableFormat,
+                           dry_run: bool):
     with KubernetesConnection(ctx, namespace) as k8s:
         deployments = k8s.apps_v1_api.list_namespaced_deployment(k8s.project_name)
-        result = []
-        for one_deployment in deployments.items:
-            result.append(k8s.apps_v1_api.patch_namespaced_deployment(
-                one_deployment.metadata.name, k8s.project_name,
-                {'spec': {'paused': None}}))
-    ctx.chat.send_table(title='deployments', table=_make_deployments_table(result), table_format=table_format)
+        names = [one_deployment.metadata.name for one_deployment in deployments.items]
+        results = bulk_patch(k8s.apps_v1_api.patch_namespaced_deployment, k8s.project_name, 'Deployment', names,
+                             body, dry_run)
+    result_table = patch_results_table(results, lambda dep: _make_deployments_table([dep])[0], dry_run)
+    ctx.chat.send_table(title='deployments', table=result_table, table_format=table_format)
 
 
 def _make_deployments_table(result) -> List[Dict]:
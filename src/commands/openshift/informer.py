@@ -0,0 +1,158 @@
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+import kubernetes.client
+import kubernetes.watch
+
+from backend.configuration import truthy_env
+from background import BackgroundWorker, ensure_worker
+from commands.openshift.api import KubernetesConnection
+
+INFORMER_WATCH_TIMEOUT = int(os.environ.get('KUBERNETES_INFORMER_WATCH_TIMEOUT', 300))
+INFORMER_SYNC_TIMEOUT = float(os.environ.get('KUBERNETES_INFORMER_SYNC_TIMEOUT', 10))
+INFORMER_MAX_FAILURES = int(os.environ.get('KUBERNETES_INFORMER_MAX_FAILURES', 3))
+
+# kind -> list method of a connection
+LIST_FUNCTIONS: Dict[str, Callable[[KubernetesConnection], Callable]] = {
+    'deployments': lambda k8s: k8s.apps_v1_api.list_namespaced_deployment,
+    'statefulsets': lambda k8s: k8s.apps_v1_api.list_namespaced_stateful_set,
+    'pods': lambda k8s: k8s.core_v1_api.list_namespaced_pod,
+    'cronjobs': lambda k8s: k8s.batch_v1_api.list_namespaced_cron_job,
+}
+
+
+def informers_enabled() -> bool:
+    return truthy_env('KUBERNETES_INFORMERS')
+
+
+def _matches(obj, label_selector: Optional[str]) -> bool:
+    """Equality-based label selector (``key=value,key2=value2``), the only kind the commands use"""
+    if not label_selector:
+        return True
+    labels = obj.metadata.labels or {}
+    for requirement in label_selector.split(','):
+        key, _, value = requirement.partition('=')
+        if labels.get(key.strip()) != value.lstrip('=').strip():
+            return False
+    return True
+
+
+class Informer(BackgroundWorker):
+    """Keep an in-memory copy of all objects of one kind in a project, following a watch stream.
+
+    The objects are listed once, then every change after that list's resourceVersion is applied as it arrives. If the
+    server no longer has that resourceVersion (410 Gone), everything is listed again. Each watch request ends after
+    ``INFORMER_WATCH_TIMEOUT`` seconds and is resumed from the last resourceVersion. After ``INFORMER_MAX_FAILURES``
+    list or watch failures in a row (for example an expired token), the copy is no longer trusted until a list or
+    an event gets through again."""
+    interval = 5  # pause before resuming the watch, so that errors don't turn into a busy loop
+
+    def __init__(self, name: str, k8s: KubernetesConnection, kind: str):
+        super().__init__(name, k8s.ctx.logger)
+        self.list_function = LIST_FUNCTIONS[kind](k8s)
+        self.project_name = k8s.project_name
+        self.kind = kind
+        self.lock = threading.Lock()
+        self.objects: Dict[str, object] = {}
+        self.resource_version: Optional[str] = None
+        self.synced = threading.Event()
+        self.watch: Optional[kubernetes.watch.Watch] = None
+        self.events = 0
+        self.relists = 0
+        self.failures = 0
+
+    def _relist(self):
+        object_list = self.list_function(self.project_name)
+        with self.lock:
+            self.objects = {obj.metadata.name: obj for obj in object_list.items}
+            self.resource_version = object_list.metadata.resource_version
+        self.relists += 1
+        self.failures = 0
+        self.synced.set()
+
+    @property
+    def healthy(self) -> bool:
+        return self.synced.is_set() and self.failures < INFORMER_MAX_FAILURES
+
+    def run_once(self):
+        try:
+            self._follow()
+        except Exception:
+            self.failures += 1
+            raise
+
+    def _follow(self):
+        if self.resource_version is None:
+            self._relist()
+        self.watch = kubernetes.watch.Watch()
+        try:
+            for event in self.watch.stream(self.list_function, self.project_name,
+                                           resource_version=self.resource_version,
+                                           timeout_seconds=INFORMER_WATCH_TIMEOUT,
+                                           allow_watch_bookmarks=True):
+                if self.stop_event.is_set():
+                    break
+                self._apply(event)
+        except kubernetes.client.ApiException as ex:
+            if ex.status != 410:
+                raise
+            self.resource_version = None  # expired, list again
+        finally:
+            self.watch.stop()
+
+    def _apply(self, event: dict):
+        event_type = event['type']
+        if event_type == 'ERROR':
+            self.resource_version = None  # most likely 410 Gone, list again
+            self.watch.stop()
+            return
+        self.failures = 0
+        if event_type == 'BOOKMARK':  # only moves the resourceVersion, its object isn't deserialized
+            self.resource_version = event['raw_object']['metadata']['resourceVersion']
+            return
+        obj = event['object']
+        with self.lock:
+            if event_type in ('ADDED', 'MODIFIED'):
+                self.objects[obj.metadata.name] = obj
+            elif event_type == 'DELETED':
+                self.objects.pop(obj.metadata.name, None)
+            self.resource_version = obj.metadata.resource_version
+        self.events += 1
+
+    def stop(self):
+        super().stop()
+        if self.watch is not None:
+            self.watch.stop()
+
+    def list(self, label_selector: Optional[str] = None) -> List:
+        """Objects as of the latest resourceVersion seen, sorted by name like the API returns them"""
+        with self.lock:
+            objects = [self.objects[name] for name in sorted(self.objects)]
+        return [obj for obj in objects if _matches(obj, label_selector)]
+
+    def status(self) -> dict:
+        with self.lock:
+            object_count = len(self.objects)
+        return super().status() | {
+            'Objects': object_count,
+            'Resource Version': self.resource_version,
+            'Synced': self.synced.is_set(),
+            'Healthy': self.healthy,
+            'Events': self.events,
+            'Relists': self.relists,
+            'Failures': self.failures}
+
+
+def list_objects(k8s: KubernetesConnection, kind: str, label_selector: Optional[str] = None) -> List:
+    """Objects of a kind in the connection's project.
+
+    With ``KUBERNETES_INFORMERS`` enabled the objects come from the informer of that project and kind (started on first
+    use), otherwise, while the informer hasn't finished its first list, or while it keeps failing, they are listed from
+    the API."""
+    if informers_enabled():
+        name = f'informer-{kind}-{k8s.server_url}-{k8s.project_name}'
+        informer = ensure_worker(name, lambda: Informer(name, k8s, kind))
+        if informer.failures < INFORMER_MAX_FAILURES and informer.synced.wait(INFORMER_SYNC_TIMEOUT):
+            return informer.list(label_selector)
+    return LIST_FUNCTIONS[kind](k8s)(k8s.project_name, label_selector=label_selector).items
@@ -11,6 +11,7 @@ from commands.extended_context import ExtendedContext
 from commands.openshift.api import KubernetesConnection
 from commands.openshift.api_obsolete_3 import do_login, do_logout
 from commands.openshift.common import OpenShiftNamespace, env_config
+from commands.openshift.informer import list_objects
 from backend.configuration import read_config, check_security
 
 if 'MOCK_CONFIGURATION' not in os.environ:
@@ -178,6 +179,6 @@ def _make_deployments_table(result) -> List[Dict]:
 @check_security
 def mock_view(ctx: ExtendedContext, namespace: str, table_format: TableFormat=TableFormat.TABLE):
     with KubernetesConnection(ctx, namespace) as k8s:
-        deployments = k8s.apps_v1_api.list_namespaced_deployment(k8s.project_name)
-    deployments_table = _make_deployments_table(deployments.items)
+        deployments = list_objects(k8s, 'deployments')
+    deployments_table = _make_deployments_table(deployments)
     ctx.chat.send_table(title='deployments', table=deployments_table, table_format=table_format)
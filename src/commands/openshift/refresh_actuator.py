@@ -1,6 +1,9 @@
+import collections
+import concurrent.futures
 import json
 import os
-from typing import Callable
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
 
 import click
 import kubernetes.client
@@ -12,11 +15,16 @@ from backend.constants import TableFormat
 from commands import gyrobot
 from commands.extended_context import ExtendedContext
 from commands.openshift.api import KubernetesConnection
-from commands.openshift.common import OpenShiftNamespace, rangify
+from commands.openshift.common import OpenShiftNamespace
+from commands.openshift.informer import list_objects
 
 if 'OPENSHIFT_ACTUATOR_REFRESH' not in os.environ:
     raise ImportError('OPENSHIFT_ACTUATOR_REFRESH not found in environment')
 
+ACTUATOR_PORT = 8778
+ACTUATOR_WORKERS = int(os.environ.get('ACTUATOR_WORKERS', 8))
+ACTUATOR_POD_TIMEOUT = float(os.environ.get('ACTUATOR_POD_TIMEOUT', 90))
+
 
 def _actuator_config():
     env_var = 'OPENSHIFT_ACTUATOR_REFRESH'
@@ -39,29 +47,30 @@ def actuator(ctx: ExtendedContext):
 @click.argument('namespace', type=OpenShiftNamespace(_actuator_config()))
 @click.argument('deployments', type=str, nargs=-1)
 @click.option('-f', '--format', type=TableFormat, default=TableFormat.TABLE)
+@click.option('-c', '--compact', is_flag=True, default=False,
+              help='Only send the changes, once for all pods with the same changes')
 @click.pass_context
 @check_security
 def refresh_actuator(ctx: ExtendedContext, namespace: str, deployments: list[str],
-                     table_format: TableFormat = TableFormat.TABLE):
-    def refresh_action(conn, pod_results, pod_to_refresh):
-        empty_proxies = {'http': None, 'https': None}
-        response_before = requests.get(
-            url=f'http://{pod_to_refresh}.pod.{conn.project_name}.kubernetes:8778/actuator/env',
-            proxies=empty_proxies, timeout=30)
-        refresh_result = requests.post(
-            url=f'http://{pod_to_refresh}.pod.{conn.project_name}.kubernetes:8778/actuator/refresh',
-            proxies=empty_proxies, timeout=30)
-        response_after = requests.get(
-            url=f'http://{pod_to_refresh}.pod.{conn.project_name}.kubernetes:8778/actuator/env',
-            proxies=empty_proxies, timeout=30)
-        pod_results[pod_to_refresh + ' - before'] = _environment_table(response_before)
-        pod_results[pod_to_refresh + ' - change'] = _environment_changes_table(
-            response_before, response_after, refresh_result)
-        pod_results[pod_to_refresh + ' - after'] = _environment_table(response_after)
+                     table_format: TableFormat = TableFormat.TABLE, compact: bool = False):
+    pod_changes = {}
+
+    def refresh_action(session, actuator_url, pod_results, pod_to_refresh):
+        environment_before = Environment.from_response(session.get(f'{actuator_url}/env', timeout=30))
+        session.post(f'{actuator_url}/refresh', timeout=30).raise_for_status()
+        environment_after = Environment.from_response(session.get(f'{actuator_url}/env', timeout=30))
+        if compact:
+            pod_changes[pod_to_refresh] = environment_before.diff(environment_after)
+            return
+        pod_results[pod_to_refresh + ' - before'] = environment_before.table()
+        pod_results[pod_to_refresh + ' - change'] = environment_before.diff(environment_after)
+        pod_results[pod_to_refresh + ' - after'] = environment_after.table()
 
     action_names = ('refresh', 'Refreshed')
 
     _actuator_action(ctx, namespace, deployments, table_format, action_names, refresh_action)
+    if pod_changes:
+        ctx.chat.send_tables('PodChanges', _group_changes(pod_changes), table_format=table_format)
 
 
 @actuator.command('view')
@@ -72,12 +81,8 @@ def refresh_actuator(ctx: ExtendedContext, namespace: str, deployments: list[str
 @check_security
 def view_actuator(ctx: ExtendedContext, namespace: str, deployments: list[str],
                   table_format: TableFormat = TableFormat.TABLE):
-    def view_action(conn, pod_results, pod_to_refresh):
-        response = requests.get(
-            url=f'http://{pod_to_refresh}.pod.{conn.project_name}.kubernetes:8778/actuator/env',
-            proxies={'http': None, 'https': None},
-            timeout=30)
-        pod_results[pod_to_refresh] = _environment_table(response)
+    def view_action(session, actuator_url, pod_results, pod_to_refresh):
+        pod_results[pod_to_refresh] = Environment.from_response(session.get(f'{actuator_url}/env', timeout=30)).table()
 
     action_names = ('view', 'Viewed')
 
@@ -92,11 +97,8 @@ def view_actuator(ctx: ExtendedContext, namespace: str, deployments: list[str],
 @check_security
 def health_actuator(ctx: ExtendedContext, namespace: str, deployments: list[str],
                     table_format: TableFormat = TableFormat.TABLE):
-    def health_action(conn, pod_results, pod):
-        response = requests.get(
-            url=f'http://{pod}.pod.{conn.project_name}.kubernetes:8778/actuator/health',
-            proxies={'http': None, 'https': None},
-            timeout=30)
+    def health_action(session, actuator_url, pod_results, pod):
+        response = session.get(f'{actuator_url}/health', timeout=30)
         health_raw = response.json()
         health_table = []
         for key, value in health_raw['components'].items():
@@ -119,7 +121,13 @@ def health_actuator(ctx: ExtendedContext, namespace: str, deployments: list[str]
 
 def _actuator_action(ctx: ExtendedContext, namespace: str, deployments: list[str], table_format: TableFormat,
                      action_names: tuple[str, str], action: Callable):
+    """Run ``action(session, actuator_url, pod_results, pod)`` on every pod of the deployments.
+
+    Up to ``ACTUATOR_WORKERS`` pods are handled at once, each with its own port forward session and
+    ``ACTUATOR_POD_TIMEOUT`` seconds for all its requests. A pod's tables are sent as soon as it is done;
+    a pod whose action fails, for whatever reason, gets an error row instead."""
     with KubernetesConnection(ctx, namespace) as conn:
+        deployment_pods = {}
         for deployment in deployments:
             label_selector = f'deployment={deployment}'
             all_pods: kubernetes.client.V1PodList = conn.core_v1_api.list_namespaced_pod(namespace=conn.project_name,
@@ -130,19 +138,38 @@ def _actuator_action(ctx: ExtendedContext, namespace: str, deployments: list[str
                     f"Couldn't find any pods on {conn.project_name} to {action_names[0]} for {deployment}",
                     is_error=True)
                 continue
-
-            pods_actioned_successful = 0
-            pod_results = {}
-            for pod_to_refresh in pods_to_refresh:
-                with conn.port_forward():
-                    try:
-                        action(conn, pod_results, pod_to_refresh)
-                        pods_actioned_successful += 1
-                    except requests.exceptions.ConnectionError as ex:
-                        pod_results[pod_to_refresh] = [{'State': 'Error', 'Message': repr(ex)}]
-            ctx.chat.send_text(
-                f"{action_names[1]} {pods_actioned_successful}/{len(pods_to_refresh)} pods for {deployment}")
-            ctx.chat.send_tables('PodStatus', pod_results, table_format=table_format)
+            deployment_pods[deployment] = pods_to_refresh
+        if not deployment_pods:
+            return
+
+        pods_actioned_successful = collections.Counter()
+        pod_count = sum(len(pods_to_refresh) for pods_to_refresh in deployment_pods.values())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(ACTUATOR_WORKERS, pod_count)) as executor:
+            futures = {
+                executor.submit(_pod_action, conn, action, pod_to_refresh): deployment
+                for deployment, pods_to_refresh in deployment_pods.items()
+                for pod_to_refresh in pods_to_refresh}
+            for future in concurrent.futures.as_completed(futures):
+                pod_results, successful = future.result()
+                pods_actioned_successful[futures[future]] += successful
+                if pod_results:
+                    ctx.chat.send_tables('PodStatus', pod_results, table_format=table_format)
+
+    for deployment, pods_to_refresh in deployment_pods.items():
+        ctx.chat.send_text(
+            f"{action_names[1]} {pods_actioned_successful[deployment]}/{len(pods_to_refresh)} pods for {deployment}")
+
+
+def _pod_action(conn: KubernetesConnection, action: Callable, pod: str) -> tuple[dict, bool]:
+    pod_results = {}
+    actuator_url = f'http://{pod}.pod.{conn.project_name}.kubernetes:{ACTUATOR_PORT}/actuator'
+    try:
+        with conn.port_forward(deadline=time.monotonic() + ACTUATOR_POD_TIMEOUT) as session:
+            action(session, actuator_url, pod_results, pod)
+        return pod_results, True
+    except Exception as ex:
+        pod_results[pod] = [{'State': 'Error', 'Message': repr(ex)}]
+        return pod_results, False
 
 
 @actuator.command('pods')
@@ -154,8 +181,7 @@ def _actuator_action(ctx: ExtendedContext, namespace: str, deployments: list[str
 def pods(ctx: ExtendedContext, namespace: str, pod_name: str = None, table_format: TableFormat = TableFormat.TABLE):
     with KubernetesConnection(ctx, namespace) as conn:
         label_selector = f'deployment={pod_name}' if pod_name else None
-        all_pods: kubernetes.client.V1PodList = conn.core_v1_api.list_namespaced_pod(namespace=conn.project_name,
-                                                                                     label_selector=label_selector)
+        all_pods = list_objects(conn, 'pods', label_selector)
 
         fields = ["Deployment", "Name", "Ready", "Status", "Restarts", "Host IP", "Pod IP"]
         pods_list = [dict(zip(fields, [
@@ -165,104 +191,88 @@ def pods(ctx: ExtendedContext, namespace: str, pod_name: str = None, table_forma
             pod.status.phase,
             sum([cs.restart_count for cs in pod.status.container_statuses]),
             pod.status.host_ip,
-            pod.status.pod_ip])) for pod in all_pods.items]
+            pod.status.pod_ip])) for pod in all_pods]
         ctx.chat.send_table(title=f"pods-{conn.project_name}", table=pods_list, table_format=table_format)
 
 
-def _environment_table(pod_env_raw):
-    env_current = json.loads(pod_env_raw.content)
+class EnvironmentValue(NamedTuple):
+    value: object
+    origin: Optional[str]
+    source: str  # name of the property source the value comes from
 
-    if 'propertySources' in env_current:  # Spring Boot v2+
-        property_sources = env_current.get('propertySources')
-        bootstrap_properties = [prop for prop in property_sources if prop['name'].startswith('bootstrapProperties')]
-        if not bootstrap_properties:
-            return [
-                {'Status': 'Error',
-                 'Message': "Could not find property sources in environment (maybe spring boot 2.7?)"}]
-        property_root = {}
-        for bootstrap_property in bootstrap_properties:
-            if bootstrap_property['properties'] == {}:
-                continue
-            common_keys = list(set(bootstrap_property['properties'].keys()) & set(property_root.keys()))
-            # assert not common_keys
-            property_root.update(bootstrap_property['properties'])
-        complex_properties = True
-    elif 'bootstrapProperties' in env_current:  # Spring Boot v1.5, only one dictionary, get to it directly
-        property_root = env_current.get('bootstrapProperties')
-        complex_properties = False
-    else:
-        return [{'Status': 'Error', 'Message': "Could not find property sources in environment"}]
-
-    all_values = []
-    for prop_name, prop_value in sorted(property_root.items()):
-        if complex_properties:
-            real_value = prop_value['value']
-            prop_origin = prop_value.get('origin')
-        else:
-            real_value = prop_value
-            prop_origin = None
 
-        if type(real_value) is str and real_value.startswith('-----BEGIN CERTIFICATE-----\n'):
-            cert = x509.load_pem_x509_certificate(real_value.encode())
-            real_value = (f"Certificate ({cert.serial_number}) "
-                          f"valid {cert.not_valid_before_utc} — {cert.not_valid_after_utc} (UTC)")
+_MISSING = EnvironmentValue(None, None, None)
+
 
-        all_values.append({
+class Environment:
+    """Properties of an ``/actuator/env`` response, parsed once into the value that applies to each key"""
+
+    def __init__(self, env_raw: dict):
+        self.properties: Dict[str, EnvironmentValue] = {}
+        self.error: Optional[str] = None
+        if 'propertySources' in env_raw:  # Spring Boot v2+, each value is a dictionary with value and origin
+            property_sources = [(ps['name'], ps.get('properties') or {}) for ps in env_raw['propertySources']]
+            complex_properties = True
+        elif 'bootstrapProperties' in env_raw:  # Spring Boot v1.5, each source is a dictionary of plain values
+            property_sources = [(name, props) for name, props in env_raw.items() if isinstance(props, dict)]
+            complex_properties = False
+        else:
+            self.error = "Could not find property sources in environment"
+            return
+        if not any(name.startswith('bootstrapProperties') for name, _ in property_sources):
+            self.error = "Could not find property sources in environment (maybe spring boot 2.7?)"
+        for source, properties in property_sources:  # in order of precedence, the first source of a key wins
+            for prop_name, prop_value in properties.items():
+                if prop_name in self.properties:
+                    continue
+                if complex_properties and isinstance(prop_value, dict):
+                    self.properties[prop_name] = EnvironmentValue(prop_value.get('value'), prop_value.get('origin'),
+                                                                  source)
+                else:
+                    self.properties[prop_name] = EnvironmentValue(prop_value, None, source)
+
+    @classmethod
+    def from_response(cls, response: requests.Response) -> 'Environment':
+        response.raise_for_status()
+        return cls(response.json())
+
+    def table(self) -> List[Dict]:
+        """The properties that come from the bootstrap (config server) sources"""
+        if self.error:
+            return [{'Status': 'Error', 'Message': self.error}]
+        return [{
             'name': prop_name,
-            'value': real_value,
-            'origin': prop_origin})
-    return all_values
-
-
-def _environment_changes_table(pod_env_before_raw, pod_env_after_raw, result_list):
-    env_before = json.loads(pod_env_before_raw.content)
-    env_after = json.loads(pod_env_after_raw.content)
-    values_before = {}
-    values_after = {}
-    for c in result_list:
-        property_names = ('bootstrapProperties', 'propertySources')
-        if not any([p in env_before for p in property_names]) or not any([p in env_after for p in property_names]):
-            return [{'State': 'Error', 'Message': "Could not find property sources in environment"}]
-        for ps in env_before.get('propertySources', env_before.get('bootstrapProperties', [])):
-            try:
-                if c in ps['properties']:
-                    values_before[c] = ps['properties'][c]
-            except TypeError:
-                return [{'State': 'Error', 'Message': f"Error when reading environment before for {c}"}]
-        for ps in env_after.get('propertySources', env_after.get('bootstrapProperties', [])):
-            if c in ps['properties']:
-                values_after[c] = ps['properties'][c]
-    return [{
-        'variable': c,
-        'before': values_before.get(c, {'value': None})['value'],
-        'after_value': values_after.get(c, {'value': None})['value'],
-        'after_origin': values_after.get(c, {'origin': None}).get('origin')}
-        for c in result_list]
-
-
-def _send_results(ctx: ExtendedContext,
-                  pod_to_refresh: str,
-                  pod_env_before: requests.Response,
-                  refresh_result: requests.Response,
-                  pod_env_after: requests.Response):
-    refresh_actuator_result = refresh_result.json()
-    if type(refresh_actuator_result) is list:
-        value_types = [isinstance(rar, str) for rar in refresh_actuator_result]
-        all_values_are_strings = all(value_types)
-    else:
-        all_values_are_strings = False
-    if refresh_result.ok and refresh_actuator_result and all_values_are_strings:
-        refresh_actuator_result_list = rangify(refresh_actuator_result, consolidate=False)
-        # ctx.chat.send_text('```\n' + '\n'.join(result_list) + '\n```\n')
-        if full_changes := _environment_changes_table(pod_env_before, pod_env_after, refresh_actuator_result_list):
-            ctx.chat.send_table(f"Changes for pod {pod_to_refresh}", full_changes)
-    else:
-        ctx.chat.send_file(
-            file_data=pod_env_before.content,
-            filename=f'pod_env_before_raw-{pod_to_refresh}.json')
-        ctx.chat.send_file(
-            file_data=refresh_result.content,
-            filename=f'actuator-refresh-{pod_to_refresh}.json')
-        ctx.chat.send_file(
-            file_data=pod_env_after.content,
-            filename=f'pod_env_after_raw-{pod_to_refresh}.json')
+            'value': _display_value(prop.value),
+            'origin': prop.origin}
+            for prop_name, prop in sorted(self.properties.items()) if prop.source.startswith('bootstrapProperties')]
+
+    def diff(self, other: 'Environment') -> List[Dict]:
+        """Properties whose value is different in ``other``, in one pass over both"""
+        if self.error or other.error:
+            return [{'State': 'Error', 'Message': self.error or other.error}]
+        changed = [prop_name for prop_name in self.properties.keys() | other.properties.keys()
+                   if self.properties.get(prop_name, _MISSING).value != other.properties.get(prop_name, _MISSING).value]
+        return [{
+            'variable': prop_name,
+            'before': _display_value(self.properties.get(prop_name, _MISSING).value),
+            'after_value': _display_value(other.properties.get(prop_name, _MISSING).value),
+            'after_origin': other.properties.get(prop_name, _MISSING).origin}
+            for prop_name in sorted(changed)]
+
+
+def _display_value(value):
+    if type(value) is str and value.startswith('-----BEGIN CERTIFICATE-----\n'):
+        cert = x509.load_pem_x509_certificate(value.encode())
+        return (f"Certificate ({cert.serial_number}) "
+                f"valid {cert.not_valid_before_utc} — {cert.not_valid_after_utc} (UTC)")
+    return value
+
+
+def _group_changes(pod_changes: Dict[str, List[Dict]]) -> Dict[str, List[Dict]]:
+    """One table for every set of identical changes, titled with the pods that had them"""
+    groups = {}
+    for pod in sorted(pod_changes):
+        changes = pod_changes[pod]
+        _, pods = groups.setdefault(json.dumps(changes, sort_keys=True, default=str), (changes, []))
+        pods.append(pod)
+    return {', '.join(pods): changes or [{'State': 'No changes'}] for changes, pods in groups.values()}
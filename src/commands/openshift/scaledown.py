@@ -6,6 +6,7 @@ from ruamel.yaml import YAML
 from commands import gyrobot, DefaultCommandGroup
 from commands.extended_context import ExtendedContext
 from commands.openshift.api import KubernetesConnection
+from commands.openshift.bulk_patch import bulk_patch, patch_results_table
 from commands.openshift.common import OpenShiftNamespace
 from backend.configuration import read_config, check_security
 
@@ -35,35 +36,41 @@ def scaledown(ctx: ExtendedContext):
                        'ignore_unknown_options': True,
                        'allow_extra_args': True})
 @click.argument('namespace', type=OpenShiftNamespace(_scaledown_config()))
+@click.option('--dry-run', 'dry_run', is_flag=True, default=False, help='Validate on the server without scaling')
 @click.pass_context
-def scaledown_default(ctx: ExtendedContext, namespace: str):
+def scaledown_default(ctx: ExtendedContext, namespace: str, dry_run: bool = False):
     ctx.forward(scaledown_do)
 
 
 @scaledown.command('do')
 @click.argument('namespace', type=OpenShiftNamespace(_scaledown_config()))
+@click.option('--dry-run', 'dry_run', is_flag=True, default=False, help='Validate on the server without scaling')
 @click.pass_context
 @check_security
-def scaledown_do(ctx: ExtendedContext, namespace):
+def scaledown_do(ctx: ExtendedContext, namespace, dry_run: bool = False):
+    excluded_deployments = set(ctx.obj['config'].get('~deployments', []))
+    excluded_statefulsets = set(ctx.obj['config'].get('~statefulsets', []))
     with KubernetesConnection(ctx, namespace) as k8s:
-        deployments_to_scaledown = k8s.apps_v1_api.list_namespaced_deployment(k8s.project_name)
-        if len(deployments_to_scaledown.items) == 0:
-            ctx.chat.send_text(f"Couldn't find any deployments on {namespace} to scale down", is_error=True)
+        deployments = k8s.apps_v1_api.list_namespaced_deployment(k8s.project_name)
+        statefulsets = k8s.apps_v1_api.list_namespaced_stateful_set(k8s.project_name)
+        deployment_names = [d.metadata.name for d in deployments.items if d.metadata.name not in excluded_deployments]
+        statefulset_names = [s.metadata.name for s in statefulsets.items
+                             if s.metadata.name not in excluded_statefulsets]
+        if not deployment_names and not statefulset_names:
+            ctx.chat.send_text(f"Couldn't find any deployments or statefulsets on {namespace} to scale down",
+                               is_error=True)
             return
 
-        results = []
-        for deployment_to_scaledown in deployments_to_scaledown.items:
-            if deployment_to_scaledown in ctx.obj['config'].get('~deployments', []): continue  # ignore deployment
-            result = k8s.apps_v1_api.patch_namespaced_replica_set_scale(
-                deployment_to_scaledown.metadata.name, k8s.project_name,
-                {'spec': {'replicas': 0}})
-            results.append(result)
-
-        for resource_to_scaledown in deployments_to_scaledown.items:
-            if resource_to_scaledown in ctx.obj['config'].get('~statefulsets', []): continue  # ignore statefulset
-            result = k8s.apps_v1_api.patch_namespaced_stateful_set_scale(
-                resource_to_scaledown.metadata.name, k8s.project_name,
-                {'spec': {'replicas': 0}})
-            results.append(result)
-
-        ctx.chat.send_table(title=f"scaledown-{k8s.project_name}", table=results)
+        scale_body = {'spec': {'replicas': 0}}
+        deployment_results = bulk_patch(k8s.apps_v1_api.patch_namespaced_deployment_scale, k8s.project_name,
+                                        'Deployment', deployment_names, scale_body, dry_run)
+        statefulset_results = bulk_patch(k8s.apps_v1_api.patch_namespaced_stateful_set_scale, k8s.project_name,
+                                         'StatefulSet', statefulset_names, scale_body, dry_run)
+
+    results_table = patch_results_table(deployment_results + statefulset_results, _make_scale_row, dry_run,
+                                        with_kind=True)
+    ctx.chat.send_table(title=f"scaledown-{k8s.project_name}", table=results_table)
+
+
+def _make_scale_row(scale) -> dict:
+    return {'Name': scale.metadata.name, 'Replicas': scale.spec.replicas}
@@ -1,41 +1,31 @@
-import base64
-import collections
 import datetime
-import json
 import os
 import pathlib
 import re
 import urllib.parse
-import zlib
 
 import click
 import praw
-import requests
 import unicodedata
-from requests.adapters import HTTPAdapter
-from requests.structures import CaseInsensitiveDict
 
-from bot_framework.yaml_wrapper import yaml
+from backend.configuration import truthy_env
 from commands import gyrobot, DefaultCommandGroup, ClickAliasedGroup
 from commands.extended_context import ExtendedContext
-from commands.reddit.common import extract_username, extract_real_thread_id
+from commands.reddit.archiver import archive_urls
+from commands.reddit.common import ShortLinkError, extract_username, extract_real_thread_id
+from commands.reddit.crowd_control import load_config, update_config, ensure_monitor, fetch_submission_metadata
+from commands.reddit.modqueue_snapshot import current_snapshot, ensure_poller, pack_sections, top_authors, \
+    SLACK_MAX_BLOCKS
+from commands.reddit.toolbox import usernotes_cache, toolbox_config_cache, update_toolbox_config, ToolboxConflict
 from state_file import state_file
 
 if 'SUBREDDIT_NAME' not in os.environ:
     raise ImportError('SUBREDDIT_NAME not found in environment')
 
-ARCHIVE_URL = 'http://archive.is'
-CHROME_USER_AGENT = (
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
-    'AppleWebKit/537.36 (KHTML, like Gecko) '
-    'Chrome/77.0.3865.90 Safari/537.36')
-
-_archive_session = requests.Session()
-_archive_session.mount(ARCHIVE_URL, HTTPAdapter(max_retries=5))
-
 
 def _send_usernote(ctx: ExtendedContext, redditor_username, notes, warnings, usernote_colors, mod_names, verbose):
     text = f'Usernotes for user {redditor_username}'
+    subreddit_url = ctx.subreddit_context.subreddit_url
     fields = []
     for note in notes['ns']:
         warning = warnings[note['w']] or ''
@@ -47,12 +37,9 @@ def _send_usernote(ctx: ExtendedContext, redditor_username, notes, warnings, use
         link_href = '???'
         if link_parts[0] == 'l':
             if len(link_parts) == 2:
-                link_href = (f'{ctx.reddit_session.config.reddit_url}/r/'
-                             f'{ctx.subreddit.display_name}/comments/{link_parts[1]}')
+                link_href = f'{subreddit_url}/comments/{link_parts[1]}'
             elif len(link_parts) == 3:
-                link_href = (
-                    f'{ctx.reddit_session.config.reddit_url}/r/{ctx.subreddit.display_name}/comments/'
-                    f'{link_parts[1]}/-/{link_parts[2]}')
+                link_href = f'{subreddit_url}/comments/{link_parts[1]}/-/{link_parts[2]}'
         else:
             link_href = note['l']
         mod_name = mod_names[note['m']]
@@ -79,67 +66,65 @@ def _send_usernote(ctx: ExtendedContext, redditor_username, notes, warnings, use
 
 
 @gyrobot.group('modqueue', cls=DefaultCommandGroup)
-def modqueue():
-    pass
+@click.pass_context
+def modqueue(ctx: ExtendedContext):
+    ensure_poller(ctx)
 
 
 @modqueue.command('posts')
 @click.pass_context
-def modqueue_posts(ctx):
+def modqueue_posts(ctx: ExtendedContext):
     """Display posts from the modqueue"""
+    snapshot = current_snapshot(ctx.subreddit)
     text = ''
-    for s in ctx.subreddit.mod.modqueue(only='submissions'):
-        text += s.title + '\n' + s.url + '\n'
-    else:
+    for s in snapshot.of_kind('submission'):
+        text += s.text + '\n' + s.url + '\n'
+    if not text:
         text = "No posts in modqueue"
     ctx.chat.send_text(text)
 
 
 @modqueue.command('comments')
 @click.pass_context
-def modqueue_comments(ctx):
+def modqueue_comments(ctx: ExtendedContext):
     """Display comments from the modqueue"""
+    snapshot = current_snapshot(ctx.subreddit)
     text = ''
-    for c in ctx.subreddit.mod.modqueue(only='comments', limit=10):
-        text += ctx.reddit_session.config.reddit_url + c.permalink + '\n```\n' + c.body[:80] + '\n```\n'
-    else:
+    reddit_url = ctx.subreddit_context.reddit_url
+    for c in snapshot.of_kind('comment')[:10]:
+        text += reddit_url + c.permalink + '\n```\n' + c.text + '\n```\n'
+    if not text:
         text = "No comments in modqueue"
     ctx.chat.send_text(text)
 
 
 @modqueue.command('grouped')
+@click.argument('limit', type=int, required=False)
 @click.pass_context
-def modqueue_grouped(ctx):
-    modqueue_list = list(ctx.subreddit.mod.modqueue(limit=None))
-    if len(modqueue_list) < 1:
+def modqueue_grouped(ctx: ExtendedContext, limit: int = None):
+    """Show users with more than one item in the modqueue. Optionally show only the top LIMIT users"""
+    snapshot = current_snapshot(ctx.subreddit)
+    if len(snapshot) < 1:
         ctx.chat.send_text('Modqueue is empty!', is_error=True)
         return
-    grouped_step_1 = collections.Counter([mq.author for mq in modqueue_list])
-    grouped_step_2 = sorted(grouped_step_1.items(), key=lambda x: -x[1])
-    grouped_step_3 = [item for item in grouped_step_2 if item[1] > 1]
-    grouped_items = [f"{item[1]} items from <{ctx.reddit_session.config.reddit_url}/u/{item[0].name}|{item[0].name}>"
-                     for item in grouped_step_3]
+    reddit_url = ctx.subreddit_context.reddit_url
+    grouped_items = [f"{count} items from <{reddit_url}/u/{author}|{author}>"
+                     for author, count in top_authors(snapshot, limit)]
     if len(grouped_items) < 1:
         ctx.chat.send_text('No duplicate entries in modqueue!', is_error=True)
         return
-    inner_text = ''
-    blocks = []
-    for item in grouped_items:
-        if len(inner_text) < 2000:
-            inner_text += item + '\n'
-        else:
-            blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": inner_text.strip('\n')}})
-            inner_text = ''
-    blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": inner_text}})
-    ctx.chat.send_blocks(blocks)
+    blocks = list(pack_sections(grouped_items))
+    for start in range(0, len(blocks), SLACK_MAX_BLOCKS):
+        ctx.chat.send_blocks(blocks[start:start + SLACK_MAX_BLOCKS])
 
 
 @modqueue.command('length', default_command=True)
 @click.pass_context
 def modqueue_length(ctx):
     """Show modqueue length"""
-    posts_modqueue_length = len(list(ctx.subreddit.mod.modqueue(only='submissions', limit=None)))
-    comments_modqueue_length = len(list(ctx.subreddit.mod.modqueue(only='comments', limit=None)))
+    snapshot = current_snapshot(ctx.subreddit)
+    posts_modqueue_length = len(snapshot.of_kind('submission'))
+    comments_modqueue_length = len(snapshot.of_kind('comment'))
     modmail_open_length = len(list(ctx.subreddit.modmail.conversations(limit=1000)))
     post_descr = 'posts' if posts_modqueue_length != 1 else 'post'
     comment_descr = 'comments' if comments_modqueue_length != 1 else 'comment'
@@ -154,10 +139,9 @@ def modqueue_length(ctx):
             creature += f"\nBut {modmail_open_length} {modmail_descr} remain"
         ctx.chat.send_text(creature)
     else:
-        reddit_url = ctx.reddit_session.config.reddit_url
-        subreddit_name = ctx.subreddit.display_name
-        modqueue_comments_url = f"{reddit_url}/r/{subreddit_name}/about/modqueue?only=comments"
-        modqueue_posts_url = f"{reddit_url}/r/{subreddit_name}/about/modqueue?only=links"
+        subreddit_url = ctx.subreddit_context.subreddit_url
+        modqueue_comments_url = f"{subreddit_url}/about/modqueue?only=comments"
+        modqueue_posts_url = f"{subreddit_url}/about/modqueue?only=links"
 
         text = (f"Modqueue contains <{modqueue_posts_url}|{posts_modqueue_length} {post_descr}>, "
                 f"<{modqueue_comments_url}|{comments_modqueue_length} {comment_descr}> and "
@@ -170,32 +154,66 @@ def modqueue_length(ctx):
 
 
 @gyrobot.command('usernotes')
-@click.argument('user')
-@click.argument('verbose', required=False)
+@click.argument('users', nargs=-1, required=True)
 @click.pass_context
-def usernotes(ctx: ExtendedContext, user, verbose=None):
-    """Display usernotes of a user"""
-    redditor_username = user
-    if (redditor_username := extract_username(redditor_username)) is None:
-        ctx.chat.send_text(f'{redditor_username} is not a valid username', is_error=True)
+def usernotes(ctx: ExtendedContext, users):
+    """Display usernotes of a user
+
+    Syntax:
+    usernotes USER [short|long]
+    usernotes USER1 USER2 ...: summary of usernotes for many users
+    usernotes bulk USER1 ...: summary of usernotes, even for a single user"""
+    users = list(users)
+    verbose = ''
+    if len(users) > 1 and users[-1].lower() in ('short', 'long'):
+        verbose = users.pop().lower()
+    if users[0].lower() == 'bulk':
+        _usernotes_bulk(ctx, users[1:])
+        return
+    if len(users) > 1:
+        _usernotes_bulk(ctx, users)
         return
-    verbose = verbose or ''
-    if verbose.lower() not in ('short', 'long'):
-        verbose = ''
-    tb_notes = ctx.subreddit.wiki['usernotes']
-    tb_notes_1 = json.loads(tb_notes.content_md)
-    warnings = tb_notes_1['constants']['warnings']
-    tb_notes_2 = CaseInsensitiveDict(json.loads(zlib.decompress(base64.b64decode(tb_notes_1['blob'])).decode()))
-    tb_config = json.loads(ctx.subreddit.wiki['toolbox'].content_md)
-    usernote_colors = {c['key']: c for c in tb_config['usernoteColors']}
-    notes = tb_notes_2.get(redditor_username.lower())
+    user = users[0]
+    if (redditor_username := extract_username(user)) is None:
+        ctx.chat.send_text(f'{user} is not a valid username', is_error=True)
+        return
+    tb_notes = usernotes_cache.get(ctx.subreddit)
+    notes = tb_notes.get(redditor_username)
     if notes is None:
         ctx.chat.send_text(f"user {redditor_username} doesn't have any user notes")
         return
+    tb_config = toolbox_config_cache.get(ctx.subreddit)
+
+    _send_usernote(ctx, redditor_username, notes, tb_notes.warnings, tb_config.usernote_colors, tb_notes.mod_names,
+                   verbose)
 
-    mod_names = tb_notes_1['constants']['users']
 
-    _send_usernote(ctx, redditor_username, notes, warnings, usernote_colors, mod_names, verbose)
+def _usernotes_bulk(ctx: ExtendedContext, users):
+    usernames = [extract_username(user) for user in users]
+    invalid_users = [u for u, username in zip(users, usernames) if username is None]
+    if invalid_users:
+        ctx.chat.send_text(f"{', '.join(invalid_users)} are not valid usernames", is_error=True)
+        return
+    if not usernames:
+        ctx.chat.send_text("No users specified", is_error=True)
+        return
+    tb_notes = usernotes_cache.get(ctx.subreddit)
+    tb_config = toolbox_config_cache.get(ctx.subreddit)
+    result_table = []
+    for username in usernames:
+        notes = tb_notes.get(username)
+        if not notes or not notes['ns']:
+            result_table.append({'User': username, 'Notes': 0, 'Last Type': None, 'Last Date': None, 'Last Note': None})
+            continue
+        last_note = max(notes['ns'], key=lambda n: n['t'])
+        warning = tb_notes.warnings[last_note['w']] or ''
+        result_table.append({
+            'User': username,
+            'Notes': len(notes['ns']),
+            'Last Type': tb_config.usernote_colors.get(warning, {'text': '?' + warning})['text'],
+            'Last Date': datetime.datetime.fromtimestamp(last_note['t']),
+            'Last Note': last_note['n']})
+    ctx.chat.send_table(title='usernotes', table=result_table)
 
 
 @gyrobot.command('youtube_post_info')
@@ -203,7 +221,11 @@ def usernotes(ctx: ExtendedContext, user, verbose=None):
 @click.pass_context
 def youtube_post_info(ctx: ExtendedContext, url):
     """Get YouTube media URL"""
-    thread_id = extract_real_thread_id(url)
+    try:
+        thread_id = extract_real_thread_id(url)
+    except ShortLinkError as ex:
+        ctx.chat.send_text(str(ex), is_error=True)
+        return
     post = ctx.reddit_session.submission(thread_id)
     post._fetch()
     media = getattr(post, 'media', None)
@@ -217,31 +239,74 @@ def youtube_post_info(ctx: ExtendedContext, url):
         ctx.chat.send_text(repr(e), is_error=True)
 
 
-@gyrobot.command('add_domain_tag')
-@click.argument('url')
-@click.argument('color')
-@click.pass_context
-def add_domain_tag(ctx: ExtendedContext, url, color):
-    """Add a tag to a domain"""
-    toolbox_data = json.loads(ctx.subreddit.wiki['toolbox'].content_md)
+def _domain_tag_name(url):
     if re.match('<.*>', url):
         url = url[1:-1]
     url_obj = urllib.parse.urlparse(url)
     final_url = url_obj.netloc
     if len(url_obj.path) > 1:
         final_url += url_obj.path
-    if not re.match(r'\#[0-9a-f]{6}', color, re.IGNORECASE):
+    return final_url
+
+
+def _valid_tag_color(color):
+    return re.match(r'\#[0-9a-f]{6}', color, re.IGNORECASE) is not None
+
+
+@gyrobot.command('add_domain_tag')
+@click.argument('url')
+@click.argument('color')
+@click.pass_context
+def add_domain_tag(ctx: ExtendedContext, url, color):
+    """Add a tag to a domain"""
+    final_url = _domain_tag_name(url)
+    if not _valid_tag_color(color):
         ctx.chat.send_text(f"{color} is not a good color on you!")
         return
-    entry = [tag for tag in toolbox_data['domainTags'] if tag['name'] == final_url]
-    if entry:
-        entry['color'] = color
-    else:
-        toolbox_data['domainTags'].append({'name': final_url, 'color': color})
-    ctx.subreddit.wiki['toolbox'].edit(json.dumps(toolbox_data), 'Updated by slack')
+    try:
+        _, conflicts = update_toolbox_config(ctx.subreddit, lambda config: config.set_domain_tag(final_url, color),
+                                             'Updated by slack')
+    except ToolboxConflict as ex:
+        ctx.chat.send_text(f"{ex}, the tag was not changed. Please try again.", is_error=True)
+        return
+    if conflicts:
+        ctx.chat.send_text("Toolbox configuration was edited by someone else in the meantime, "
+                           "the tag was applied on top of their changes")
     ctx.chat.send_text(f"Added color {color} for domain {final_url}")
 
 
+@gyrobot.command('add_domain_tags')
+@click.argument('tags', nargs=-1, required=True)
+@click.pass_context
+def add_domain_tags(ctx: ExtendedContext, tags):
+    """Add tags to many domains in one edit
+
+    Syntax:
+    add_domain_tags URL1 COLOR1 URL2 COLOR2 ..."""
+    if len(tags) % 2 != 0:
+        ctx.chat.send_text("Domains and colors should come in pairs", is_error=True)
+        return
+    tag_changes = [(_domain_tag_name(url), color) for url, color in zip(tags[0::2], tags[1::2])]
+    bad_colors = [color for _, color in tag_changes if not _valid_tag_color(color)]
+    if bad_colors:
+        ctx.chat.send_text(f"{', '.join(bad_colors)} are not good colors on you!", is_error=True)
+        return
+
+    def _apply_tags(config):
+        return [{'Domain': name, 'Color': color, 'Result': config.set_domain_tag(name, color)}
+                for name, color in tag_changes]
+
+    try:
+        result_table, conflicts = update_toolbox_config(ctx.subreddit, _apply_tags, 'Updated by slack')
+    except ToolboxConflict as ex:
+        ctx.chat.send_text(f"{ex}, no tags were changed. Please try again.", is_error=True)
+        return
+    if conflicts:
+        ctx.chat.send_text("Toolbox configuration was edited by someone else in the meantime, "
+                           "tags were applied on top of their changes")
+    ctx.chat.send_table(title='domain_tags', table=result_table)
+
+
 @gyrobot.command('add_policy')
 @click.argument('title')
 @click.pass_context
@@ -262,50 +327,32 @@ def add_policy(ctx: ExtendedContext, title):
     ctx.chat.send_text(f"Policy recorded: `{new_content.strip()}`")
 
 
-def _archive_page(url):
-    url = url.replace('//www.reddit.com/', '//old.reddit.com/')
-
-    # start_page = requests.get(ARCHIVE_URL)
-    # soup = BeautifulSoup(start_page.text, 'lxml')
-    # main_form = soup.find('form', {'id': 'submiturl'})
-    # submit_id = main_form.find('input', {'name': 'submitid'})['value']
-    p2 = _archive_session.post(
-        f'{ARCHIVE_URL}/submit/',
-        data={
-            'url': url
-        },
-        headers={
-            'Referer': 'http://archive.is',
-            'User-Agent': CHROME_USER_AGENT})
-    if p2.url == f'{ARCHIVE_URL}/submit/':
-        return p2.headers['Refresh'][6:]
-    else:
-        return p2.url
-
-
 @gyrobot.command('archive')
 @click.argument('username')
+@click.option('--fresh', is_flag=True, default=False, help="Ignore results of a previous, interrupted run")
 @click.pass_context
-def archive_user(ctx: ExtendedContext, username):
+def archive_user(ctx: ExtendedContext, username, fresh=False):
     """\
     Archive all posts and comments of a user. This helps to preserve the
     account history when nuking the user's contribution (especially when
     the user then deletes their account).
-    Only one argument, the username"""
-    if (username := extract_username(username)) is None:
+    Only one argument, the username. An interrupted run continues where it
+    stopped, unless --fresh is given"""
+    if (redditor_username := extract_username(username)) is None:
         ctx.chat.send_text(f'{username} is not a valid username', is_error=True)
         return
-    user = ctx.reddit_session.redditor(username)
+    user = ctx.reddit_session.redditor(redditor_username)
+    reddit_url = ctx.subreddit_context.reddit_url
 
     urls_to_archive = []
-    urls_to_archive.append(f'{ctx.reddit_session.config.reddit_url}/user/{user.name}/submitted/')
+    urls_to_archive.append(f'{reddit_url}/user/{user.name}/submitted/')
 
     submissions = list(user.submissions.new(limit=None))
     for s in submissions:
-        urls_to_archive.append(ctx.reddit_session.config.reddit_url + s.permalink)
+        urls_to_archive.append(reddit_url + s.permalink)
 
     comments = list(user.comments.new(limit=None))
-    url_base = f'{ctx.reddit_session.config.reddit_url}/user/{user.name}/comments?sort=new'
+    url_base = f'{reddit_url}/user/{user.name}/comments?sort=new'
     urls_to_archive.append(url_base)
     for c in comments[24::25]:
         after = c.name
@@ -314,33 +361,24 @@ def archive_user(ctx: ExtendedContext, username):
     ctx.chat.send_file(
         file_data='\n'.join(urls_to_archive).encode(),
         filename=f'archive-{user}-request.txt')
-    final_urls = [_archive_page(url) for url in urls_to_archive]
-    ctx.chat.send_file(
-        file_data='\n'.join(final_urls).encode(),
-        filename=f'archive-{user}-response.txt')
 
+    results_file = pathlib.Path('data') / f'archive-{user}.tsv'
+    if fresh:
+        results_file.unlink(missing_ok=True)
 
-@gyrobot.command('history')
-@click.argument('username')
-@click.pass_context
-def do_history(ctx: ExtendedContext, username):
-    """\
-    Return full user comment history, including deleted comments
-    This should work for deleted users as well
-    Data comes from pushshift.io"""
-    comments = requests.get(
-        "http://api.pushshift.io/reddit/comment/search",
-        params={
-            'limit': 40,
-            'author': username,
-            'subreddit': ctx.subreddit.display_name}).json()
-    if not comments['data']:
-        ctx.chat.send_text(f"User u/{username} has no comments in r/{ctx.subreddit.display_name}")
-        return
-    comment_full_body = [comment['body'] for comment in comments['data']]
+    def _progress(done, total):
+        ctx.chat.send_text(f"Archived {done}/{total} pages for {user}...")
+
+    results, failed = archive_urls(urls_to_archive, results_file, _progress)
     ctx.chat.send_file(
-        file_data='\n'.join(comment_full_body).encode(),
-        filename=f'comment_history-{username}.txt')
+        file_data='\n'.join(results.values()).encode(),
+        filename=f'archive-{user}-response.txt')
+    if failed:
+        ctx.chat.send_file(
+            file_data='\n'.join(f'{url}\t{error}' for url, error in failed).encode(),
+            filename=f'archive-{user}-failed.txt')
+        ctx.chat.send_text(f"{len(failed)} pages could not be archived. Run the command again to retry them.",
+                           is_error=True)
 
 
 @gyrobot.command('comment_source')
@@ -363,29 +401,6 @@ def comment_source(ctx: ExtendedContext, comment_id):
         ctx.chat.send_text(repr(e), is_error=True)
 
 
-@gyrobot.command('deleted_comment_source')
-@click.argument('comment_id', nargs=-1)
-@click.pass_context
-def deleted_comment_source(ctx: ExtendedContext, comment_ids):
-    """\
-    Return comment source even if deleted. Use comment ids
-    Data comes from pushshift.io"""
-    ids = ','.join(comment_ids)
-    comments = requests.get(
-        "http://api.pushshift.io/reddit/comment/search",
-        params={
-            'limit': 40,
-            'ids': ids,
-            'subreddit': ctx.subreddit.display_name}).json()
-    if not comments['data']:
-        ctx.chat.send_text(f"No comments under those ids were found in r/{ctx.subreddit.display_name}")
-        return
-    comment_full_body = [comment['body'] for comment in comments['data']]
-    ctx.chat.send_file(
-        file_data='\n'.join(comment_full_body).encode(),
-        filename=f'comment_body-{ids}.txt')
-
-
 @gyrobot.group('configure_enhanced_crowd_control', cls=ClickAliasedGroup, aliases=['order66', 'order_66'])
 @click.pass_context
 def configure_enhanced_crowd_control(ctx):
@@ -395,47 +410,50 @@ def configure_enhanced_crowd_control(ctx):
     list/show: list all current threads
     add THREAD_ID or URL: add a new thread to the monitored threads
     del/delete/remove THREAD_ID or URL: delete the thread from the monitored threads
+    monitor: start monitoring the threads (if not already running) and show removal statistics
     """
-    config = {}
-    config_file = pathlib.Path(f'config/enhanced_crowd_control.yml')
-    if config_file.exists():
-        with config_file.open(mode='r', encoding='utf8') as y:
-            config = dict(yaml.load(y))
-    if ctx.subreddit.display_name not in config:
-        config[ctx.subreddit.display_name] = {
+    if ctx.subreddit.display_name not in load_config():
+        update_config(lambda config: config.setdefault(ctx.subreddit.display_name, {
             'slack': {'channel': '#something', 'url': 'https://hooks.slack.com/services/TEAM_ID/CHANNEL_ID/KEY'},
-            'threads': [{'action': 'remove', 'id': 'xxxxxx', 'last': None}]}
-        with config_file.open(mode='w', encoding='utf8') as y:
-            yaml.dump(config, y)
-    monitored_threads: list = config[ctx.subreddit.display_name]['threads']
-    ctx.obj['monitored_threads'] = monitored_threads
-    ctx.obj['config'] = config
-    ctx.obj['config_file'] = config_file
+            'threads': [{'action': 'remove', 'id': 'xxxxxx', 'last': None}]}))
+    if truthy_env('ENHANCED_CROWD_CONTROL_MONITOR'):
+        ensure_monitor(ctx)
+
+
+def _monitored_threads(ctx: ExtendedContext, config: dict) -> list:
+    return config.setdefault(ctx.subreddit.display_name, {}).setdefault('threads', [])
 
 
 @configure_enhanced_crowd_control.command('list', aliases=['show'])
 @click.pass_context
 def configure_enhanced_crowd_control_list(ctx):
-    monitored_threads = ctx.obj['monitored_threads']
+    monitored_threads = _monitored_threads(ctx, load_config())
+    missing_threads = [thread for thread in monitored_threads if 'date' not in thread or 'permalink' not in thread]
+    if missing_threads:
+        metadata = fetch_submission_metadata(ctx.reddit_session, [thread['id'] for thread in missing_threads])
+
+        def add_metadata(config):
+            threads = _monitored_threads(ctx, config)
+            for thread in threads:
+                if 'date' not in thread or 'permalink' not in thread:
+                    thread.update(metadata.get(thread['id'], {}))
+            return threads
+
+        monitored_threads = update_config(add_metadata)
     text = ""
+    reddit_url = ctx.subreddit_context.reddit_url
     for thread_index, thread in enumerate(monitored_threads):
-        if 'date' in thread and 'permalink' in thread:
-            submission_date = thread['date']
-            permalink = thread['permalink']
-        else:
-            s = ctx.reddit_session.submission(thread['id'])
-            s.comment_limit = 0
-            s._fetch()
-            submission_date = datetime.datetime.utcfromtimestamp(s.created_utc)
-            permalink = s.permalink
-            thread['date'] = submission_date
-            thread['permalink'] = permalink
+        submission_date = thread.get('date')
+        permalink = thread.get('permalink')
+        if submission_date is None or permalink is None:
+            text += f"{1 + thread_index}. {thread['id']} (not found)\n"
+            continue
         from_date = thread.get('from_date')
         to_date = thread.get('to_date')
         from_date_text = from_date.isoformat() if from_date else "-\u221e"
         to_date_text = to_date.isoformat() if to_date else "+\u221e"
         action_emoji = '\u274c' if thread['action'] == 'remove' else '\u2611'
-        text += (f"{1 + thread_index}. {action_emoji} {ctx.reddit_session.config.reddit_url}{permalink}\t"
+        text += (f"{1 + thread_index}. {action_emoji} {reddit_url}{permalink}\t"
                  f"(on {submission_date:%Y-%m-%d %H:%M:%S UTC}) "
                  f"(monitoring {from_date_text} \u2014 {to_date_text})")
         text += "\n"
@@ -446,59 +464,80 @@ def configure_enhanced_crowd_control_list(ctx):
 @click.argument('thread_id')
 @click.pass_context
 def configure_enhanced_crowd_control_add(ctx: ExtendedContext, thread_id):
-    monitored_threads = ctx.obj['monitored_threads']
-    thread_id = extract_real_thread_id(thread_id)
-    found = [t for t in monitored_threads if t['id'] == thread_id]
-    if found:
+    try:
+        thread_id = extract_real_thread_id(thread_id)
+    except ShortLinkError as ex:
+        ctx.chat.send_text(str(ex), is_error=True)
+        return
+    if any(t['id'] == thread_id for t in _monitored_threads(ctx, load_config())):
         ctx.chat.send_text(f"Ignoring addition request, {thread_id} has already been added", is_error=True)
-    else:
-        s = ctx.reddit_session.submission(thread_id)
-        s.comment_limit = 0
-        s._fetch()
-        submission_date = datetime.datetime.utcfromtimestamp(s.created_utc)
-        submission_subreddit = s.subreddit.display_name
-        submission_url = ctx.reddit_session.config.reddit_url + s.permalink
-        if s.subreddit.display_name.lower() != ctx.subreddit.display_name.lower():
-            ctx.chat.send_text(
-                f"Cannot add a thread that belongs to r/{submission_subreddit}. ({submission_url})",
-                is_error=True)
-            return
-        permalink = s.permalink
+        return
+    s = ctx.reddit_session.submission(thread_id)
+    s.comment_limit = 0
+    s._fetch()
+    submission_date = datetime.datetime.utcfromtimestamp(s.created_utc)
+    submission_subreddit = s.subreddit.display_name
+    submission_url = ctx.subreddit_context.reddit_url + s.permalink
+    if not ctx.subreddit_context.is_own_item(s):
+        ctx.chat.send_text(
+            f"Cannot add a thread that belongs to r/{submission_subreddit}. ({submission_url})",
+            is_error=True)
+        return
+
+    def add_thread(config):
+        monitored_threads = _monitored_threads(ctx, config)
+        if any(t['id'] == thread_id for t in monitored_threads):
+            return False  # added by someone else while the submission was being fetched
         monitored_threads.append({
             'action': 'remove',
             'id': thread_id,
             'last': None,
             'date': submission_date,
-            'permalink': permalink})
-        ctx.chat.send_text(f"Added {thread_id} ({submission_url})")
+            'permalink': s.permalink})
+        return True
 
-    with ctx.obj['config_file'].open(mode='w', encoding='utf8') as y:
-        yaml.dump(ctx.obj['config'], y)
+    if update_config(add_thread):
+        ctx.chat.send_text(f"Added {thread_id} ({submission_url})")
+    else:
+        ctx.chat.send_text(f"Ignoring addition request, {thread_id} has already been added", is_error=True)
 
 
 @configure_enhanced_crowd_control.command('del', aliases=['delete', 'remove'])
 @click.argument('thread_id')
 @click.pass_context
-def configure_enhanced_crowd_control_list(ctx: ExtendedContext, thread_id):
-    monitored_threads = ctx.obj['monitored_threads']
-    thread_id = extract_real_thread_id(thread_id)
-    remove_me = None
-    if re.match(r'^\d+$', thread_id):
-        remove_me = int(thread_id) - 1
-        thread_id = monitored_threads[remove_me]['id']
-    else:
+def configure_enhanced_crowd_control_del(ctx: ExtendedContext, thread_id):
+    try:
+        thread_id = extract_real_thread_id(thread_id)
+    except ShortLinkError as ex:
+        ctx.chat.send_text(str(ex), is_error=True)
+        return
+
+    def remove_thread(config):
+        monitored_threads = _monitored_threads(ctx, config)
+        if re.match(r'^\d+$', thread_id):
+            remove_me = int(thread_id) - 1
+            return monitored_threads.pop(remove_me)['id'] if 0 <= remove_me < len(monitored_threads) else None
         for thread_index, thread in enumerate(monitored_threads):
             if thread['id'] == thread_id:
-                remove_me = thread_index
-                break
-    if remove_me is not None:
-        monitored_threads.pop(remove_me)
-        ctx.chat.send_text(f"Removed {thread_id}")
+                return monitored_threads.pop(thread_index)['id']
+        return None
+
+    removed_thread_id = update_config(remove_thread)
+    if removed_thread_id is not None:
+        ctx.chat.send_text(f"Removed {removed_thread_id}")
     else:
         ctx.chat.send_text(f"{thread_id} not found", is_error=True)
 
-    with ctx.obj['config_file'].open(mode='w', encoding='utf8') as y:
-        yaml.dump(ctx.obj['config'], y)
+
+@configure_enhanced_crowd_control.command('monitor', aliases=['stats'])
+@click.pass_context
+def configure_enhanced_crowd_control_monitor(ctx: ExtendedContext):
+    monitor = ensure_monitor(ctx)
+    thread_stats = monitor.thread_stats()
+    if not thread_stats:
+        ctx.chat.send_text("Monitoring started, no threads have been handled yet")
+        return
+    ctx.chat.send_table(title='enhanced_crowd_control', table=thread_stats)
 
 
 @gyrobot.command('unicode_post')
@@ -506,7 +545,11 @@ def configure_enhanced_crowd_control_list(ctx: ExtendedContext, thread_id):
 @click.pass_context
 def unicode(ctx: ExtendedContext, thread_id):
     """Convert reddit post title to unicode code points"""
-    thread_id = extract_real_thread_id(thread_id)
+    try:
+        thread_id = extract_real_thread_id(thread_id)
+    except ShortLinkError as ex:
+        ctx.chat.send_text(str(ex), is_error=True)
+        return
     ctx.logger.debug(thread_id)
     ctx.logger.debug(ctx.reddit_session)
     post = ctx.reddit_session.submission(thread_id)
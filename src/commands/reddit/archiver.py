@@ -0,0 +1,123 @@
+import concurrent.futures
+import os
+import pathlib
+import threading
+import time
+import urllib.parse
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+ARCHIVE_URL = os.environ.get('ARCHIVE_URL', 'http://archive.is')
+ARCHIVE_WORKERS = int(os.environ.get('ARCHIVE_WORKERS', 4))
+ARCHIVE_HOST_INTERVAL = float(os.environ.get('ARCHIVE_HOST_INTERVAL', 2))
+ARCHIVE_RETRIES = int(os.environ.get('ARCHIVE_RETRIES', 3))
+ARCHIVE_PROGRESS_INTERVAL = float(os.environ.get('ARCHIVE_PROGRESS_INTERVAL', 10))
+CHROME_USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+    'AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/77.0.3865.90 Safari/537.36')
+
+_archive_session = requests.Session()
+_archive_session.mount(ARCHIVE_URL, HTTPAdapter(pool_maxsize=ARCHIVE_WORKERS))
+
+
+class _HostThrottle:
+    """Token bucket per host: up to ``burst`` requests start at once, and the bucket refills at ``burst`` requests
+    per ``interval`` seconds. With one token per worker, each worker can start a request every ``interval`` seconds.
+
+    A request that finds the bucket empty takes a token in advance and sleeps until it would have been refilled, so
+    waiting requests start in order."""
+
+    def __init__(self, interval: float, burst: int = 1):
+        self.interval = interval
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, Tuple[float, float]] = {}  # host -> (tokens, when they were counted)
+
+    def wait(self, url: str):
+        host = urllib.parse.urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            tokens, counted = self.buckets.get(host, (self.burst, now))
+            if self.interval > 0:
+                tokens = min(self.burst, tokens + (now - counted) * self.burst / self.interval)
+            else:
+                tokens = self.burst
+            tokens -= 1
+            self.buckets[host] = (tokens, now)
+        if tokens < 0:
+            time.sleep(-tokens * self.interval / self.burst)
+
+
+_throttle = _HostThrottle(ARCHIVE_HOST_INTERVAL, ARCHIVE_WORKERS)
+
+
+def _archive_page(url):
+    url = url.replace('//www.reddit.com/', '//old.reddit.com/')
+    submit_url = f'{ARCHIVE_URL}/submit/'
+    for attempt in range(1 + ARCHIVE_RETRIES):
+        _throttle.wait(submit_url)
+        try:
+            p2 = _archive_session.post(
+                submit_url,
+                data={
+                    'url': url
+                },
+                headers={
+                    'Referer': ARCHIVE_URL,
+                    'User-Agent': CHROME_USER_AGENT},
+                timeout=120)
+        except requests.exceptions.RequestException:
+            if attempt == ARCHIVE_RETRIES:
+                raise
+        else:
+            if p2.status_code != 429 and p2.status_code < 500:
+                break
+            if attempt == ARCHIVE_RETRIES:
+                p2.raise_for_status()
+        time.sleep(ARCHIVE_HOST_INTERVAL * 2 ** attempt)
+    if p2.url == submit_url:
+        return p2.headers['Refresh'][6:]
+    else:
+        return p2.url
+
+
+def _read_results(results_file: pathlib.Path) -> Dict[str, str]:
+    if not results_file.exists():
+        return {}
+    with results_file.open(encoding='utf8') as f:
+        return dict(line.rstrip('\n').split('\t', 1) for line in f if '\t' in line)
+
+
+def archive_urls(urls: Iterable[str], results_file: pathlib.Path, progress: Callable[[int, int], None] = None,
+                 progress_interval: float = ARCHIVE_PROGRESS_INTERVAL) -> Tuple[Dict[str, str], List[Tuple[str, str]]]:
+    """Submit urls to the archive in parallel, appending each result to ``results_file`` as soon as it arrives.
+
+    Urls that already have a result in ``results_file`` (from an interrupted earlier run) are not submitted again.
+    ``progress(done, total)`` is called at most every ``progress_interval`` seconds.
+    Returns the results for all urls and a list of (url, error) for the ones that failed."""
+    results = _read_results(results_file)
+    urls = list(dict.fromkeys(urls))
+    pending = [url for url in urls if url not in results]
+    total = len(urls)
+    done = total - len(pending)
+    failed = []
+    last_progress = time.monotonic()
+    with results_file.open(mode='a', encoding='utf8') as rf, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS) as executor:
+        futures = {executor.submit(_archive_page, url): url for url in pending}
+        for future in concurrent.futures.as_completed(futures):
+            url = futures[future]
+            done += 1
+            try:
+                results[url] = future.result()
+                rf.write(f'{url}\t{results[url]}\n')
+                rf.flush()
+            except Exception as ex:
+                failed.append((url, repr(ex)))
+            if progress and time.monotonic() - last_progress >= progress_interval:
+                progress(done, total)
+                last_progress = time.monotonic()
+    return {url: results[url] for url in urls if url in results}, failed
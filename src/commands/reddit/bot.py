@@ -1,25 +1,96 @@
+import collections
 import os
+import threading
+import time
+from typing import List, Optional, Tuple
 
 import click
+import praw
 
 from commands import gyrobot
 from commands.extended_context import ExtendedContext
+from commands.reddit.common import ShortLinkError, extract_real_thread_ids
+from commands.reddit.toolbox import latest_revision_id
 
 if 'REDDIT_ALT_USER' not in os.environ:
     raise ImportError('REDDIT_ALT_USER not found in environment')
 
 WIKI_PAGE_BAD_FORMAT = "Page should have a title (starting with `# `) at the first line and an empty line below that"
+WIKI_CACHE_SIZE = 64
+MAKE_BATCH_INTERVAL = float(os.environ.get('MAKE_BATCH_INTERVAL', 1))
 
+_wiki_cache: collections.OrderedDict = collections.OrderedDict()  # (subreddit, page, revision id) -> lines
+_protected_pages = set()
+_wiki_lock = threading.Lock()
 
-def _get_wiki_text(sr, wiki_page_name, revision_id=None):
-    if revision_id is None: revision_id = 'LATEST'
+
+def _protect_wiki_page(sr, wiki_page_name):
+    key = (sr.display_name.lower(), wiki_page_name)
+    if key in _protected_pages:
+        return
     wiki_page = sr.wiki[wiki_page_name]
     # If wiki page is not protected (i.e. "Only mods may edit and view"), protect it.
     if wiki_page.mod.settings()['permlevel'] != 2:
         wiki_page.mod.update(permlevel=2, listed=True)
-    wiki_text = wiki_page.content_md if revision_id == 'LATEST' else wiki_page.revision[revision_id].content_md
+    _protected_pages.add(key)
+
+
+def _get_wiki_revision(sr, wiki_page_name, revision_id=None) -> Tuple[Optional[str], List[str]]:
+    """Revision id and lines of a wiki page revision (the latest one by default).
+
+    A revision never changes, so its lines are kept in memory and the latest revision of a page is only downloaded
+    again when a newer one exists."""
+    if revision_id is None or revision_id == 'LATEST':
+        revision_id = latest_revision_id(sr.wiki[wiki_page_name])
+    _protect_wiki_page(sr, wiki_page_name)
+    key = (sr.display_name.lower(), wiki_page_name, revision_id)
+    with _wiki_lock:
+        if revision_id is not None and key in _wiki_cache:
+            _wiki_cache.move_to_end(key)
+            return revision_id, _wiki_cache[key]
+    wiki_page = sr.wiki[wiki_page_name]
+    wiki_text = wiki_page.content_md if revision_id is None else wiki_page.revision(revision_id).content_md
     wiki_lines = wiki_text.splitlines()
-    return wiki_lines
+    if revision_id is not None:
+        with _wiki_lock:
+            _wiki_cache[key] = wiki_lines
+            while len(_wiki_cache) > WIKI_CACHE_SIZE:
+                _wiki_cache.popitem(last=False)
+    return revision_id, wiki_lines
+
+
+def _get_wiki_text(sr, wiki_page_name, revision_id=None):
+    return _get_wiki_revision(sr, wiki_page_name, revision_id)[1]
+
+
+def _find_sticky_comment(submission: praw.models.Submission, username: str) -> Optional[praw.models.Comment]:
+    """The comment of the user stickied in the submission. Only a top-level comment can be stickied, so the rest of
+    the comment tree isn't expanded"""
+    for comment in submission.comments:
+        if isinstance(comment, praw.models.MoreComments):
+            continue
+        if comment.stickied and comment.author and comment.author.name.lower() == username.lower():
+            return comment
+    return None
+
+
+def _split_post_text(wiki_lines: List[str]) -> Optional[Tuple[str, str]]:
+    """Title and body of a post, or None if the page isn't in the expected format"""
+    if len(wiki_lines) < 2 or not wiki_lines[0].startswith("# ") or wiki_lines[1] != '':
+        return None
+    return wiki_lines[0][2:], '\n'.join(wiki_lines[2:])
+
+
+def _publish_sticky(ctx: ExtendedContext, thread_id, text) -> Tuple[praw.models.Comment, str]:
+    """Update the bot's sticky comment in the thread, or create it. Returns the comment and what was done"""
+    submission = ctx.bot_reddit_session.submission(thread_id)
+    sticky_comment = _find_sticky_comment(submission, ctx.subreddit_context.bot_username)
+    if sticky_comment:
+        sticky_comment.edit(text)
+        return sticky_comment, 'updated'
+    sticky_comment = submission.reply(text)
+    sticky_comment.mod.distinguish(how='yes', sticky=True)
+    return sticky_comment, 'created'
 
 
 @gyrobot.group('make')
@@ -56,15 +127,10 @@ def make_post(ctx: ExtendedContext, thread_id, wiki_page_name, revision_id=None)
 
     sr = ctx.bot_reddit_session.subreddit(ctx.subreddit.display_name)
     wiki_lines = _get_wiki_text(sr, wiki_page_name, revision_id)
-    if len(wiki_lines) < 2:
-        ctx.chat.send_text(WIKI_PAGE_BAD_FORMAT, is_error=True)
-        return
-    if wiki_lines[0].startswith("# ") and wiki_lines[1] == '':
-        wiki_title = wiki_lines[0][2:]
-        wiki_text_body = '\n'.join(wiki_lines[2:])
-    else:
+    if (post_text := _split_post_text(wiki_lines)) is None:
         ctx.chat.send_text(WIKI_PAGE_BAD_FORMAT, is_error=True)
         return
+    wiki_title, wiki_text_body = post_text
 
     if thread_id.upper() == 'NEW':
         submission = sr.submit(wiki_title, wiki_text_body)
@@ -97,15 +163,57 @@ def make_sticky(ctx: ExtendedContext, thread_id, wiki_page, revision_id=None):
     wiki_lines = _get_wiki_text(sr, wiki_page, revision_id)
     wiki_text_body = '\n'.join(wiki_lines)
 
-    submission = ctx.bot_reddit_session.submission(thread_id)
-    sticky_comments = [c for c in submission.comments.list()
-                       if getattr(c, 'stickied', False) and
-                       c.author.name == ctx.bot_reddit_session.user.me().name]
-    if sticky_comments:
-        sticky_comment = sticky_comments[0]
-        sticky_comment.edit(wiki_text_body)
-    else:
-        sticky_comment = submission.reply(wiki_text_body)
-        sticky_comment.mod.distinguish(how='yes', sticky=True)
-
+    sticky_comment, _ = _publish_sticky(ctx, thread_id, wiki_text_body)
     ctx.chat.send_text(ctx.bot_reddit_session.config.reddit_url + sticky_comment.permalink)
+
+
+@make.command('batch')
+@click.argument('kind', type=click.Choice(['post', 'sticky'], case_sensitive=False))
+@click.argument('wiki_page')
+@click.argument('thread_ids', nargs=-1, required=True)
+@click.option('-r', '--revision', 'revision_id', default=None, help='Wiki page revision (default: latest)')
+@click.pass_context
+def make_batch(ctx: ExtendedContext, kind, wiki_page, thread_ids, revision_id=None):
+    """
+    Update many posts or sticky comments from the same wiki page revision at once.
+
+    Syntax:
+    make batch post wiki_page thread_id1 thread_id2 ...
+    make batch sticky wiki_page thread_id1 thread_id2 ... [-r version_id]"""
+    kind = kind.lower()
+    sr = ctx.bot_reddit_session.subreddit(ctx.subreddit.display_name)
+    revision_id, wiki_lines = _get_wiki_revision(sr, wiki_page, revision_id)
+    if kind == 'post':
+        if (post_text := _split_post_text(wiki_lines)) is None:
+            ctx.chat.send_text(WIKI_PAGE_BAD_FORMAT, is_error=True)
+            return
+        wiki_text_body = post_text[1]
+    else:
+        wiki_text_body = '\n'.join(wiki_lines)
+    reddit_url = ctx.bot_reddit_session.config.reddit_url
+
+    def publish(thread_id):
+        if kind == 'post':
+            submission = ctx.bot_reddit_session.submission(thread_id)
+            submission.edit(wiki_text_body)
+            return submission.permalink, 'updated'
+        sticky_comment, action = _publish_sticky(ctx, thread_id, wiki_text_body)
+        return sticky_comment.permalink, action
+
+    try:
+        thread_ids = list(dict.fromkeys(extract_real_thread_ids(thread_ids)))
+    except ShortLinkError as ex:
+        ctx.chat.send_text(str(ex), is_error=True)
+        return
+    results = []
+    next_edit = 0.0
+    for thread_id in thread_ids:
+        time.sleep(max(0.0, next_edit - time.monotonic()))
+        next_edit = time.monotonic() + MAKE_BATCH_INTERVAL
+        try:
+            permalink, action = publish(thread_id)
+            results.append({'Thread': thread_id, 'Result': action, 'Link': reddit_url + permalink})
+        except Exception as ex:
+            ctx.logger.warning(f"Could not update {thread_id}: {ex!r}")
+            results.append({'Thread': thread_id, 'Result': f'error: {ex}', 'Link': None})
+    ctx.chat.send_table(title=f"{wiki_page} revision {revision_id}", table=results)
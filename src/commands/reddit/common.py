@@ -1,30 +1,130 @@
+import concurrent.futures
+import os
 import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
 import requests
 
+from state_file import state_file
+
 REDDIT_USERNAME_PATTERN = r'^<https://(?:www\.|old\.|new\.)?reddit\.com/u(?:ser)?/(?P<username>[a-zA-Z0-9_-]+)/?(?:\|\1)?>$'
+SHORT_LINK_TTL = float(os.environ.get('SHORT_LINK_TTL', 30 * 24 * 60 * 60))
+SHORT_LINK_ATTEMPTS = 3
+
+_SLACK_BOLD_REGEX = re.compile(r'^\*(.*)\*$')
+_USERNAME_REGEX = re.compile(r'^[a-zA-Z0-9_-]+$')
+_REDDIT_USERNAME_REGEX = re.compile(REDDIT_USERNAME_PATTERN)
+_USERNAME_PREFIX_REGEX = re.compile(r'^/?u/(?P<username>[a-zA-Z0-9_-]+)$')
+_THREAD_ID_REGEX = re.compile(r'(?:^|/)comments/(?P<thread_id>[a-z0-9]+)(?:/|$)', re.IGNORECASE)
+
+_short_links: Optional[dict] = None
+_short_links_lock = threading.Lock()
+
+
+class ShortLinkError(Exception):
+    """Share links that couldn't be resolved to a thread, the message can be sent to the user as is"""
 
 
 def extract_username(username):
-    if re.match(r'^\*.*\*$', username):
-        username = username[1:-1]  # Remove slack formatting
-    if re.match(r'^[a-zA-Z0-9_-]+$', username):
+    if m := _SLACK_BOLD_REGEX.match(username):
+        username = m.group(1)  # Remove slack formatting
+    if _USERNAME_REGEX.match(username):
         pass  # Already a valid username
-    elif m := re.match(REDDIT_USERNAME_PATTERN, username):
+    elif m := _REDDIT_USERNAME_REGEX.match(username):
         username = m.group('username')  # Extract username from reddit link
-    elif re.match(r'^u/[a-zA-Z0-9_-]+$', username):
-        username = username.split('/')[-1]  # Extract username from reddit link
+    elif m := _USERNAME_PREFIX_REGEX.match(username):
+        username = m.group('username')  # Extract username from u/username
     else:
         username = None  # Invalid username
     return username
 
 
-def extract_real_thread_id(thread_id):
-    if thread_id.startswith('<') and thread_id.endswith('>'):  # slack link
-        thread_id = thread_id[1:-1]
+def _is_short_link(url):
+    return url.startswith('https://www.reddit.com/r/') and '/s/' in url
+
+
+def _retry_delay(response: requests.Response, attempt: int) -> float:
+    try:
+        return min(float(response.headers.get('Retry-After', 2 ** attempt)), 30)
+    except ValueError:  # an HTTP date
+        return 2 ** attempt
+
+
+def _resolve_short_link(url):
+    """Follow the redirects of a share link to the thread it leads to, without downloading any page.
+
+    If reddit refuses the HEAD request, the redirects are followed with a GET whose body is never read. Rate limits
+    and server errors are retried ``SHORT_LINK_ATTEMPTS`` times."""
+    for attempt in range(SHORT_LINK_ATTEMPTS):
+        response = requests.head(url, allow_redirects=True, timeout=30)
+        if response.status_code in (403, 405):
+            with requests.get(url, allow_redirects=True, timeout=30, stream=True) as response:
+                pass
+        if (response.status_code == 429 or response.status_code >= 500) and attempt + 1 < SHORT_LINK_ATTEMPTS:
+            time.sleep(_retry_delay(response, attempt))
+            continue
+        response.raise_for_status()
+        if not _THREAD_ID_REGEX.search(response.url):
+            raise ValueError(f"it leads to {response.url}, not to a thread")
+        return response.url
+
 
-    if thread_id.startswith('https://www.reddit.com/r/') and '/s/' in thread_id:
-        response = requests.get(thread_id)
-        thread_id = response.url.split('/')[6]
+def _try_resolve_short_link(url):
+    try:
+        return _resolve_short_link(url)
+    except (requests.RequestException, ValueError) as ex:
+        return ex
+
+
+def _short_link_cache() -> dict:
+    global _short_links
+    if _short_links is None:
+        with state_file('short_links') as cache:
+            _short_links = dict(cache)
+    return _short_links
+
+
+def resolve_short_links(urls: Iterable[str]) -> Dict[str, str]:
+    """Resolve reddit share links (/s/) to the full urls they redirect to.
+
+    Resolved links are kept in ``state_file('short_links')`` for ``SHORT_LINK_TTL`` seconds, links that aren't in
+    the cache are resolved in parallel. Only links that lead to a thread are cached, if any link can't be resolved
+    a ``ShortLinkError`` lists them (after the others are cached)."""
+    urls = list(dict.fromkeys(urls))
+    now = time.time()
+    with _short_links_lock:
+        cache = _short_link_cache()
+        result = {url: cache[url]['url'] for url in urls
+                  if url in cache and now - cache[url]['resolved'] < SHORT_LINK_TTL}
+    missing = [url for url in urls if url not in result]
+    if not missing:
+        return result
+    resolved = {}
+    errors = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(missing))) as executor:
+        for url, outcome in zip(missing, executor.map(_try_resolve_short_link, missing)):
+            if isinstance(outcome, Exception):
+                errors[url] = outcome
+            else:
+                resolved[url] = outcome
+    with _short_links_lock:
+        cache.update({url: {'url': full_url, 'resolved': now} for url, full_url in resolved.items()})
+        for url in [url for url, entry in cache.items() if now - entry['resolved'] >= SHORT_LINK_TTL]:
+            del cache[url]
+        with state_file('short_links') as state:
+            state.clear()
+            state.update(cache)
+    if errors:
+        raise ShortLinkError("Couldn't resolve share links: " +
+                                   '; '.join(f"{url} ({error})" for url, error in errors.items()))
+    return result | resolved
+
+
+def _thread_id_from_url(thread_id):
+    if m := _THREAD_ID_REGEX.search(thread_id):
+        thread_id = m.group('thread_id')
     elif '/' in thread_id:
         if thread_id.startswith('http://') or thread_id.startswith('https://'):
             thread_id = thread_id.split('/')[6]
@@ -33,3 +133,18 @@ def extract_real_thread_id(thread_id):
         else:
             thread_id = thread_id.split('/')[3]
     return thread_id
+
+
+def extract_real_thread_ids(thread_ids: Iterable[str]) -> List[str]:
+    """Thread ids from many ids, urls, share links or slack links, resolving all share links in one batch"""
+    unwrapped = []
+    for thread_id in thread_ids:
+        if thread_id.startswith('<') and thread_id.endswith('>'):  # slack link
+            thread_id = thread_id[1:-1]
+        unwrapped.append(thread_id)
+    resolved = resolve_short_links([thread_id for thread_id in unwrapped if _is_short_link(thread_id)])
+    return [_thread_id_from_url(resolved.get(thread_id, thread_id)) for thread_id in unwrapped]
+
+
+def extract_real_thread_id(thread_id):
+    return extract_real_thread_ids([thread_id])[0]
@@ -0,0 +1,180 @@
+import datetime
+import pathlib
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import praw
+
+from background import BackgroundWorker, ensure_worker
+from bot_framework.yaml_wrapper import yaml
+from commands.extended_context import ExtendedContext
+
+CONFIG_FILE = pathlib.Path('config/enhanced_crowd_control.yml')
+MONITOR_NAME = 'enhanced_crowd_control'
+CROWD_CONTROL_REASON_CODE = 'CROWD_CONTROL'
+
+_config_lock = threading.RLock()
+
+
+def load_config() -> dict:
+    with _config_lock:
+        if not CONFIG_FILE.exists():
+            return {}
+        with CONFIG_FILE.open(mode='r', encoding='utf8') as y:
+            return dict(yaml.load(y) or {})
+
+
+def save_config(config: dict):
+    with _config_lock:
+        with CONFIG_FILE.open(mode='w', encoding='utf8') as y:
+            yaml.dump(config, y)
+
+
+def update_config(update: Callable[[dict], Any]) -> Any:
+    """Load the configuration, change it with ``update`` and save it, without anyone else writing in between"""
+    with _config_lock:
+        config = load_config()
+        result = update(config)
+        save_config(config)
+    return result
+
+
+def _as_utc(value, end_of_day: bool = False) -> Optional[datetime.datetime]:
+    """Dates and datetimes from the configuration as aware UTC datetimes (a date is the whole day)"""
+    if value is None:
+        return None
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time.max if end_of_day else datetime.time.min)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def fetch_submission_metadata(reddit_session: praw.Reddit, thread_ids: Iterable[str]) -> Dict[str, dict]:
+    """Creation date and permalink of many submissions, fetched with /api/info (100 submissions per request)"""
+    fullnames = [f't3_{thread_id}' for thread_id in thread_ids]
+    if not fullnames:
+        return {}
+    return {s.id: {
+        'date': datetime.datetime.fromtimestamp(s.created_utc, datetime.timezone.utc).replace(tzinfo=None),
+        'permalink': s.permalink} for s in reddit_session.info(fullnames=fullnames)}
+
+
+class _ThreadStats:
+    def __init__(self):
+        self.seen = 0
+        self.removed = 0
+        self.started = time.monotonic()
+
+    @property
+    def removals_per_minute(self) -> float:
+        return 60 * self.removed / max(time.monotonic() - self.started, 1)
+
+
+class CrowdControlMonitor(BackgroundWorker):
+    """Follow all monitored threads with a single comment stream and remove crowd-controlled comments.
+
+    Reddit's crowd control only collapses comments of users that are not trusted in the community, enhanced crowd
+    control removes them instead. The last comment handled in each thread is kept in memory and written back to
+    the configuration every ``flush_interval`` seconds."""
+    interval = 1
+
+    def __init__(self, ctx: ExtendedContext, flush_interval: float = 60):
+        super().__init__(MONITOR_NAME, ctx.logger)
+        self.subreddit = ctx.subreddit
+        self.subreddit_name = ctx.subreddit.display_name
+        self.flush_interval = flush_interval
+        self.comment_stream = self._new_stream(skip_existing=True)
+        self.threads: Dict[str, dict] = {}
+        self.config_mtime: Optional[float] = None
+        self.last: Dict[str, str] = {}
+        self.stats: Dict[str, _ThreadStats] = {}
+        self.last_flush = time.monotonic()
+
+    def _new_stream(self, skip_existing: bool):
+        return self.subreddit.stream.comments(pause_after=-1, skip_existing=skip_existing)
+
+    def _reload_threads(self):
+        """Pick up threads added or removed by the configure commands"""
+        if not CONFIG_FILE.exists():
+            self.threads = {}
+            return
+        mtime = CONFIG_FILE.stat().st_mtime
+        if mtime == self.config_mtime:
+            return
+        config = load_config()
+        self.config_mtime = mtime
+        threads = config.get(self.subreddit_name, {}).get('threads', [])
+        self.threads = {thread['id']: thread for thread in threads}
+        for thread_id in self.threads:
+            self.stats.setdefault(thread_id, _ThreadStats())
+
+    def _in_window(self, thread: dict, comment: praw.models.Comment) -> bool:
+        created = datetime.datetime.fromtimestamp(comment.created_utc, datetime.timezone.utc)
+        from_date = _as_utc(thread.get('from_date'))
+        to_date = _as_utc(thread.get('to_date'), end_of_day=True)
+        return (from_date is None or created >= from_date) and (to_date is None or created <= to_date)
+
+    def run_once(self):
+        self._reload_threads()
+        try:
+            for comment in self.comment_stream:
+                if comment is None:
+                    break
+                self._handle(comment)
+        except Exception:
+            # a generator that raised is finished for good, the new one starts with the latest comments again so
+            # that the ones posted while this failed aren't missed
+            self.comment_stream = self._new_stream(skip_existing=False)
+            raise
+        if self.last and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def _handle(self, comment: praw.models.Comment):
+        thread = self.threads.get(comment.link_id[3:])
+        if thread is None:
+            return
+        self.stats[thread['id']].seen += 1
+        self.last[thread['id']] = comment.id
+        if (thread['action'] == 'remove'
+                and getattr(comment, 'collapsed_reason_code', None) == CROWD_CONTROL_REASON_CODE
+                and not comment.distinguished
+                and not getattr(comment, 'removed', False)
+                and self._in_window(thread, comment)):
+            comment.mod.remove()
+            self.stats[thread['id']].removed += 1
+
+    def flush(self):
+        """Write the last handled comment of each thread back to the configuration in one go"""
+        def set_last(config):
+            for thread in config.get(self.subreddit_name, {}).get('threads', []):
+                if thread['id'] in self.last:
+                    thread['last'] = self.last[thread['id']]
+
+        with _config_lock:
+            update_config(set_last)
+            self.config_mtime = CONFIG_FILE.stat().st_mtime
+        self.last = {}
+        self.last_flush = time.monotonic()
+
+    def on_stop(self):
+        if self.last:
+            self.flush()
+
+    def thread_stats(self) -> list:
+        return [{
+            'Thread': thread_id,
+            'Seen': stats.seen,
+            'Removed': stats.removed,
+            'Removed/min': round(stats.removals_per_minute, 2)}
+            for thread_id, stats in self.stats.items() if thread_id in self.threads]
+
+    def status(self) -> dict:
+        return super().status() | {
+            'Threads': len(self.threads),
+            'Removed': sum(stats.removed for stats in self.stats.values())}
+
+
+def ensure_monitor(ctx: ExtendedContext) -> CrowdControlMonitor:
+    return ensure_worker(MONITOR_NAME, lambda: CrowdControlMonitor(ctx))
@@ -1,10 +1,15 @@
 import os
 
 import click
-import psycopg
+import praw
+from durations_nlp import Duration
 
+from backend.configuration import truthy_env
 from commands import gyrobot
 from commands.extended_context import ExtendedContext
+from commands.reddit.common import extract_username
+from commands.reddit.ingest import ensure_ingester
+from commands.reddit.queries import run_query, posts_by_author, top_posters, repeat_domains, QueryResult
 
 if 'GYROBOT_DATABASE_URL' not in os.environ:
     raise ImportError('GYROBOT_DATABASE_URL not found in environment')
@@ -18,7 +23,7 @@ SQL_TOO_MANY_POSTS = """\
                     public.submissions
                 where
                     created > (now() at time zone 'utc' - interval '1 day')
-                    and subreddit = %(subreddit)s
+                    and lower(subreddit) = %(subreddit)s
                 group by
                     author
                 having
@@ -26,15 +31,151 @@ SQL_TOO_MANY_POSTS = """\
                 order by
                     count(*) desc;"""
 
+SQL_COMMENT_HISTORY = """\
+                select
+                    body
+                from
+                    public.comments
+                where
+                    lower(subreddit) = %(subreddit)s
+                    and lower(author) = lower(%(author)s)
+                order by
+                    created desc
+                limit %(limit)s;"""
+
+SQL_COMMENTS_BY_ID = """\
+                select
+                    body
+                from
+                    public.comments
+                where
+                    id = any(%(ids)s)
+                    and lower(subreddit) = %(subreddit)s;"""
+
+
+def _autostart_ingester(ctx: ExtendedContext):
+    if truthy_env('GYROBOT_INGEST'):
+        ensure_ingester(ctx)
+
+
+def _query(ctx: ExtendedContext, sql, params):
+    _autostart_ingester(ctx)
+    result = run_query(sql, params)
+    return result.headers, result.rows
+
+
+def _window_seconds(ctx: ExtendedContext, window: tuple[str]):
+    window_text = ' '.join(window) if window else '1 day'
+    duration = Duration(window_text.replace('_', ' '))
+    if not duration.parsed_durations:
+        ctx.chat.send_text(f'{window_text} is not an acceptable timeframe', is_error=True)
+        return None
+    return duration.to_seconds()
+
+
+def _send_query_result(ctx: ExtendedContext, title, result: QueryResult):
+    if not result.rows:
+        ctx.chat.send_text(f"Nothing found ({result.latency_text})")
+        return
+    ctx.chat.send_table(title, result.as_table())
+    ctx.chat.send_text(f"_{result.latency_text}_")
+
 
 @gyrobot.command('too_many_posts')
 @click.pass_context
 def too_many_posts(ctx: ExtendedContext):
     """Show users with too many posts in the last 24 hours"""
-    with psycopg.connect(os.environ['GYROBOT_DATABASE_URL']) as conn:
-        with conn.cursor() as cur:
-            rows_raw = cur.execute(SQL_TOO_MANY_POSTS, {'subreddit': ctx.subreddit.display_name})
-            rows = rows_raw.fetchall()
-            headers = [col.name for col in rows_raw.description]
+    headers, rows = _query(ctx, SQL_TOO_MANY_POSTS, {'subreddit': ctx.subreddit_context.name_lower})
     result_table = [dict(zip(headers, row)) for row in rows]
     ctx.chat.send_table('too_many_posts', result_table)
+
+
+@gyrobot.command('posts_by')
+@click.argument('user')
+@click.argument('window', nargs=-1)
+@click.pass_context
+def posts_by(ctx: ExtendedContext, user, window):
+    """Show the posts of a user in a time window (default: 1 day), e.g. posts_by USERNAME 3 days"""
+    if (username := extract_username(user)) is None:
+        ctx.chat.send_text(f'{user} is not a valid username', is_error=True)
+        return
+    if (seconds := _window_seconds(ctx, window)) is None:
+        return
+    _autostart_ingester(ctx)
+    _send_query_result(ctx, f'posts_by-{username}', posts_by_author(ctx.subreddit_context.name_lower, username, seconds))
+
+
+@gyrobot.command('top_posters')
+@click.argument('window', nargs=-1)
+@click.option('-n', '--limit', type=int, default=20)
+@click.pass_context
+def do_top_posters(ctx: ExtendedContext, window, limit=20):
+    """Show the users with the most posts in a time window (default: 1 day), e.g. top_posters 2 weeks
+
+    Counts come from the submissions stored by the ingester (see ingest), kept as hourly counters"""
+    if (seconds := _window_seconds(ctx, window)) is None:
+        return
+    _autostart_ingester(ctx)
+    _send_query_result(ctx, 'top_posters', top_posters(ctx.subreddit_context.name_lower, seconds, limit=limit))
+
+
+@gyrobot.command('repeat_domains')
+@click.argument('window', nargs=-1)
+@click.option('-n', '--limit', type=int, default=20)
+@click.pass_context
+def do_repeat_domains(ctx: ExtendedContext, window, limit=20):
+    """Show the domains posted more than once in a time window (default: 1 day), e.g. repeat_domains 12 hours
+
+    Counts come from the submissions stored by the ingester (see ingest), kept as hourly counters"""
+    if (seconds := _window_seconds(ctx, window)) is None:
+        return
+    _autostart_ingester(ctx)
+    _send_query_result(ctx, 'repeat_domains', repeat_domains(ctx.subreddit_context.name_lower, seconds, limit=limit))
+
+
+@gyrobot.command('history')
+@click.argument('user')
+@click.pass_context
+def do_history(ctx: ExtendedContext, user):
+    """\
+    Return full user comment history, including deleted comments
+    This should work for deleted users as well
+    Data comes from the comments ingested in the bot database"""
+    if (username := extract_username(user)) is None:
+        ctx.chat.send_text(f'{user} is not a valid username', is_error=True)
+        return
+    _, rows = _query(ctx, SQL_COMMENT_HISTORY,
+                     {'subreddit': ctx.subreddit_context.name_lower, 'author': username, 'limit': 40})
+    if not rows:
+        ctx.chat.send_text(f"User u/{username} has no comments in r/{ctx.subreddit.display_name}")
+        return
+    comment_full_body = [row[0] for row in rows]
+    ctx.chat.send_file(
+        file_data='\n'.join(comment_full_body).encode(),
+        filename=f'comment_history-{username}.txt')
+
+
+@gyrobot.command('deleted_comment_source')
+@click.argument('comment_ids', nargs=-1)
+@click.pass_context
+def deleted_comment_source(ctx: ExtendedContext, comment_ids):
+    """\
+    Return comment source even if deleted. Use comment ids or urls
+    Data comes from the comments ingested in the bot database"""
+    ids = [praw.reddit.Comment.id_from_url(c) if '/' in c else c.removeprefix('t1_') for c in comment_ids]
+    _, rows = _query(ctx, SQL_COMMENTS_BY_ID, {'subreddit': ctx.subreddit_context.name_lower, 'ids': ids})
+    if not rows:
+        ctx.chat.send_text(f"No comments under those ids were found in r/{ctx.subreddit.display_name}")
+        return
+    comment_full_body = [row[0] for row in rows]
+    ctx.chat.send_file(
+        file_data='\n'.join(comment_full_body).encode(),
+        filename=f"comment_body-{','.join(ids)}.txt")
+
+
+@gyrobot.command('ingest')
+@click.pass_context
+def ingest(ctx: ExtendedContext):
+    """Start storing new submissions and comments in the bot database (if not already running) and show progress"""
+    ingester = ensure_ingester(ctx)
+    ctx.chat.send_table(title='ingest', table=[ingester.status()])
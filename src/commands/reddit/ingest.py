@@ -0,0 +1,247 @@
+import collections
+import datetime
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import praw
+import psycopg
+
+from background import BackgroundWorker, ensure_worker
+from commands.extended_context import ExtendedContext
+
+INGESTER_NAME = 'ingest'
+INGEST_BATCH_SIZE = int(os.environ.get('GYROBOT_INGEST_BATCH_SIZE', 500))
+INGEST_FLUSH_INTERVAL = float(os.environ.get('GYROBOT_INGEST_FLUSH_INTERVAL', 10))
+INGEST_MAX_ATTEMPTS = int(os.environ.get('GYROBOT_INGEST_MAX_ATTEMPTS', 5))
+
+SUBMISSION_COLUMNS = ('id', 'subreddit', 'author', 'created', 'title', 'url', 'domain', 'permalink', 'selftext')
+COMMENT_COLUMNS = ('id', 'subreddit', 'author', 'created', 'link_id', 'parent_id', 'permalink', 'body')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS public.submissions (
+    id        TEXT PRIMARY KEY,
+    subreddit TEXT NOT NULL,
+    author    TEXT,
+    created   TIMESTAMP NOT NULL,
+    title     TEXT,
+    url       TEXT,
+    domain    TEXT,
+    permalink TEXT,
+    selftext  TEXT
+);
+CREATE INDEX IF NOT EXISTS submissions_lower_subreddit_lower_author_created_idx
+    ON public.submissions (lower(subreddit), lower(author), created);
+CREATE INDEX IF NOT EXISTS submissions_lower_subreddit_created_idx
+    ON public.submissions (lower(subreddit), created);
+
+CREATE TABLE IF NOT EXISTS public.comments (
+    id        TEXT PRIMARY KEY,
+    subreddit TEXT NOT NULL,
+    author    TEXT,
+    created   TIMESTAMP NOT NULL,
+    link_id   TEXT,
+    parent_id TEXT,
+    permalink TEXT,
+    body      TEXT
+);
+CREATE INDEX IF NOT EXISTS comments_lower_subreddit_lower_author_created_idx
+    ON public.comments (lower(subreddit), lower(author), created);
+
+CREATE TABLE IF NOT EXISTS public.author_hourly_posts (
+    subreddit TEXT NOT NULL,
+    author    TEXT NOT NULL,
+    hour      TIMESTAMP NOT NULL,
+    posts     INTEGER NOT NULL,
+    PRIMARY KEY (subreddit, author, hour)
+);
+CREATE INDEX IF NOT EXISTS author_hourly_posts_subreddit_hour_idx
+    ON public.author_hourly_posts (subreddit, hour);
+
+CREATE TABLE IF NOT EXISTS public.domain_hourly_posts (
+    subreddit TEXT NOT NULL,
+    domain    TEXT NOT NULL,
+    hour      TIMESTAMP NOT NULL,
+    posts     INTEGER NOT NULL,
+    PRIMARY KEY (subreddit, domain, hour)
+);
+CREATE INDEX IF NOT EXISTS domain_hourly_posts_subreddit_hour_idx
+    ON public.domain_hourly_posts (subreddit, hour);
+"""
+
+# Moves staged submissions into the table and adds the ones that were actually new to the hourly counters
+_SQL_INSERT_SUBMISSIONS = """
+WITH inserted AS (
+    INSERT INTO public.submissions ({columns})
+    SELECT {columns} FROM {staging_table}
+    ON CONFLICT (id) DO NOTHING
+    RETURNING subreddit, author, domain, date_trunc('hour', created) AS hour
+), authors AS (
+    INSERT INTO public.author_hourly_posts (subreddit, author, hour, posts)
+    SELECT subreddit, author, hour, count(*) FROM inserted WHERE author IS NOT NULL GROUP BY 1, 2, 3
+    ON CONFLICT (subreddit, author, hour) DO UPDATE SET posts = author_hourly_posts.posts + excluded.posts
+)
+INSERT INTO public.domain_hourly_posts (subreddit, domain, hour, posts)
+SELECT subreddit, domain, hour, count(*) FROM inserted WHERE domain IS NOT NULL GROUP BY 1, 2, 3
+ON CONFLICT (subreddit, domain, hour) DO UPDATE SET posts = domain_hourly_posts.posts + excluded.posts
+"""
+_SQL_INSERT_ROWS = """
+INSERT INTO public.{table} ({columns})
+SELECT {columns} FROM {staging_table}
+ON CONFLICT (id) DO NOTHING
+"""
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+_CONNECTION_ERRORS = (psycopg.OperationalError, psycopg.InterfaceError)
+
+
+def connect() -> psycopg.Connection:
+    global _schema_ready
+    conn = psycopg.connect(os.environ['GYROBOT_DATABASE_URL'])
+    with _schema_lock:
+        if not _schema_ready:
+            with conn.cursor() as cur:
+                cur.execute(_SCHEMA)
+            conn.commit()
+            _schema_ready = True
+    return conn
+
+
+def _created(item) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(item.created_utc, datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _author(item) -> Optional[str]:
+    return item.author.name if item.author else None
+
+
+def _submission_row(s: praw.models.Submission) -> tuple:
+    return (s.id, s.subreddit.display_name.lower(), _author(s), _created(s), s.title, s.url, s.domain, s.permalink,
+            s.selftext)
+
+
+def _comment_row(c: praw.models.Comment) -> tuple:
+    return (c.id, c.subreddit.display_name.lower(), _author(c), _created(c), c.link_id, c.parent_id, c.permalink,
+            c.body)
+
+
+# table -> (columns, row of a stream item), in the order they are read and flushed
+TABLE_ROWS: Dict[str, Tuple[tuple, Callable]] = {
+    'submissions': (SUBMISSION_COLUMNS, _submission_row),
+    'comments': (COMMENT_COLUMNS, _comment_row),
+}
+
+
+def copy_rows(conn: psycopg.Connection, table: str, columns: tuple, rows: List[tuple]):
+    """Bulk insert rows with COPY, skipping the ones that are already there.
+
+    COPY can't skip duplicates by itself (streams replay recent items on restart), so the rows are copied into a
+    temporary staging table first and moved from there with a single INSERT ... ON CONFLICT DO NOTHING. New
+    submissions are also added to the hourly per-author and per-domain counters in the same statement."""
+    column_list = ', '.join(columns)
+    staging_table = f'{table}_staging'
+    with conn.cursor() as cur:
+        cur.execute(f'CREATE TEMP TABLE IF NOT EXISTS {staging_table} '
+                    f'(LIKE public.{table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS')
+        with cur.copy(f'COPY {staging_table} ({column_list}) FROM STDIN') as copy:
+            for row in rows:
+                copy.write_row(row)
+        insert_sql = _SQL_INSERT_SUBMISSIONS if table == 'submissions' else _SQL_INSERT_ROWS
+        cur.execute(insert_sql.format(table=table, columns=column_list, staging_table=staging_table))
+    conn.commit()
+
+
+class Ingester(BackgroundWorker):
+    """Follow the subreddit's new submissions and comments and store them in ``GYROBOT_DATABASE_URL``"""
+    interval = 1
+
+    def __init__(self, ctx: ExtendedContext):
+        super().__init__(INGESTER_NAME, ctx.logger)
+        self.subreddit = ctx.subreddit
+        self.streams = {table: self._new_stream(table) for table in TABLE_ROWS}
+        self.pending: Dict[str, List[tuple]] = {table: [] for table in TABLE_ROWS}
+        self.failed_attempts = collections.Counter()
+        self.ingested = collections.Counter()
+        self.dropped = collections.Counter()
+        self.last_flush = time.monotonic()
+        self.conn: Optional[psycopg.Connection] = None
+
+    def _new_stream(self, table: str):
+        return getattr(self.subreddit.stream, table)(pause_after=-1)
+
+    def run_once(self):
+        for table, (_, make_row) in TABLE_ROWS.items():
+            try:
+                for item in self.streams[table]:
+                    if item is None:
+                        break
+                    self.pending[table].append(make_row(item))
+            except Exception:
+                self.streams[table] = self._new_stream(table)  # a generator that raised is finished for good
+                raise
+        pending = sum(len(rows) for rows in self.pending.values())
+        if pending >= INGEST_BATCH_SIZE or (pending and time.monotonic() - self.last_flush >= INGEST_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = connect()
+        for table in TABLE_ROWS:
+            self._flush_table(table)
+        self.last_flush = time.monotonic()
+
+    def _flush_table(self, table: str):
+        """Copy the pending rows of a table in one batch.
+
+        A batch that failed ``INGEST_MAX_ATTEMPTS`` times for anything but a connection problem (a row the database
+        won't take) is copied one row at a time instead, and the rows that still fail are dropped."""
+        if not self.pending[table]:
+            return
+        columns, _ = TABLE_ROWS[table]
+        try:
+            if self.failed_attempts[table] >= INGEST_MAX_ATTEMPTS:
+                self._copy_one_by_one(table, columns)
+            else:
+                copy_rows(self.conn, table, columns, self.pending[table])
+                self.ingested[table] += len(self.pending[table])
+                self.pending[table] = []
+            self.failed_attempts[table] = 0
+        except _CONNECTION_ERRORS:
+            self.conn.close()
+            raise
+        except psycopg.Error:
+            self.conn.rollback()
+            self.failed_attempts[table] += 1
+            raise
+
+    def _copy_one_by_one(self, table: str, columns: tuple):
+        while self.pending[table]:
+            row = self.pending[table][0]
+            try:
+                copy_rows(self.conn, table, columns, [row])
+                self.ingested[table] += 1
+            except _CONNECTION_ERRORS:
+                raise
+            except psycopg.Error as ex:
+                self.conn.rollback()
+                self.dropped[table] += 1
+                self.logger.error(f"Dropped {table} row {row[0]} that can't be stored: {ex!r}")
+            self.pending[table].pop(0)
+
+    def on_stop(self):
+        self.flush()
+        if self.conn is not None:
+            self.conn.close()
+
+    def status(self) -> dict:
+        return super().status() | {
+            'Submissions': self.ingested['submissions'],
+            'Comments': self.ingested['comments'],
+            'Pending': sum(len(rows) for rows in self.pending.values()),
+            'Dropped': sum(self.dropped.values())}
+
+
+def ensure_ingester(ctx: ExtendedContext) -> Ingester:
+    return ensure_worker(INGESTER_NAME, lambda: Ingester(ctx))
@@ -0,0 +1,170 @@
+import bisect
+import collections
+import heapq
+import os
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import praw
+
+from background import BackgroundWorker, ensure_worker, get_worker
+from commands.extended_context import ExtendedContext
+
+POLLER_NAME = 'modqueue'
+DELETED_AUTHOR = '[deleted]'
+SLACK_SECTION_LENGTH = 2000
+SLACK_MAX_BLOCKS = 50
+
+_snapshot: Optional['ModqueueSnapshot'] = None
+_snapshot_lock = threading.Lock()
+
+
+class ModqueueItem(NamedTuple):
+    fullname: str
+    kind: str
+    author: str
+    created_utc: float
+    permalink: str
+    text: str
+    url: str
+
+    @classmethod
+    def from_praw(cls, item):
+        if isinstance(item, praw.models.Submission):
+            kind, text, url = 'submission', item.title, item.url
+        else:
+            kind, text, url = 'comment', item.body[:80], None
+        return cls(
+            fullname=item.fullname,
+            kind=kind,
+            author=item.author.name if item.author else DELETED_AUTHOR,
+            created_utc=item.created_utc,
+            permalink=item.permalink,
+            text=text,
+            url=url)
+
+
+class ModqueueSnapshot:
+    """Immutable view of the modqueue at one point in time, indexed by author, kind and age"""
+
+    def __init__(self, items: List[ModqueueItem], taken_at: float = None):
+        self.items = items
+        self.taken_at = taken_at or time.time()
+        self.by_fullname: Dict[str, ModqueueItem] = {item.fullname: item for item in items}
+        self.by_author: Dict[str, List[ModqueueItem]] = collections.defaultdict(list)
+        self.by_kind: Dict[str, List[ModqueueItem]] = {'submission': [], 'comment': []}
+        for item in items:
+            self.by_author[item.author].append(item)
+            self.by_kind[item.kind].append(item)
+        self.by_age = sorted(items, key=lambda i: i.created_utc)
+        self._created = [item.created_utc for item in self.by_age]
+
+    def __len__(self):
+        return len(self.items)
+
+    def of_kind(self, kind: str) -> List[ModqueueItem]:
+        return self.by_kind.get(kind, [])
+
+    def older_than(self, seconds: float) -> List[ModqueueItem]:
+        """Items that have been created more than ``seconds`` ago, oldest first"""
+        cutoff = self.taken_at - seconds
+        return self.by_age[:bisect.bisect_left(self._created, cutoff)]
+
+    def new_since(self, previous: 'ModqueueSnapshot') -> List[ModqueueItem]:
+        return [item for item in self.items if item.fullname not in previous.by_fullname]
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.taken_at
+
+
+def top_authors(snapshot: ModqueueSnapshot, limit: int = None, min_count: int = 2) -> List[Tuple[str, int]]:
+    """Authors with at least ``min_count`` items, most items first, at most ``limit`` of them"""
+    counts = ((author, len(items)) for author, items in snapshot.by_author.items()
+              if len(items) >= min_count and author != DELETED_AUTHOR)
+    if limit is None:
+        return sorted(counts, key=lambda x: -x[1])
+    return heapq.nlargest(limit, counts, key=lambda x: x[1])
+
+
+def pack_sections(lines: Iterable[str], max_length: int = SLACK_SECTION_LENGTH) -> Iterator[dict]:
+    """Join lines into mrkdwn section blocks of at most ``max_length`` characters without dropping any line"""
+    chunk = []
+    chunk_length = 0
+    for line in lines:
+        if chunk and chunk_length + len(line) + 1 > max_length:
+            yield {"type": "section", "text": {"type": "mrkdwn", "text": '\n'.join(chunk)}}
+            chunk = []
+            chunk_length = 0
+        chunk.append(line)
+        chunk_length += len(line) + 1
+    if chunk:
+        yield {"type": "section", "text": {"type": "mrkdwn", "text": '\n'.join(chunk)}}
+
+
+def fetch_snapshot(subreddit: praw.reddit.Subreddit) -> ModqueueSnapshot:
+    return ModqueueSnapshot([ModqueueItem.from_praw(item) for item in subreddit.mod.modqueue(limit=None)])
+
+
+def current_snapshot(subreddit: praw.reddit.Subreddit) -> ModqueueSnapshot:
+    """Latest snapshot from the poller, or a fresh one if the poller isn't running"""
+    with _snapshot_lock:
+        snapshot = _snapshot
+    if snapshot is not None and get_worker(POLLER_NAME) is not None:
+        return snapshot
+    return fetch_snapshot(subreddit)
+
+
+def _replace_snapshot(snapshot: ModqueueSnapshot) -> Optional[ModqueueSnapshot]:
+    global _snapshot
+    with _snapshot_lock:
+        previous, _snapshot = _snapshot, snapshot
+    return previous
+
+
+class ModqueuePoller(BackgroundWorker):
+    """Refresh the shared modqueue snapshot and post new items to ``MODQUEUE_POLL_CHANNEL``"""
+
+    def __init__(self, ctx: ExtendedContext, interval: float):
+        super().__init__(POLLER_NAME, ctx.logger, interval)
+        self.subreddit = ctx.subreddit
+        self.reddit_url = ctx.reddit_session.config.reddit_url
+        self.conversation = ctx.chat
+        self.channel = os.environ.get('MODQUEUE_POLL_CHANNEL')
+        self.spike_threshold = int(os.environ.get('MODQUEUE_SPIKE_THRESHOLD', 3))
+        self.notified_items = 0
+
+    def run_once(self):
+        snapshot = fetch_snapshot(self.subreddit)
+        previous = _replace_snapshot(snapshot)
+        if previous is None or not self.channel:
+            return  # first poll only establishes the baseline
+        new_items = snapshot.new_since(previous)
+        if new_items:
+            self.conversation.send_text(self._delta_text(new_items, snapshot), channel=self.channel)
+            self.notified_items += len(new_items)
+
+    def _delta_text(self, new_items: List[ModqueueItem], snapshot: ModqueueSnapshot) -> str:
+        new_posts = sum(1 for item in new_items if item.kind == 'submission')
+        new_comments = len(new_items) - new_posts
+        text = (f"{len(new_items)} new items in modqueue ({new_posts} posts, {new_comments} comments), "
+                f"{len(snapshot)} in total")
+        new_per_author = collections.Counter(item.author for item in new_items if item.author != DELETED_AUTHOR)
+        for author, count in new_per_author.most_common():
+            if count < self.spike_threshold:
+                break
+            text += (f"\n⚠ {count} new items from <{self.reddit_url}/u/{author}|{author}> "
+                     f"({len(snapshot.by_author[author])} in queue)")
+        return text
+
+    def status(self) -> dict:
+        return super().status() | {'Notified Items': self.notified_items}
+
+
+def ensure_poller(ctx: ExtendedContext) -> Optional[ModqueuePoller]:
+    """Start the modqueue poller if ``MODQUEUE_POLL_INTERVAL`` is set"""
+    if 'MODQUEUE_POLL_INTERVAL' not in os.environ:
+        return None
+    interval = float(os.environ['MODQUEUE_POLL_INTERVAL'])
+    return ensure_worker(POLLER_NAME, lambda: ModqueuePoller(ctx, interval))
@@ -1,14 +1,20 @@
+import collections
 import datetime
+import io
 import os
+import tempfile
+from typing import Iterator, Tuple
 
 import click
+import praw
 import prawcore
+import xlsxwriter
 from durations_nlp import Duration
 from word2number.w2n import word_to_num
 
 from commands import gyrobot, ClickAliasedGroup
 from commands.extended_context import ExtendedContext
-from commands.reddit.common import extract_real_thread_id, extract_username
+from commands.reddit.common import ShortLinkError, extract_real_thread_id, extract_username
 from state_file import state_file
 
 if 'SUBREDDIT_NAME' not in os.environ:
@@ -20,13 +26,27 @@ def nuke():
     pass
 
 
+def _can_remove(ctx: ExtendedContext) -> bool:
+    """Whether the main account may remove and approve items, telling the user if it can't"""
+    if ctx.subreddit_context.has_permission('posts'):
+        return True
+    ctx.chat.send_text(f"The bot doesn't have the posts permission in r/{ctx.subreddit_context.name}", is_error=True)
+    return False
+
+
 @nuke.command('thread', aliases=['post'])
 @click.argument('thread_id')
 @click.pass_context
 def nuke_thread(ctx: ExtendedContext, thread_id):
     """Nuke whole thread (except distinguished comments)
     Thread ID should be either the submission URL or the submission id"""
-    thread_id = extract_real_thread_id(thread_id)
+    if not _can_remove(ctx):
+        return
+    try:
+        thread_id = extract_real_thread_id(thread_id)
+    except ShortLinkError as ex:
+        ctx.chat.send_text(str(ex), is_error=True)
+        return
     post = ctx.reddit_session.submission(thread_id)
     post.comments.replace_more(limit=None)
     comments = post.comments.list()
@@ -62,7 +82,13 @@ def undo_nuke_thread(ctx: ExtendedContext, thread_id):
 
     :param ctx: command context
     :param thread_id: either the submission URL or the submission id"""
-    thread_id = extract_real_thread_id(thread_id)
+    if not _can_remove(ctx):
+        return
+    try:
+        thread_id = extract_real_thread_id(thread_id)
+    except ShortLinkError as ex:
+        ctx.chat.send_text(str(ex), is_error=True)
+        return
     with state_file('nuke_thread') as state:
         if thread_id not in state:
             ctx.chat.send_text(f"Could not find thread {thread_id}", is_error=True)
@@ -81,6 +107,20 @@ def _w2n(input_text):
         return None
 
 
+def _parse_timeframe(timeframe: tuple[str]):
+    if not timeframe:
+        timeframe = ('3', 'days')
+    if timeframe[0] in ('a', 'an'):
+        timeframe = ('1',) + timeframe[1:]
+    elif (conv_num := _w2n(timeframe[0])) is not None:
+        timeframe = (str(conv_num),) + timeframe[1:]
+    if timeframe in (('forever_and_ever',), ('forever', 'and', 'ever'), ('forever',)):
+        timeframe = ('100', 'years')  # should be enough
+    timeframe = ' '.join(timeframe)
+    timeframe = ' '.join(timeframe.replace('_', ' ').split())
+    return timeframe, Duration(timeframe)
+
+
 @nuke.command('user')
 @click.argument('username')
 @click.argument('timeframe', required=False, nargs=-1)
@@ -93,36 +133,64 @@ def nuke_user(ctx: ExtendedContext, username: str, timeframe: tuple[str] = None,
     Default value is 3 days. You can use standard values, e.g. "48 hours", "2 months", "10 years" etc.
     Add SUBMISSIONS or POSTS to remove submissions as well.
     """
-    if not timeframe:
-        timeframe = ('3', 'days')
-    if timeframe[0] in ('a', 'an'):
-        timeframe = ('1',) + timeframe[1:]
-    elif (conv_num := _w2n(timeframe[0])) is not None:
-        timeframe = (str(conv_num),) + timeframe[1:]
-    if timeframe in (('forever_and_ever',), ('forever', 'and', 'ever'), ('forever',)):
-        timeframe = ('100', 'years')  # should be enough
-    timeframe = ' '.join(timeframe)
-    timeframe = ' '.join(timeframe.replace('_', ' ').split())
-    cutoff_age = Duration(timeframe)
+    if not _can_remove(ctx):
+        return
+    timeframe, cutoff_age = _parse_timeframe(timeframe)
     if not cutoff_age.parsed_durations:
         ctx.chat.send_text(f'{timeframe} is not an acceptable timeframe', is_error=True)
         return
-    if (username := extract_username(username)) is None:
+    if (redditor_username := extract_username(username)) is None:
         ctx.chat.send_text(f'{username} is not a valid username', is_error=True)
         return
+    for is_error, text in _nuke_user(ctx, redditor_username, timeframe, cutoff_age, remove_submissions):
+        ctx.chat.send_text(text, is_error=is_error)
+
+
+@nuke.command('users')
+@click.argument('usernames', nargs=-1, required=True)
+@click.option('-t', '--timeframe', default='3_days',
+              help='Timeframe to search, use underscores instead of spaces, e.g. 48_hours')
+@click.option('-s', '-p', '--submissions', '--posts', 'remove_submissions',
+              is_flag=True, default=False, type=click.BOOL)
+@click.pass_context
+def nuke_users(ctx: ExtendedContext, usernames: tuple[str], timeframe: str = '3_days',
+               remove_submissions: bool = False):
+    """\
+    Nuke the comments of many users at once, e.g. nuke users user1 user2 -t 2_weeks
+    Default timeframe is 3 days. Add -s to remove submissions as well.
+    """
+    if not _can_remove(ctx):
+        return
+    timeframe, cutoff_age = _parse_timeframe((timeframe,))
+    if not cutoff_age.parsed_durations:
+        ctx.chat.send_text(f'{timeframe} is not an acceptable timeframe', is_error=True)
+        return
+    redditor_usernames = [extract_username(username) for username in usernames]
+    invalid_usernames = [u for u, r in zip(usernames, redditor_usernames) if r is None]
+    if invalid_usernames:
+        ctx.chat.send_text(f"{', '.join(invalid_usernames)} are not valid usernames", is_error=True)
+        return
+    for redditor_username in dict.fromkeys(redditor_usernames):
+        for is_error, text in _nuke_user(ctx, redditor_username, timeframe, cutoff_age, remove_submissions):
+            ctx.chat.send_text(f"*{redditor_username}*\n{text}", is_error=is_error)
+
+
+def _nuke_user(ctx: ExtendedContext, username: str, timeframe: str, cutoff_age: Duration,
+               remove_submissions: bool) -> Iterator[Tuple[bool, str]]:
+    """Remove the comments (and submissions) of a user, yielding (is_error, text) messages for the caller to send"""
     u = ctx.bot_reddit_session.redditor(username)
     try:
         u._fetch()
     except prawcore.exceptions.ResponseException as ex:
         if ex.response.status_code == 400:
-            ctx.chat.send_text(f'{username} may be shadowbanned', is_error=True)
+            yield True, f'{username} may be shadowbanned'
             return
         elif ex.response.status_code == 404:
-            ctx.chat.send_text(f'{username} not found', is_error=True)
+            yield True, f'{username} not found'
             return
         raise
     if hasattr(u, 'is_suspended') and u.is_suspended:
-        ctx.chat.send_text(f"{username} is suspended", is_error=True)
+        yield True, f"{username} is suspended"
 
     all_comments = u.comments.new(limit=None)
     removed_comments = 0
@@ -137,16 +205,16 @@ def nuke_user(ctx: ExtendedContext, username: str, timeframe: tuple[str] = None,
     try:
         all_comments = list(all_comments)
     except prawcore.exceptions.Forbidden as ex:
-        ctx.chat.send_text(f"User `{username}` is probably suspended", is_error=True)
         ctx.logger.warning(repr(ex))
+        yield True, f"User `{username}` is probably suspended"
         return
     except Exception as ex:
         ctx.logger.warning(type(ex))
         all_comments = []
-
+    subreddit_context = ctx.subreddit_context
     for c in all_comments:
-        comment_subreddit_name = c.subreddit.display_name.lower()
-        if comment_subreddit_name != ctx.subreddit.display_name.lower():
+        if not subreddit_context.is_own_item(c):
+            comment_subreddit_name = c.subreddit_name_prefixed[2:].lower()
             other_subreddits += 1
             other_subreddit_history[comment_subreddit_name] = \
                 other_subreddit_history.get(comment_subreddit_name, 0) + 1
@@ -174,9 +242,9 @@ def nuke_user(ctx: ExtendedContext, username: str, timeframe: tuple[str] = None,
         other_subreddit_submissions = 0
         too_old_submissions = 0
         for s in all_submissions:
-            submission_subreddit_name = s.subreddit.display_name.lower()
-            if submission_subreddit_name != ctx.subreddit.display_name.lower():
-                other_subreddits += 1
+            if not subreddit_context.is_own_item(s):
+                submission_subreddit_name = s.subreddit_name_prefixed[2:].lower()
+                other_subreddit_submissions += 1
                 other_subreddit_history[submission_subreddit_name] = \
                     other_subreddit_history.get(submission_subreddit_name, 0) + 1
                 continue
@@ -186,7 +254,7 @@ def nuke_user(ctx: ExtendedContext, username: str, timeframe: tuple[str] = None,
             submission_created = datetime.datetime.fromtimestamp(s.created_utc)
             submission_age = now - submission_created
             if submission_age.days > cutoff_age.to_days():
-                too_old += 1
+                too_old_submissions += 1
                 continue
             s.mod.remove()
             removed_submissions += 1
@@ -196,7 +264,31 @@ def nuke_user(ctx: ExtendedContext, username: str, timeframe: tuple[str] = None,
             f"{already_removed_submissions} submissions were already removed.\n"
             f"{too_old_submissions} submissions were too old for the {timeframe} timeframe.\n"
         )
-    ctx.chat.send_text(result)
+    yield False, result
+
+
+def _is_ghost(comment: praw.models.Comment) -> bool:
+    """Comment of a deleted account, not from a mod and not already removed"""
+    return not comment.distinguished and not comment.banned_by and not comment.author
+
+
+def _iter_comment_tree(submission: praw.models.Submission):
+    """Yield every comment of the submission, expanding "load more comments" stubs only when they are reached.
+
+    Unlike ``replace_more(limit=None)`` followed by ``list()``, comments are available while the rest of the tree is
+    still being fetched."""
+    pending = collections.deque(submission.comments)
+    seen = set()
+    while pending:
+        item = pending.popleft()
+        if isinstance(item, praw.models.MoreComments):
+            pending.extend(item.comments())
+            continue
+        if item.id in seen:
+            continue
+        seen.add(item.id)
+        yield item
+        pending.extend(item.replies)
 
 
 @nuke.command('ghosts', aliases=['ghost'])
@@ -205,23 +297,40 @@ def nuke_user(ctx: ExtendedContext, username: str, timeframe: tuple[str] = None,
 def nuke_ghosts(ctx: ExtendedContext, thread_id):
     """Nuke deleted users in thread.
     :parameter: thread_id either the submission URL or the submission id"""
-    thread_id = extract_real_thread_id(thread_id)
+    if not _can_remove(ctx):
+        return
+    try:
+        thread_id = extract_real_thread_id(thread_id)
+    except ShortLinkError as ex:
+        ctx.chat.send_text(str(ex), is_error=True)
+        return
     submission = ctx.reddit_session.submission(thread_id)
-    submission.comments.replace_more(limit=None)
+    reddit_url = ctx.subreddit_context.reddit_url
 
-    removed_comments = []
+    removed_comments = 0
+    failed_comments = []
+    with tempfile.TemporaryFile() as report_file:
+        workbook = xlsxwriter.Workbook(report_file, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('Removed Comments')
+        worksheet.write_row(0, 0, ['Id', 'Link', 'Text'])
 
-    for comment in submission.comments.list():
-        if comment.distinguished:  # comment was from mod
-            continue
-        if comment.banned_by:  # comment was already removed
-            continue
-        if comment.author:  # author exists
-            continue
-        removed_comments.append({
-            'Id': comment.id,
-            'Link': ctx.reddit_session.config.reddit_url + comment.permalink,
-            'Text': comment.body})
-        comment.mod.remove()
-    ctx.chat.send_text(f"{len(removed_comments)} comments were removed.\n")
-    ctx.chat.send_table(title="Removed Comments", table=removed_comments, send_as_excel=True)
+        for comment in _iter_comment_tree(submission):
+            if not _is_ghost(comment):
+                continue
+            try:
+                comment.mod.remove()
+            except Exception as ex:
+                ctx.logger.warning(f"Could not remove {comment.id}: {ex!r}")
+                failed_comments.append(comment.id)
+                continue
+            removed_comments += 1
+            worksheet.write_row(removed_comments, 0, [comment.id, reddit_url + comment.permalink, comment.body])
+        workbook.close()
+
+        ctx.chat.send_text(f"{removed_comments} comments were removed.\n")
+        if failed_comments:
+            ctx.chat.send_text(f"Could not remove {len(failed_comments)} comments: {', '.join(failed_comments)}",
+                               is_error=True)
+        if removed_comments:
+            report_file.seek(0, io.SEEK_SET)
+            ctx.chat.send_file(report_file, title="Removed Comments", filename=f"nuke-ghosts-{thread_id}.xlsx")
@@ -0,0 +1,164 @@
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+import psycopg
+
+from commands.reddit.ingest import connect
+
+SQL_POSTS_BY_AUTHOR = """\
+                select
+                    created,
+                    title,
+                    domain,
+                    permalink
+                from
+                    public.submissions
+                where
+                    lower(subreddit) = %(subreddit)s
+                    and lower(author) = lower(%(author)s)
+                    and created > (now() at time zone 'utc' - make_interval(secs => %(seconds)s))
+                order by
+                    created desc;"""
+
+SQL_TOP_POSTERS = """\
+                with window_start as (
+                    select
+                        now() at time zone 'utc' - make_interval(secs => %(seconds)s) as since
+                ), window_counts as (
+                    -- whole hours from the counters
+                    select
+                        author,
+                        posts
+                    from
+                        public.author_hourly_posts, window_start
+                    where
+                        subreddit = %(subreddit)s
+                        and hour >= date_trunc('hour', since) + interval '1 hour'
+                    union all
+                    -- the part of the first hour that is inside the window from the submissions themselves
+                    select
+                        author,
+                        count(*)
+                    from
+                        public.submissions, window_start
+                    where
+                        lower(subreddit) = %(subreddit)s
+                        and author is not null
+                        and created > since
+                        and created < date_trunc('hour', since) + interval '1 hour'
+                    group by
+                        author
+                )
+                select
+                    author,
+                    sum(posts) as posts
+                from
+                    window_counts
+                group by
+                    author
+                having
+                    sum(posts) >= %(min_posts)s
+                order by
+                    sum(posts) desc
+                limit %(limit)s;"""
+
+
+SQL_REPEAT_DOMAINS = """\
+                with window_start as (
+                    select
+                        now() at time zone 'utc' - make_interval(secs => %(seconds)s) as since
+                ), window_counts as (
+                    -- whole hours from the counters
+                    select
+                        domain,
+                        posts
+                    from
+                        public.domain_hourly_posts, window_start
+                    where
+                        subreddit = %(subreddit)s
+                        and hour >= date_trunc('hour', since) + interval '1 hour'
+                    union all
+                    -- the part of the first hour that is inside the window from the submissions themselves
+                    select
+                        domain,
+                        count(*)
+                    from
+                        public.submissions, window_start
+                    where
+                        lower(subreddit) = %(subreddit)s
+                        and domain is not null
+                        and created > since
+                        and created < date_trunc('hour', since) + interval '1 hour'
+                    group by
+                        domain
+                )
+                select
+                    domain,
+                    sum(posts) as posts
+                from
+                    window_counts
+                group by
+                    domain
+                having
+                    sum(posts) >= %(min_posts)s
+                order by
+                    sum(posts) desc
+                limit %(limit)s;"""
+
+_conn: Optional[psycopg.Connection] = None
+_conn_lock = threading.Lock()
+
+
+class QueryResult(NamedTuple):
+    headers: List[str]
+    rows: List[tuple]
+    elapsed: float
+
+    def as_table(self) -> List[dict]:
+        return [dict(zip(self.headers, row)) for row in self.rows]
+
+    @property
+    def latency_text(self) -> str:
+        return f"{len(self.rows)} rows in {self.elapsed * 1000:.1f} ms"
+
+
+def run_query(sql: str, params: dict) -> QueryResult:
+    """Run a query on the shared database connection, reconnecting if the connection was lost.
+
+    Subreddits are matched in lower case (``lower(subreddit)``, the hourly counters store them that way), so the
+    ``subreddit`` parameter must be lower case, e.g. ``ctx.subreddit_context.name_lower``. Authors are matched
+    case-insensitively too (``lower(author)``)."""
+    global _conn
+    with _conn_lock:
+        if _conn is None or _conn.closed:
+            _conn = connect()
+        start = time.perf_counter()
+        try:
+            with _conn.cursor() as cur:
+                cur.execute(sql, params)
+                rows = cur.fetchall()
+                headers = [col.name for col in cur.description]
+            _conn.commit()
+        except psycopg.OperationalError:
+            _conn.close()
+            raise
+        except psycopg.Error:
+            _conn.rollback()
+            raise
+        elapsed = time.perf_counter() - start
+    return QueryResult(headers, rows, elapsed)
+
+
+def posts_by_author(subreddit: str, author: str, seconds: float) -> QueryResult:
+    return run_query(SQL_POSTS_BY_AUTHOR, {'subreddit': subreddit, 'author': author, 'seconds': seconds})
+
+
+def top_posters(subreddit: str, seconds: float, limit: int = 20, min_posts: int = 1) -> QueryResult:
+    return run_query(SQL_TOP_POSTERS,
+                     {'subreddit': subreddit, 'seconds': seconds, 'limit': limit, 'min_posts': min_posts})
+
+
+def repeat_domains(subreddit: str, seconds: float, limit: int = 20, min_posts: int = 2) -> QueryResult:
+    return run_query(SQL_REPEAT_DOMAINS,
+                     {'subreddit': subreddit, 'seconds': seconds, 'limit': limit, 'min_posts': min_posts})
@@ -1,41 +1,54 @@
+import collections
+import datetime
 import io
+import itertools
 import json
+import operator
 import os
 import pathlib
 import tempfile
+import threading
+from typing import Dict, List
 
 import click
 import psycopg
 import xlsxwriter
 from tabulate import tabulate
 
+from background import BackgroundWorker, ensure_worker, get_worker
 from bot_framework.yaml_wrapper import yaml
-from commands import gyrobot
+from commands import gyrobot, DefaultCommandGroup
 from commands.extended_context import ExtendedContext
 
 if 'QUESTIONNAIRE_DATABASE_URL' not in os.environ:
     raise ImportError('QUESTIONNAIRE_DATABASE_URL not found in environment')
 
-SQL_SURVEY_PREFILLED_ANSWERS = r"""select answer[3] AS Code, answer_value as Answer, count(*) AS VoteCount
-from (select regexp_split_to_array(code, '_') AS answer_parts, *
-      from "Answers"
-      where  code = 'q_{0}' or code like 'q\_{0}\_%') AS dt(answer)
-group by 1, 2
-order by 3 desc"""
-SQL_SURVEY_TEXT = r"""select answer_value as Answer, count(*) AS VoteCount 
+SURVEY_CURSOR_ITERSIZE = int(os.environ.get('SURVEY_CURSOR_ITERSIZE', 2000))
+SURVEY_DASHBOARD_INTERVAL = float(os.environ.get('SURVEY_DASHBOARD_INTERVAL', 10))
+SURVEY_RECOUNT_VOTES = int(os.environ.get('SURVEY_RECOUNT_VOTES', 1000))
+DASHBOARD_NAME = 'survey_dashboard'
+
+# Vote counts of every answer of every question, grouped by question number and answer code ("q_3_2" -> 3, "2")
+SQL_SURVEY_ANSWERS = r"""select split_part(code, '_', 2)::int AS Question,
+       nullif(split_part(code, '_', 3), '') AS AnswerCode,
+       answer_value AS AnswerValue,
+       count(*) AS VoteCount
+from "Answers"
+where code ~ '^q_[0-9]+(_|$)'
+group by 1, 2, 3
+order by 1, 4 desc"""
+SQL_SURVEY_LAST_VOTE = 'select max(id) from "Votes"'
+SQL_SURVEY_NEW_VOTES = """select date(datestamp) AS Day, count(*) AS VoteCount
+from "Votes"
+where id > %(after)s and id <= %(until)s
+group by 1"""
+SQL_SURVEY_NEW_ANSWERS = r"""select split_part(code, '_', 2)::int AS Question,
+       nullif(split_part(code, '_', 3), '') AS AnswerCode,
+       answer_value AS AnswerValue,
+       count(*) AS VoteCount
 from "Answers"
-where code = 'q_{0}'
-group by 1
-order by 2 desc"""
-SQL_SURVEY_SCALE_MATRIX = """select answer[3] AS AnswerCode, answer_value AS AnswerValue, count(vote_id) AS VoteCount
-from (select regexp_split_to_array(code, '_') AS answer_parts, *
-      from "Answers"
-      where code like 'q\_{0}\_%') AS dt(answer)
-group by 1, 2
-order by 1, 3 desc"""
-SQL_SURVEY_PARTICIPATION = r"""select count(*), date(datestamp) from "Votes"
-group by date(datestamp)
-order by date(datestamp);"""
+where code ~ '^q_[0-9]+(_|$)' and vote_id > %(after)s and vote_id <= %(until)s
+group by 1, 2, 3"""
 
 
 def _flatten_choices(choices):
@@ -50,6 +63,150 @@ def _flatten_choices(choices):
     return result
 
 
+class Questionnaire:
+    """Questions of the questionnaire file, with the lookups needed to translate answers prepared once"""
+
+    def __init__(self, documents):
+        self.questions = [q for q in documents if q['kind'] not in ('config', 'header')]
+        self.question_ids = [f'q_{1 + i}' for i in range(len(self.questions))]
+        self.choices = [self._choice_map(q) for q in self.questions]
+        self.matrix_values = [list(q['choices'].values()) if q['kind'] == 'scale-matrix' else None
+                              for q in self.questions]
+
+    @staticmethod
+    def _choice_map(question):
+        if question['kind'] in ('tree', 'checktree'):
+            # flatten choices tree
+            return _flatten_choices(question['choices'])
+        elif question['kind'] in ('radio', 'checkbox'):
+            return question['choices']
+        return None
+
+    def __len__(self):
+        return len(self.questions)
+
+
+_questionnaire_cache = {}  # path -> (mtime, Questionnaire)
+_questionnaire_lock = threading.Lock()
+
+
+def _load_questionnaire(questionnaire_file: pathlib.Path) -> Questionnaire:
+    """Parsed questionnaire, parsed again only when the file is modified"""
+    mtime = questionnaire_file.stat().st_mtime
+    with _questionnaire_lock:
+        cached_mtime, questionnaire = _questionnaire_cache.get(questionnaire_file, (None, None))
+        if cached_mtime == mtime:
+            return questionnaire
+        with questionnaire_file.open(encoding='utf8') as qf:
+            questionnaire = Questionnaire(list(yaml.load_all(qf)))
+        _questionnaire_cache[questionnaire_file] = (mtime, questionnaire)
+        return questionnaire
+
+
+class SurveyResults:
+    """Vote counts of the survey, kept up to date incrementally.
+
+    Votes and answers are only ever added, but not necessarily committed in id order, and answers may be stored after
+    their vote. So the last ``SURVEY_RECOUNT_VOTES`` vote ids are counted again on every refresh, and only the votes
+    before them are settled: aggregated once and merged into the cached counts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.settled = 0  # votes up to this id are counted for good
+        self.watermark = 0  # highest vote id seen
+        self.settled_votes_per_day: collections.Counter = collections.Counter()
+        self.recent_votes_per_day: collections.Counter = collections.Counter()
+        # question number -> (answer code, answer value) -> votes
+        self.settled_answers: Dict[int, collections.Counter] = collections.defaultdict(collections.Counter)
+        self.recent_answers: Dict[int, collections.Counter] = collections.defaultdict(collections.Counter)
+
+    @staticmethod
+    def _count(cur, after: int, until: int, votes_per_day: collections.Counter,
+               answers: Dict[int, collections.Counter]):
+        """Add the votes with ids in (after, until] to the counters"""
+        if until <= after:
+            return
+        params = {'after': after, 'until': until}
+        cur.execute(SQL_SURVEY_NEW_VOTES, params)
+        for day, vote_count in cur:
+            votes_per_day[day] += vote_count
+        cur.execute(SQL_SURVEY_NEW_ANSWERS, params)
+        for question_id, answer_code, answer_value, vote_count in cur:
+            answers[question_id][answer_code, answer_value] += vote_count
+
+    def _vote_count(self) -> int:
+        return sum(self.settled_votes_per_day.values()) + sum(self.recent_votes_per_day.values())
+
+    def refresh(self) -> int:
+        """Merge the votes cast since the last refresh, returns how many votes were added"""
+        database_url = os.environ['QUESTIONNAIRE_DATABASE_URL']
+        with self.lock:
+            previous_count = self._vote_count()
+            recent_votes_per_day = collections.Counter()
+            recent_answers = collections.defaultdict(collections.Counter)
+            with psycopg.connect(database_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(SQL_SURVEY_LAST_VOTE)
+                    last_vote = cur.fetchone()[0] or 0
+                    settled = max(self.settled, last_vote - SURVEY_RECOUNT_VOTES)
+                    self._count(cur, self.settled, settled, self.settled_votes_per_day, self.settled_answers)
+                    self.settled = settled
+                    self._count(cur, settled, last_vote, recent_votes_per_day, recent_answers)
+            self.recent_votes_per_day = recent_votes_per_day
+            self.recent_answers = recent_answers
+            self.watermark = last_vote
+            return self._vote_count() - previous_count
+
+    @property
+    def vote_count(self) -> int:
+        with self.lock:
+            return self._vote_count()
+
+    def daily_votes(self) -> List[tuple]:
+        """(votes, day) per day in date order, votes without a datestamp last with day ``'undated'``"""
+        with self.lock:
+            votes_per_day = self.settled_votes_per_day + self.recent_votes_per_day
+        undated = votes_per_day.pop(None, 0)
+        rows = [(vote_count, day) for day, vote_count in sorted(votes_per_day.items())]
+        if undated:
+            rows.append((undated, 'undated'))
+        return rows
+
+    def question_answers(self, question_id) -> List[tuple]:
+        """(answer code, answer value, vote count) rows of a question, most voted first"""
+        with self.lock:
+            answers = (self.settled_answers.get(question_id, collections.Counter()) +
+                       self.recent_answers.get(question_id, collections.Counter()))
+        return sorted(((answer_code, answer_value, vote_count)
+                       for (answer_code, answer_value), vote_count in answers.items()),
+                      key=lambda row: -row[2])
+
+
+_survey_results = SurveyResults()
+
+
+class SurveyDashboard(BackgroundWorker):
+    """Refresh the survey results and post the new votes to the channel the dashboard was started from"""
+
+    def __init__(self, ctx: ExtendedContext, interval: float):
+        super().__init__(DASHBOARD_NAME, ctx.logger, interval)
+        self.conversation = ctx.chat
+        self.channel = ctx.chat.channel_id
+        self.channel_name = getattr(ctx.chat, 'channel_name', None) or self.channel  # not every chat has names
+
+    def run_once(self):
+        new_votes = _survey_results.refresh()
+        if not new_votes:
+            return
+        today = datetime.date.today()
+        votes_today = sum(vote_count for vote_count, day in _survey_results.daily_votes() if day == today)
+        self.conversation.send_text(
+            f"*Survey*: {_survey_results.vote_count} votes (+{new_votes}), {votes_today} today", channel=self.channel)
+
+    def status(self) -> dict:
+        return super().status() | {'Votes': _survey_results.vote_count, 'Last Vote': _survey_results.watermark}
+
+
 def _make_table(title, cols, rows):
     table = tabulate(rows, headers=cols, tablefmt='pipe')
     if title:
@@ -57,38 +214,69 @@ def _make_table(title, cols, rows):
     return table
 
 
-def _survey_question(self, questions, question_id):
-    question = questions[question_id - 1]
+def _question_result(questionnaire, question_id, answers):
+    """Title, columns and rows of a question from its (answer code, answer value, vote count) rows.
+
+    Rows are produced lazily while ``answers`` is consumed, except for matrix questions which are sorted first."""
+    question = questionnaire.questions[question_id - 1]
     title = question['title']
     if question['kind'] in ('checktree', 'checkbox', 'tree', 'radio'):
-        cols, rows = self._survey_database_query(SQL_SURVEY_PREFILLED_ANSWERS.format(question_id))
-        choices = {}
-        if question['kind'] in ('tree', 'checktree'):
-            # flatten choices tree
-            choices = self._flatten_choices(question['choices'])
-        elif question['kind'] in ('radio', 'checkbox'):
-            choices = question['choices']
-        rows = [self._translate_choice(choices, row) for row in rows]
+        choices = questionnaire.choices[question_id - 1]
+        rows = (_translate_choice(choices, row) for row in answers)
         cols = ["Vote Value", "Vote Count"]
     elif question['kind'] in ('text', 'textarea'):
-        cols, rows = self._survey_database_query(SQL_SURVEY_TEXT.format(question_id))
+        cols = ["Answer", "Vote Count"]
+        rows = ((answer_value, vote_count) for answer_code, answer_value, vote_count in answers if answer_code is None)
     elif question['kind'] in ('scale-matrix',):
-        cols, rows = self._survey_database_query(SQL_SURVEY_SCALE_MATRIX.format(question_id))
-        rows = [self._translate_matrix(question['choices'], question['lines'], row) for row in rows]
+        cols = ["Line", "Vote Value", "Vote Count"]
+        rows = sorted((row for row in answers if row[0] is not None), key=lambda row: (row[0], -row[2]))
+        matrix_values = questionnaire.matrix_values[question_id - 1]
+        rows = [_translate_matrix(matrix_values, question['lines'], row) for row in rows]
     else:
         cols = ['Message']
         rows = [('Not implemented',)]
     return title, cols, rows
 
 
-def _survey_database_query(sql):
+def _survey_question(questionnaire, question_id):
+    _survey_results.refresh()
+    return _question_result(questionnaire, question_id, _survey_results.question_answers(question_id))
+
+
+def _survey_all_questions(questionnaire):
+    """Results of all questions, from the incrementally refreshed vote counts"""
+    _survey_results.refresh()
+    result = []
+    for question_id in range(1, len(questionnaire) + 1):
+        title, cols, rows = _question_result(questionnaire, question_id, _survey_results.question_answers(question_id))
+        result.append({'title': title, 'question_code': f'q_{question_id}', 'cols': cols, 'rows': list(rows)})
+    return result
+
+
+def _write_survey_workbook(questionnaire, output):
+    """Write the results of all questions to an xlsx file, one sheet per question.
+
+    Answers are read through a server-side cursor, ``SURVEY_CURSOR_ITERSIZE`` rows at a time, and the workbook is
+    written in constant memory mode, so memory use doesn't grow with the number of (text) answers."""
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
     database_url = os.environ['QUESTIONNAIRE_DATABASE_URL']
     with psycopg.connect(database_url) as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql)
-            rows = cur.fetchall()
-            cols = [col.name for col in cur.description]
-    return cols, rows
+        with conn.cursor(name='survey_answers') as cur:
+            cur.itersize = SURVEY_CURSOR_ITERSIZE
+            cur.execute(SQL_SURVEY_ANSWERS)
+            answers = itertools.groupby(cur, key=operator.itemgetter(0))
+            current_id, current_answers = next(answers, (None, iter(())))
+            for question_id in range(1, len(questionnaire) + 1):
+                while current_id is not None and current_id < question_id:  # answers to unknown questions
+                    current_id, current_answers = next(answers, (None, iter(())))
+                question_answers = (row[1:] for row in current_answers) if current_id == question_id else ()
+                title, cols, rows = _question_result(questionnaire, question_id, question_answers)
+                worksheet = workbook.add_worksheet(f'q_{question_id}')
+                worksheet.write(0, 0, title)
+                worksheet.write_row(2, 0, cols)
+                for row_number, row in enumerate(rows, start=3):
+                    worksheet.write_row(row_number, 0, row)
+    workbook.close()
 
 
 def _translate_choice(choices, row):
@@ -104,12 +292,11 @@ def _translate_choice(choices, row):
     return choice_value, choice_count
 
 
-def _translate_matrix(choices, lines, row):
+def _translate_matrix(matrix_values, lines, row):
     line = int(row[0])
     answer = int(row[1])
     count = row[2]
-    answer_key = list(choices.keys())[answer - 1]
-    return lines[line - 1] or '<empty>', choices[answer_key], count
+    return lines[line - 1] or '<empty>', matrix_values[answer - 1], count
 
 
 def _truncate(text, length):
@@ -119,36 +306,75 @@ def _truncate(text, length):
         return text[:length - 3] + '...'
 
 
-@gyrobot.group('survey')
+@gyrobot.group('survey',
+               cls=DefaultCommandGroup,
+               invoke_without_command=True,
+               context_settings={
+                   'ignore_unknown_options': True,
+                   'allow_extra_args': True})
 @click.pass_context
 def survey(ctx: ExtendedContext):
-    """Get results from survey"""
+    """Get results from survey
+
+    Syntax:
+    survey count|questions|questions_full|mods|votes_per_day|q_N|full_replies [json]
+    survey dashboard [stop]: post new votes every few seconds"""
     if 'QUESTIONNAIRE_DATABASE_URL' not in os.environ:
         ctx.chat.send_text('No questionnaire found', is_error=True)
-        return
+        ctx.exit()
     if 'QUESTIONNAIRE_FILE' not in os.environ:
         ctx.chat.send_text('No questionnaire file defined', is_error=True)
-        return
+        ctx.exit()
     questionnaire_file = pathlib.Path('data') / os.environ['QUESTIONNAIRE_FILE']
     if not questionnaire_file.exists():
         ctx.chat.send_text('No questionnaire file found', is_error=True)
+        ctx.exit()
+    questionnaire = _load_questionnaire(questionnaire_file)
+    ctx.obj['questionnaire'] = questionnaire
+    ctx.obj['questions'] = questionnaire.questions
+    ctx.obj['question_ids'] = questionnaire.question_ids
+    if ctx.invoked_subcommand is None:
+        ctx.invoke(survey_query)
+
+
+@survey.command('dashboard')
+@click.argument('action', type=click.Choice(['start', 'stop'], case_sensitive=False), default='start')
+@click.pass_context
+def survey_dashboard(ctx: ExtendedContext, action='start'):
+    """Post the number of new votes to this channel every SURVEY_DASHBOARD_INTERVAL seconds"""
+    if action.lower() == 'stop':
+        if (dashboard := get_worker(DASHBOARD_NAME)) is None:
+            ctx.chat.send_text('Survey dashboard is not running', is_error=True)
+            return
+        dashboard.stop()
+        ctx.chat.send_text('Survey dashboard stopped')
         return
-    with questionnaire_file.open(encoding='utf8') as qf:
-        questionnaire_data = list(yaml.load_all(qf))
-    questions = [q for q in questionnaire_data if q['kind'] not in ('config', 'header')]
-    question_ids = [f'q_{1 + i}' for i in range(len(questions))]
-    ctx.obj['questions'] = questions
-    ctx.obj['question_ids'] = question_ids
-    args = ctx.args
+    dashboard = ensure_worker(DASHBOARD_NAME, lambda: SurveyDashboard(ctx, SURVEY_DASHBOARD_INTERVAL))
+    where = 'this channel' if dashboard.channel == ctx.chat.channel_id else f"channel {dashboard.channel_name}"
+    ctx.chat.send_text(f"Survey dashboard is running every {dashboard.interval} seconds in {where}")
+
+
+@survey.command('query',
+                default_command=True,
+                context_settings={
+                    'ignore_unknown_options': True,
+                    'allow_extra_args': True})
+@click.pass_context
+def survey_query(ctx: ExtendedContext):
+    """Query survey results"""
+    questionnaire = ctx.obj['questionnaire']
+    questions = questionnaire.questions
+    question_ids = questionnaire.question_ids
+    args = list(ctx.args)
     if len(args) == 0:
         args = ['']
     title = None
     if args[0] == 'mods':
         args[0] = 'q_60'
     if args[0] == 'count':
-        sql = 'SELECT COUNT(*) FROM "Votes"'
         result_type = 'single'
-        _, rows = _survey_database_query(sql)
+        _survey_results.refresh()
+        rows = [(_survey_results.vote_count,)]
     elif args[0] in ('questions', 'questions_full'):
         trunc_length = 60 if args[0] == 'questions' else 200
         result_type = 'table'
@@ -156,22 +382,19 @@ def survey(ctx: ExtendedContext):
         rows = [(f"\u266f{1 + i}", q['kind'], _truncate(q['title'], trunc_length)) for i, q in
                 enumerate(questions)]
     elif args[0] == 'votes_per_day':
-        sql = SQL_SURVEY_PARTICIPATION
         result_type = 'table'
-        cols, rows = _survey_database_query(sql)
+        _survey_results.refresh()
+        cols = ['count', 'date']
+        rows = _survey_results.daily_votes()
     elif args[0] in question_ids:
         question_id = int(args[0].split('_')[-1])
         result_type = 'table'
-        title, cols, rows = _survey_question(questions, question_id)
+        title, cols, rows = _survey_question(questionnaire, question_id)
     elif args[0] == 'full_replies':
         result_type = 'full_table'
         if len(args) > 1 and args[1] == 'json':
             result_type = 'full_table_json'
-        result = []
-        for question_text_id in question_ids:
-            question_id = int(question_text_id.split('_')[-1])
-            title, cols, rows = _survey_question(questions, question_id)
-            result.append({'title': title, 'question_code': question_text_id, 'cols': cols, 'rows': rows})
+            result = _survey_all_questions(questionnaire)
     else:
         valid_queries = ['count', 'questions', 'questions_full', 'mods', 'votes_per_day', 'full_replies'] + \
                         ['q_1', '...', f'q_{str(len(questions))}']
@@ -184,29 +407,10 @@ def survey(ctx: ExtendedContext):
     elif result_type == 'table':
         ctx.chat.send_table(title=title, table=[dict(zip(cols, row)) for row in rows])
     elif result_type == 'full_table':
-        filedata = b''
         with tempfile.TemporaryFile() as tmpfile:
-            workbook = xlsxwriter.Workbook(tmpfile)
-            for question_response in result:
-                worksheet = workbook.add_worksheet()
-                worksheet.name = question_response['question_code']
-                title = question_response['title']
-                cols = question_response['cols']
-                rows = question_response['rows']
-
-                worksheet.write('A1', title)
-                for col_number, col in enumerate(cols):
-                    worksheet.write(2, col_number, col)
-                for row_number, row in enumerate(rows):
-                    for col_number, col in enumerate(cols):
-                        worksheet.write(3 + row_number, col_number, row[col_number])
-                # table = self.make_table(title, cols, rows)
-                # full_table += table + '\n\n'
-            workbook.close()
-            tmpfile.flush()
+            _write_survey_workbook(questionnaire, tmpfile)
             tmpfile.seek(0, io.SEEK_SET)
-            filedata = tmpfile.read()
-        ctx.chat.send_file(filedata, filename="Survey_Results.xlsx", title="Survey Results")
+            ctx.chat.send_file(tmpfile, filename="Survey_Results.xlsx", title="Survey Results")
     elif result_type == 'full_table_json':
         filedata = json.dumps(result)
         ctx.chat.send_file(filedata, filename='Survey_Results.json', title="Survey Results")
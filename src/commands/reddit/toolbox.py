@@ -0,0 +1,130 @@
+import base64
+import copy
+import json
+import threading
+import zlib
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import praw
+import prawcore
+
+
+class Usernotes(NamedTuple):
+    users: Dict[str, dict]  # keyed by lowercase username
+    warnings: List[str]
+    mod_names: List[str]
+
+    def get(self, username: str) -> Optional[dict]:
+        return self.users.get(username.lower())
+
+
+class ToolboxConflict(Exception):
+    pass
+
+
+class ToolboxConfig:
+    def __init__(self, data: dict):
+        self.data = data
+        self.usernote_colors = {c['key']: c for c in data.get('usernoteColors', [])}
+        self.domain_tags = {tag['name']: tag for tag in data.setdefault('domainTags', [])}
+
+    def copy(self) -> 'ToolboxConfig':
+        return ToolboxConfig(copy.deepcopy(self.data))
+
+    def set_domain_tag(self, name: str, color: str) -> str:
+        """Add or update the tag of a domain. Returns what was done: added, updated or unchanged"""
+        tag = self.domain_tags.get(name)
+        if tag is None:
+            tag = {'name': name, 'color': color}
+            self.data['domainTags'].append(tag)
+            self.domain_tags[name] = tag
+            return 'added'
+        if tag.get('color') == color:
+            return 'unchanged'
+        tag['color'] = color
+        return 'updated'
+
+    def to_json(self) -> str:
+        return json.dumps(self.data)
+
+
+def _parse_usernotes(content_md: str) -> Usernotes:
+    tb_notes = json.loads(content_md)
+    blob = json.loads(zlib.decompress(base64.b64decode(tb_notes['blob'])).decode())
+    return Usernotes(
+        users={username.lower(): notes for username, notes in blob.items()},
+        warnings=tb_notes['constants']['warnings'],
+        mod_names=tb_notes['constants']['users'])
+
+
+def _parse_toolbox_config(content_md: str) -> ToolboxConfig:
+    return ToolboxConfig(json.loads(content_md))
+
+
+def latest_revision_id(wiki_page: praw.models.WikiPage) -> Optional[str]:
+    """Id of the latest revision of a wiki page, without downloading the page content"""
+    latest_revision = next(iter(wiki_page.revisions(limit=1)), None)
+    return latest_revision['id'] if latest_revision else None
+
+
+class WikiRevisionCache:
+    """Parsed content of a wiki page per subreddit, parsed again only when the page revision changes"""
+
+    def __init__(self, page_name: str, parse: Callable[[str], object]):
+        self.page_name = page_name
+        self.parse = parse
+        self.lock = threading.Lock()
+        self.entries: Dict[str, tuple] = {}  # subreddit name -> (revision id, parsed value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, subreddit: praw.reddit.Subreddit):
+        return self.get_with_revision(subreddit)[1]
+
+    def get_with_revision(self, subreddit: praw.reddit.Subreddit) -> tuple:
+        """Revision id and parsed content of the latest revision of the page"""
+        key = subreddit.display_name.lower()
+        wiki_page = subreddit.wiki[self.page_name]
+        revision_id = latest_revision_id(wiki_page)
+        with self.lock:
+            cached_revision_id, value = self.entries.get(key, (None, None))
+            if revision_id is not None and revision_id == cached_revision_id:
+                self.hits += 1
+                return cached_revision_id, value
+        value = self.parse(wiki_page.content_md)
+        with self.lock:
+            self.entries[key] = (wiki_page.revision_id, value)
+            self.misses += 1
+        return wiki_page.revision_id, value
+
+    def invalidate(self, subreddit: praw.reddit.Subreddit):
+        with self.lock:
+            self.entries.pop(subreddit.display_name.lower(), None)
+
+
+usernotes_cache = WikiRevisionCache('usernotes', _parse_usernotes)
+toolbox_config_cache = WikiRevisionCache('toolbox', _parse_toolbox_config)
+
+
+def update_toolbox_config(subreddit: praw.reddit.Subreddit, update: Callable[[ToolboxConfig], object],
+                          reason: str, retries: int = 1) -> tuple:
+    """Apply ``update`` to a copy of the toolbox config and save it in a single wiki edit.
+
+    The edit is made against the revision the changes were applied to, so reddit rejects it if another moderator
+    edited the page in between. In that case the changes are applied again on top of the new revision, up to
+    ``retries`` times. Returns the result of ``update`` and the number of conflicts encountered."""
+    conflicts = 0
+    while True:
+        revision_id, config = toolbox_config_cache.get_with_revision(subreddit)
+        new_config = config.copy()
+        result = update(new_config)
+        try:
+            subreddit.wiki['toolbox'].edit(content=new_config.to_json(), reason=reason, previous=revision_id)
+        except prawcore.exceptions.Conflict:
+            toolbox_config_cache.invalidate(subreddit)
+            conflicts += 1
+            if conflicts > retries:
+                raise ToolboxConflict(f"Toolbox configuration was edited by someone else ({conflicts} times)")
+            continue
+        toolbox_config_cache.invalidate(subreddit)
+        return result, conflicts
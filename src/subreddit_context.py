@@ -0,0 +1,45 @@
+import functools
+import threading
+from typing import FrozenSet, Optional
+
+import praw
+
+
+class SubredditContext:
+    """Values about the bot's subreddit that never change while the bot runs, computed once at startup.
+
+    Listing items carry the name of their subreddit as a plain string (``subreddit_name_prefixed``), so
+    ``is_own_item`` can filter them without creating a lazy ``Subreddit`` object for every item."""
+
+    def __init__(self, subreddit: praw.reddit.Subreddit, reddit_session: praw.Reddit,
+                 bot_reddit_session: Optional[praw.Reddit] = None):
+        self.subreddit = subreddit
+        self.reddit_session = reddit_session
+        self.bot_reddit_session = bot_reddit_session
+        self.name = subreddit.display_name
+        self.name_lower = self.name.lower()
+        self.prefixed_name_lower = 'r/' + self.name_lower
+        self.reddit_url = reddit_session.config.reddit_url
+        self.subreddit_url = f'{self.reddit_url}/r/{self.name}'
+        self._lock = threading.Lock()
+
+    def is_own_item(self, item) -> bool:
+        """Whether a comment or submission belongs to this subreddit"""
+        return item.subreddit_name_prefixed.lower() == self.prefixed_name_lower
+
+    @functools.cached_property
+    def mod_permissions(self) -> FrozenSet[str]:
+        """Moderator permissions of the main account, fetched the first time they are needed"""
+        with self._lock:
+            me = self.reddit_session.user.me()
+            moderators = list(self.subreddit.moderator(redditor=me))
+            return frozenset(moderators[0].mod_permissions) if moderators else frozenset()
+
+    def has_permission(self, permission: str) -> bool:
+        return 'all' in self.mod_permissions or permission in self.mod_permissions
+
+    @functools.cached_property
+    def bot_username(self) -> str:
+        """Name of the alt account (``REDDIT_ALT_USER``) the bot session is logged in as, fetched the first time it
+        is needed"""
+        return self.bot_reddit_session.user.me().name
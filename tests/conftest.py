@@ -0,0 +1,4 @@
+import os
+
+# commands.reddit refuses to load without a subreddit
+os.environ.setdefault('SUBREDDIT_NAME', 'test')
@@ -0,0 +1,102 @@
+"""Local stand-in for archive.is, covering the part of ``/submit/`` that :mod:`commands.reddit.archiver` uses.
+
+Submitted pages are answered like archive.is does: a redirect to the archived page, or (for urls containing ``wip``)
+a 200 "work in progress" page with a ``Refresh`` header pointing to it. Urls can be set up to fail a number of times
+first. Run it by hand and point the bot at it with ``ARCHIVE_URL=http://127.0.0.1:<port>``:
+
+    python tests/fake_archive.py [PORT]
+"""
+import hashlib
+import http.server
+import sys
+import threading
+import time
+import urllib.parse
+from typing import Dict, List, Tuple
+
+
+class FakeArchive(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0):
+        super().__init__(('127.0.0.1', port), _ArchiveHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.submissions: List[Tuple[float, str]] = []
+        self.failures: Dict[str, List[int]] = {}
+        self.active = 0
+        self.max_active = 0
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def archived_url(self, url: str) -> str:
+        return f'{self.url}/{hashlib.sha1(url.encode()).hexdigest()[:5]}'
+
+    def fail(self, url: str, *statuses: int):
+        """Answer the next submissions of ``url`` with these status codes, in order"""
+        self.failures[url] = list(statuses)
+
+    def submitted(self) -> List[str]:
+        with self.lock:
+            return [url for _, url in self.submissions]
+
+    def start(self) -> 'FakeArchive':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _ArchiveHandler(http.server.BaseHTTPRequestHandler):
+    server: FakeArchive
+
+    def do_POST(self):
+        if self.path != '/submit/':
+            self.send_error(404)
+            return
+        form = urllib.parse.parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        url = form['url'][0]
+        server = self.server
+        with server.lock:
+            server.submissions.append((time.monotonic(), url))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            statuses = server.failures.get(url)
+            status = statuses.pop(0) if statuses else None
+        try:
+            time.sleep(server.latency)
+            if status is not None:
+                self.send_error(status)
+            elif 'wip' in url:
+                self._send_page(200, {'Refresh': f'0;url={server.archived_url(url)}'})
+            else:
+                self._send_page(302, {'Location': server.archived_url(url)})
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def do_GET(self):
+        self._send_page(200, {})
+
+    def _send_page(self, status: int, headers: Dict[str, str]):
+        body = b'<html><body>archived</body></html>'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    archive = FakeArchive(int(sys.argv[1]) if len(sys.argv) > 1 else 8099)
+    print(f'Serving on {archive.url}')
+    archive.serve_forever()
@@ -0,0 +1,232 @@
+"""Local stand-in for the Kubernetes API, covering the list and watch calls of :mod:`commands.openshift.informer`.
+
+Deployments, statefulsets, pods and cronjobs are kept in memory with a cluster-wide resourceVersion, like the real
+API server. Watches stream the changes after a resourceVersion (chunked, one JSON event per line) until their
+``timeoutSeconds``, with periodic bookmarks, and answer a resourceVersion older than the kept history with a 410 Gone
+ERROR event. Requests can be set up to fail.
+
+    python tests/fake_kubernetes.py [PORT]
+"""
+import copy
+import http.server
+import json
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from typing import Dict, List, Optional, Tuple
+
+# resource -> (API path prefix, kind, apiVersion)
+RESOURCES = {
+    'deployments': ('/apis/apps/v1', 'Deployment', 'apps/v1'),
+    'statefulsets': ('/apis/apps/v1', 'StatefulSet', 'apps/v1'),
+    'pods': ('/api/v1', 'Pod', 'v1'),
+    'cronjobs': ('/apis/batch/v1', 'CronJob', 'batch/v1'),
+}
+_POD_SPEC = {'containers': [{'name': 'app', 'image': 'registry.example/app:1'}]}
+_POD_TEMPLATE = {'metadata': {}, 'spec': _POD_SPEC}
+# spec of a minimal object the client can deserialize
+_SPECS = {
+    'deployments': {'replicas': 1, 'selector': {'matchLabels': {}}, 'template': _POD_TEMPLATE},
+    'statefulsets': {'replicas': 1, 'selector': {'matchLabels': {}}, 'template': _POD_TEMPLATE},
+    'pods': _POD_SPEC,
+    'cronjobs': {'schedule': '0 * * * *', 'jobTemplate': {'spec': {'template': _POD_TEMPLATE}}},
+}
+_PATH_REGEX = re.compile(r'^(?P<prefix>/apis?/(?:[a-z]+/)?v1)/namespaces/(?P<namespace>[^/]+)/(?P<resource>[a-z]+)$')
+
+
+class FakeKubernetes(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, bookmark_interval: float = 0.2):
+        super().__init__(('127.0.0.1', port), _KubernetesHandler)
+        self.bookmark_interval = bookmark_interval
+        self.changed = threading.Condition()
+        self.closing = threading.Event()
+        self.resource_version = 1
+        self.objects: Dict[Tuple[str, str], Dict[str, dict]] = {}  # (resource, namespace) -> name -> object
+        self.history: List[Tuple[int, str, str, str, dict]] = []  # (rv, resource, namespace, event type, object)
+        self.oldest_version = 1  # watches from before this get 410 Gone
+        self.watch_generation = 0
+        self.failures: Dict[str, List[int]] = {'list': [], 'watch': []}
+        self.requests: List[str] = []
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def _change(self, resource: str, namespace: str, event_type: str, obj: dict):
+        self.resource_version += 1
+        obj['metadata']['resourceVersion'] = str(self.resource_version)
+        self.history.append((self.resource_version, resource, namespace, event_type, copy.deepcopy(obj)))
+        self.changed.notify_all()
+
+    def add(self, resource: str, namespace: str, name: str, labels: Dict[str, str] = None):
+        _, kind, api_version = RESOURCES[resource]
+        obj = {'apiVersion': api_version, 'kind': kind,
+               'metadata': {'name': name, 'namespace': namespace, 'labels': labels or {}},
+               'spec': copy.deepcopy(_SPECS[resource])}
+        with self.changed:
+            self.objects.setdefault((resource, namespace), {})[name] = obj
+            self._change(resource, namespace, 'ADDED', obj)
+
+    def label(self, resource: str, namespace: str, name: str, labels: Dict[str, str]):
+        with self.changed:
+            obj = self.objects[resource, namespace][name]
+            obj['metadata']['labels'] = labels
+            self._change(resource, namespace, 'MODIFIED', obj)
+
+    def delete(self, resource: str, namespace: str, name: str):
+        with self.changed:
+            obj = self.objects[resource, namespace].pop(name)
+            self._change(resource, namespace, 'DELETED', obj)
+
+    def compact(self):
+        """Forget the history, like etcd compaction: watches from an older resourceVersion get 410 Gone"""
+        with self.changed:
+            self.history.clear()
+            self.oldest_version = self.resource_version
+
+    def end_watches(self):
+        """End all open watches, like an API server restart"""
+        with self.changed:
+            self.watch_generation += 1
+            self.changed.notify_all()
+
+    def fail(self, request_kind: str, *statuses: int):
+        """Answer the next ``list`` or ``watch`` requests with these status codes, in order"""
+        with self.changed:
+            self.failures[request_kind] = list(statuses)
+
+    def start(self) -> 'FakeKubernetes':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.closing.set()
+        self.end_watches()
+        self.shutdown()
+        self.server_close()
+
+
+def _matches(obj: dict, label_selector: Optional[str]) -> bool:
+    labels = obj['metadata'].get('labels') or {}
+    return all(labels.get(key) == value
+               for key, _, value in (requirement.partition('=') for requirement in label_selector.split(',')))
+
+
+class _KubernetesHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: FakeKubernetes
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = {key: values[0] for key, values in urllib.parse.parse_qs(url.query).items()}
+        m = _PATH_REGEX.match(url.path)
+        if not m or m['resource'] not in RESOURCES or RESOURCES[m['resource']][0] != m['prefix']:
+            self._send_status(404, 'NotFound', f'{url.path} not found')
+            return
+        watch = query.get('watch') == 'true'
+        server = self.server
+        with server.changed:
+            server.requests.append(('watch ' if watch else 'list ') + url.path)
+            statuses = server.failures['watch' if watch else 'list']
+            status = statuses.pop(0) if statuses else None
+        if status is not None:
+            self._send_status(status, 'Failure', f'failing with {status} as asked')
+        elif watch:
+            self._watch(m['resource'], m['namespace'], query)
+        else:
+            self._list(m['resource'], m['namespace'], query.get('labelSelector'))
+
+    def _list(self, resource: str, namespace: str, label_selector: Optional[str]):
+        _, kind, api_version = RESOURCES[resource]
+        with self.server.changed:
+            objects = self.server.objects.get((resource, namespace), {})
+            items = [copy.deepcopy(objects[name]) for name in sorted(objects)
+                     if not label_selector or _matches(objects[name], label_selector)]
+            resource_version = str(self.server.resource_version)
+        self._send_json(200, {'apiVersion': api_version, 'kind': f'{kind}List',
+                              'metadata': {'resourceVersion': resource_version}, 'items': items})
+
+    def _watch(self, resource: str, namespace: str, query: Dict[str, str]):
+        server = self.server
+        since = int(query.get('resourceVersion') or server.resource_version)
+        deadline = time.monotonic() + float(query.get('timeoutSeconds', 60))
+        bookmarks = query.get('allowWatchBookmarks') == 'true'
+        _, kind, api_version = RESOURCES[resource]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        with server.changed:
+            generation = server.watch_generation
+            if since < server.oldest_version:
+                self._send_event({'type': 'ERROR', 'object': {
+                    'kind': 'Status', 'apiVersion': 'v1', 'status': 'Failure', 'reason': 'Expired', 'code': 410,
+                    'message': f'too old resource version: {since} ({server.oldest_version})'}})
+                self._end_chunks()
+                return
+        last_bookmark = time.monotonic()
+        while True:
+            with server.changed:
+                if not (events := self._events_after(resource, namespace, since)) and \
+                        not self._ended(deadline, generation):
+                    server.changed.wait(min(deadline - time.monotonic(), server.bookmark_interval))
+                    events = self._events_after(resource, namespace, since)
+                current_version = server.resource_version
+                ended = self._ended(deadline, generation)
+            try:
+                for rv, event_type, obj in events:
+                    self._send_event({'type': event_type, 'object': obj})
+                    since = rv
+                if bookmarks and time.monotonic() - last_bookmark >= server.bookmark_interval:
+                    self._send_event({'type': 'BOOKMARK', 'object': {
+                        'kind': kind, 'apiVersion': api_version,
+                        'metadata': {'resourceVersion': str(current_version)}}})
+                    since = current_version
+                    last_bookmark = time.monotonic()
+                if ended:
+                    self._end_chunks()
+                    return
+            except (BrokenPipeError, ConnectionResetError):
+                return  # the client stopped watching
+
+    def _events_after(self, resource: str, namespace: str, since: int) -> List[Tuple[int, str, dict]]:
+        return [(rv, event_type, obj) for rv, r, ns, event_type, obj in self.server.history
+                if rv > since and r == resource and ns == namespace]
+
+    def _ended(self, deadline: float, generation: int) -> bool:
+        server = self.server
+        return time.monotonic() >= deadline or generation != server.watch_generation or server.closing.is_set()
+
+    def _send_event(self, event: dict):
+        data = json.dumps(event).encode() + b'\n'
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+
+    def _end_chunks(self):
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _send_status(self, code: int, reason: str, message: str):
+        self._send_json(code, {'kind': 'Status', 'apiVersion': 'v1', 'status': 'Failure', 'reason': reason,
+                               'message': message, 'code': code})
+
+    def _send_json(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    api = FakeKubernetes(int(sys.argv[1]) if len(sys.argv) > 1 else 8098)
+    print(f'Serving on {api.url}')
+    api.serve_forever()
@@ -0,0 +1,135 @@
+import pytest
+
+from commands.reddit import archiver
+from fake_archive import FakeArchive
+
+
+@pytest.fixture
+def fake_archive(monkeypatch):
+    archive = FakeArchive(latency=0.02).start()
+    monkeypatch.setattr(archiver, 'ARCHIVE_URL', archive.url)
+    monkeypatch.setattr(archiver, 'ARCHIVE_HOST_INTERVAL', 0.01)
+    monkeypatch.setattr(archiver, '_throttle', archiver._HostThrottle(0))
+    yield archive
+    archive.stop()
+
+
+def _urls(count: int) -> list:
+    return [f'https://www.reddit.com/r/test/comments/{i:x}/' for i in range(count)]
+
+
+def test_archives_every_url_and_writes_results(fake_archive, tmp_path):
+    urls = _urls(20)
+    results_file = tmp_path / 'results.tsv'
+    results, failed = archiver.archive_urls(urls, results_file)
+    old_urls = [url.replace('//www.', '//old.') for url in urls]
+    assert failed == []
+    assert results == {url: fake_archive.archived_url(old_url) for url, old_url in zip(urls, old_urls)}
+    assert sorted(fake_archive.submitted()) == sorted(old_urls)
+    assert archiver._read_results(results_file) == results
+
+
+def test_work_in_progress_page_returns_refresh_target(fake_archive, tmp_path):
+    url = 'https://www.reddit.com/r/test/comments/wip/'
+    results, failed = archiver.archive_urls([url], tmp_path / 'results.tsv')
+    assert results == {url: fake_archive.archived_url(url.replace('//www.', '//old.'))}
+
+
+def test_retries_rate_limits_and_server_errors(fake_archive, tmp_path):
+    url = _urls(1)[0]
+    fake_archive.fail(url.replace('//www.', '//old.'), 429, 503)
+    results, failed = archiver.archive_urls([url], tmp_path / 'results.tsv')
+    assert failed == []
+    assert url in results
+    assert len(fake_archive.submitted()) == 3
+
+
+def test_reports_failures_and_retries_them_on_resume(fake_archive, tmp_path):
+    urls = _urls(5)
+    results_file = tmp_path / 'results.tsv'
+    broken = urls[2].replace('//www.', '//old.')
+    fake_archive.fail(broken, *[500] * (1 + archiver.ARCHIVE_RETRIES))
+    results, failed = archiver.archive_urls(urls, results_file)
+    assert [url for url, _ in failed] == [urls[2]]
+    assert urls[2] not in archiver._read_results(results_file)
+
+    results, failed = archiver.archive_urls(urls, results_file)
+    assert failed == []
+    assert list(results) == urls
+    # the second run only submitted the page that failed the first time
+    assert fake_archive.submitted()[-1] == broken
+    assert len(fake_archive.submitted()) == 4 + (1 + archiver.ARCHIVE_RETRIES) + 1
+
+
+def test_resume_skips_urls_with_results(fake_archive, tmp_path):
+    urls = _urls(6)
+    results_file = tmp_path / 'results.tsv'
+    results_file.write_text(''.join(f'{url}\thttp://archive.example/{i}\n' for i, url in enumerate(urls[:4])))
+    results, failed = archiver.archive_urls(urls, results_file)
+    assert failed == []
+    assert results[urls[0]] == 'http://archive.example/0'
+    assert sorted(fake_archive.submitted()) == sorted(url.replace('//www.', '//old.') for url in urls[4:])
+
+
+def test_concurrency_is_bounded(fake_archive, tmp_path):
+    fake_archive.latency = 0.1
+    archiver.archive_urls(_urls(3 * archiver.ARCHIVE_WORKERS), tmp_path / 'results.tsv')
+    assert 1 < fake_archive.max_active <= archiver.ARCHIVE_WORKERS
+
+
+class _Clock:
+    """Stand-in for the time module of the archiver: sleeping moves the start of the last request, not the clock"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.starts = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.starts[-1] += seconds
+
+
+def _throttled_starts(monkeypatch, throttle, requests):
+    """Start times of (arrival time, url) requests going through the throttle"""
+    clock = _Clock()
+    monkeypatch.setattr(archiver, 'time', clock)
+    for arrival, url in requests:
+        clock.now = arrival
+        clock.starts.append(arrival)
+        throttle.wait(url)
+    return clock.starts
+
+
+def test_requests_to_the_archive_are_spaced(monkeypatch):
+    throttle = archiver._HostThrottle(2)
+    starts = _throttled_starts(monkeypatch, throttle, [(0, 'http://a/submit/')] * 3 + [(9, 'http://a/submit/')])
+    assert starts == [0, 2, 4, 9]
+
+
+def test_every_worker_can_send_a_request_per_interval(monkeypatch):
+    throttle = archiver._HostThrottle(2, burst=4)
+    starts = _throttled_starts(monkeypatch, throttle, [(0, 'http://a/submit/')] * 6 + [(10, 'http://a/submit/')] * 5)
+    assert starts == [0, 0, 0, 0, 0.5, 1, 10, 10, 10, 10, 10.5]
+
+
+def test_hosts_are_throttled_separately(monkeypatch):
+    throttle = archiver._HostThrottle(2)
+    starts = _throttled_starts(monkeypatch, throttle, [(0, 'http://a/submit/'), (0, 'http://b/submit/')] * 2)
+    assert starts == [0, 0, 2, 2]
+
+
+def test_workers_overlap_under_the_default_throttle(fake_archive, tmp_path, monkeypatch):
+    fake_archive.latency = 0.1
+    burst = archiver.ARCHIVE_WORKERS
+    monkeypatch.setattr(archiver, '_throttle', archiver._HostThrottle(0.05 * burst, burst))
+    archiver.archive_urls(_urls(2 * burst), tmp_path / 'results.tsv')
+    assert fake_archive.max_active > 1
+
+
+def test_progress_is_reported(fake_archive, tmp_path):
+    calls = []
+    archiver.archive_urls(_urls(4), tmp_path / 'results.tsv', lambda done, total: calls.append((done, total)),
+                          progress_interval=0)
+    assert calls == [(1, 4), (2, 4), (3, 4), (4, 4)]
@@ -0,0 +1,136 @@
+import logging
+import time
+
+import click
+import pytest
+
+import background
+from commands.extended_context import ExtendedContext
+from commands.openshift import informer
+from commands.openshift.api import KubernetesConnection
+from fake_kubernetes import FakeKubernetes
+
+NAMESPACE = 'test-project'
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    api = FakeKubernetes(bookmark_interval=0.1).start()
+    monkeypatch.setenv('KUBERNETES_INFORMERS', 'true')
+    monkeypatch.setattr(informer.Informer, 'interval', 0.05)
+    monkeypatch.setattr(informer, 'INFORMER_WATCH_TIMEOUT', 60)
+    yield api
+    for worker in background.all_workers():
+        if isinstance(worker, informer.Informer):
+            worker.stop()
+            worker.join(5)
+    api.stop()
+
+
+@pytest.fixture
+def k8s(fake_api):
+    ctx = ExtendedContext(click.Command('test'), obj={
+        'logger': logging.getLogger('test'),
+        'config': {'environments': {'test': {'url': fake_api.url, 'credentials': 'token',
+                                             'project_name': NAMESPACE}}}})
+    with KubernetesConnection(ctx, 'test') as k8s:
+        yield k8s
+
+
+def _worker(k8s, kind: str) -> informer.Informer:
+    return background.get_worker(f'informer-{kind}-{k8s.server_url}-{k8s.project_name}')
+
+
+def _names(objects) -> list:
+    return [obj.metadata.name for obj in objects]
+
+
+def _wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.02)
+
+
+@pytest.mark.parametrize('kind', list(informer.LIST_FUNCTIONS))
+def test_lists_every_kind_from_the_cache(fake_api, k8s, kind):
+    fake_api.add(kind, NAMESPACE, 'b')
+    fake_api.add(kind, NAMESPACE, 'a', {'app': 'web'})
+    fake_api.add(kind, 'other-project', 'c')
+    assert _names(informer.list_objects(k8s, kind)) == ['a', 'b']
+    assert _names(informer.list_objects(k8s, kind, 'app=web')) == ['a']
+    lists = len(fake_api.requests)
+    assert _names(informer.list_objects(k8s, kind)) == ['a', 'b']
+    assert [r for r in fake_api.requests[lists:] if r.startswith('list')] == []
+
+
+def test_follows_changes(fake_api, k8s):
+    fake_api.add('deployments', NAMESPACE, 'web', {'app': 'web'})
+    fake_api.add('deployments', NAMESPACE, 'worker')
+    informer.list_objects(k8s, 'deployments')
+    fake_api.add('deployments', NAMESPACE, 'api')
+    fake_api.label('deployments', NAMESPACE, 'worker', {'app': 'web'})
+    fake_api.delete('deployments', NAMESPACE, 'web')
+    cached = _worker(k8s, 'deployments')
+    _wait_for(lambda: cached.resource_version == str(fake_api.resource_version))
+    assert _names(informer.list_objects(k8s, 'deployments')) == ['api', 'worker']
+    assert _names(informer.list_objects(k8s, 'deployments', 'app=web')) == ['worker']
+    assert cached.events == 3
+    assert cached.relists == 1
+
+
+def test_resumes_watch_after_timeout(fake_api, k8s, monkeypatch):
+    monkeypatch.setattr(informer, 'INFORMER_WATCH_TIMEOUT', 1)
+    informer.list_objects(k8s, 'pods')
+    cached = _worker(k8s, 'pods')
+    time.sleep(1.5)
+    fake_api.add('pods', NAMESPACE, 'late')
+    _wait_for(lambda: _names(cached.list()) == ['late'])
+    assert cached.relists == 1
+    assert sum(r.startswith('watch') for r in fake_api.requests) >= 2
+
+
+def test_bookmarks_move_the_resource_version(fake_api, k8s):
+    fake_api.add('deployments', NAMESPACE, 'web')
+    informer.list_objects(k8s, 'deployments')
+    cached = _worker(k8s, 'deployments')
+    for i in range(3):
+        fake_api.add('deployments', 'other-project', f'other-{i}')
+    _wait_for(lambda: cached.resource_version == str(fake_api.resource_version))
+    assert cached.events == 0
+    assert cached.errors == 0
+
+
+def test_lists_again_when_the_resource_version_is_gone(fake_api, k8s):
+    fake_api.add('deployments', NAMESPACE, 'web')
+    informer.list_objects(k8s, 'deployments')
+    cached = _worker(k8s, 'deployments')
+    fake_api.fail('watch', *[503] * 1000)
+    fake_api.end_watches()
+    _wait_for(lambda: cached.errors >= 1)
+    # the change is only in the list, the watch from the informer's resourceVersion gets 410 Gone
+    fake_api.add('deployments', NAMESPACE, 'api')
+    fake_api.compact()
+    fake_api.fail('watch')
+    _wait_for(lambda: cached.relists == 2)
+    assert _names(informer.list_objects(k8s, 'deployments')) == ['api', 'web']
+
+
+def test_failing_informer_is_not_served(fake_api, k8s, monkeypatch):
+    monkeypatch.setattr(informer, 'INFORMER_MAX_FAILURES', 2)
+    fake_api.add('cronjobs', NAMESPACE, 'nightly')
+    informer.list_objects(k8s, 'cronjobs')
+    cached = _worker(k8s, 'cronjobs')
+    fake_api.fail('watch', *[401] * 1000)
+    fake_api.end_watches()
+    _wait_for(lambda: not cached.healthy)
+    fake_api.add('cronjobs', NAMESPACE, 'hourly')
+    # the stale cache doesn't know the new job, the API does
+    assert _names(cached.list()) == ['nightly']
+    assert _names(informer.list_objects(k8s, 'cronjobs')) == ['hourly', 'nightly']
+    assert cached.status()['Healthy'] is False
+
+    fake_api.fail('watch')
+    _wait_for(lambda: cached.healthy)
+    _wait_for(lambda: _names(cached.list()) == ['hourly', 'nightly'])
+    assert cached.relists == 1